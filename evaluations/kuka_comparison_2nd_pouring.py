@@ -8,8 +8,9 @@ from examples.kuka_TamedPUMA import example_kuka_TamedPUMA
 from examples.kuka_PUMA_3D_ModulationIK import example_kuka_PUMA_modulationIK
 from texttable import Texttable
 import latextable
-import copy
+import copy, os
 import pickle
+from pumafabrics.tamed_puma.utils.latency_profiler import export_latency_json, table_latency
 from scipy import interpolate
 
 
@@ -19,7 +20,7 @@ class comparison_kuka_class():
         if results is None:
             self.results = {"min_distance": [], "collision": [], "goal_reached": [], "time_to_goal": [], "xee_list": [],
                    "qdot_diff_list": [],
-                   "dist_to_NN": [], "vel_to_NN": [], "solver_times": [], "solver_time": [], "solver_time_std": []}
+                   "dist_to_NN": [], "vel_to_NN": [], "solver_times": [], "solver_time": [], "solver_time_std": [], "latency": []}
         else:
             self.results = results
         self.n_runs = n_runs
@@ -58,13 +59,19 @@ class comparison_kuka_class():
     def run_i(self, example_class, case:str, q_init_list:list, results_PUMA=None, positions_obstacles_list=[], speed_obstacles_list=[], goal_pos_list=None, goal_vel_list=None):
         results_tot = copy.deepcopy(self.results)
         example_class.overwrite_defaults(params=example_class.params, render=False)
+        example_class.params["bool_profiler"] = True  # per-stage latencies, see export_latency_json
         for i_run in range(self.n_runs):
             if goal_pos_list is not None:
                 example_class.overwrite_defaults(params=example_class.params, goal_pos=goal_pos_list[i_run])
             if goal_vel_list is not None:
                 example_class.overwrite_defaults(params=example_class.params, goal_vel=goal_vel_list[i_run])
             example_class.overwrite_defaults(params=example_class.params, init_pos=q_init_list[i_run], positions_obstacles=positions_obstacles_list[i_run], speed_obstacles=speed_obstacles_list[i_run])
-            example_class.construct_example()
+            if i_run > 0 and hasattr(example_class, "reset"):
+                # keep the constructed planners and loaded policy, only reset the state of the example
+                example_class.reset(q_init=q_init_list[i_run], goal=example_class.params["goal_pos"],
+                                    obstacles=positions_obstacles_list[i_run])
+            else:
+                example_class.construct_example()
             results_i = example_class.run_kuka_example()
             if case == "Fabrics" and results_i["goal_reached"] == False:
                 print("i_run:", i_run)
@@ -74,7 +81,7 @@ class comparison_kuka_class():
                 distances, _, _ = self.distance_to_NN(results_PUMA["xee_list"][i_run], results_i["xee_list"])
             results_tot["dist_to_NN"].append(distances)
             for key in results_i:
-                results_tot[key].append(results_i[key])
+                results_tot.setdefault(key, []).append(results_i[key])
         return results_tot
 
     def KukaComparison(self, q_init_list:list, positions_obstacles_list:list, speed_obstacles_list:list, network_yaml: str, network_yaml_GOMP:str, nr_obst:int, goal_pos_list=None, goal_vel_list=None):
@@ -124,6 +131,7 @@ class comparison_kuka_class():
         self.results = {self.cases[0]: results_PUMA, self.cases[1]: results_PUMA_obst, self.cases[2]: results_IK, self.cases[3]: results_fabrics, self.cases[4]: results_FPM, self.cases[5]: results_CPM}
         with open("../pumafabrics/puma_extension/results/data_files/simulation_kuka_2nd"+network_yaml+".pkl", 'wb') as f:
             pickle.dump(self.results, f)
+        export_latency_json(self.results, self.cases, "../pumafabrics/puma_extension/results/data_files/latency_kuka_2nd"+network_yaml+".json")
         return self.results
 
     def KukaComparisonLoad(self):
@@ -253,4 +261,8 @@ if __name__ == "__main__":
 
     #plot the results:
     kuka_class.table_results(results)
+    latency_file = "../pumafabrics/puma_extension/results/data_files/latency_kuka_2nd"+network_yaml+".json"
+    if os.path.exists(latency_file):
+        print('\nTexttable Latex (latency):')
+        print(table_latency(latency_file))
 
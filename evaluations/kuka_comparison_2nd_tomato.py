@@ -10,6 +10,7 @@ from texttable import Texttable
 import latextable
 import copy, os
 import pickle
+from pumafabrics.tamed_puma.utils.latency_profiler import export_latency_json, table_latency
 from scipy.interpolate import interp1d
 from scipy import interpolate
 import matplotlib.pyplot as plt
@@ -20,7 +21,7 @@ class comparison_kuka_class():
         if results is None:
             self.results = {"min_distance": [], "collision": [], "goal_reached": [], "time_to_goal": [], "xee_list": [],
                    "qdot_diff_list": [],
-                   "dist_to_NN": [], "vel_to_NN": [], "solver_times": [], "solver_time": [], "solver_time_std": []}
+                   "dist_to_NN": [], "vel_to_NN": [], "solver_times": [], "solver_time": [], "solver_time_std": [], "latency": []}
         else:
             self.results = results
         self.n_runs = n_runs
@@ -107,6 +108,7 @@ class comparison_kuka_class():
               speed_obstacles_list=[], goal_pos_list=None, goal_vel_list=None, xee_demonstrations=None):
         results_tot = copy.deepcopy(self.results)
         example_class.overwrite_defaults(params=example_class.params, render=False)
+        example_class.params["bool_profiler"] = True  # per-stage latencies, see export_latency_json
         for i_run in range(self.n_runs):
             print("case: ", case, ", run_id: ", i_run)
             if goal_pos_list is not None:
@@ -114,7 +116,12 @@ class comparison_kuka_class():
             if goal_vel_list is not None:
                 example_class.overwrite_defaults(params=example_class.params, goal_vel=goal_vel_list[i_run])
             example_class.overwrite_defaults(params=example_class.params, init_pos=q_init_list[i_run], positions_obstacles=positions_obstacles_list[i_run], speed_obstacles=speed_obstacles_list[i_run])
-            example_class.construct_example()
+            if i_run > 0 and hasattr(example_class, "reset"):
+                # keep the constructed planners and loaded policy, only reset the state of the example
+                example_class.reset(q_init=q_init_list[i_run], goal=example_class.params["goal_pos"],
+                                    obstacles=positions_obstacles_list[i_run])
+            else:
+                example_class.construct_example()
             results_i = example_class.run_kuka_example()
             if xee_demonstrations == None:
                 if case == "Fabrics" and results_i["goal_reached"] == False:
@@ -131,7 +138,7 @@ class comparison_kuka_class():
                                                                  case=case)
             results_tot["dist_to_NN"].append(distances)
             for key in results_i:
-                results_tot[key].append(results_i[key])
+                results_tot.setdefault(key, []).append(results_i[key])
         return results_tot
 
     def KukaComparison(self, q_init_list:list, positions_obstacles_list:list, speed_obstacles_list:list,
@@ -185,6 +192,7 @@ class comparison_kuka_class():
         os.makedirs(os.path.dirname(filename), exist_ok=True)
         with open("../pumafabrics/puma_extension/results/data_files/simulation_kuka_2nd_"+network_yaml+".pkl", 'wb') as f:
             pickle.dump(self.results, f)
+        export_latency_json(self.results, self.cases, "../pumafabrics/puma_extension/results/data_files/latency_kuka_2nd_"+network_yaml+".json")
         return self.results
 
     def KukaComparisonLoad(self):
@@ -314,4 +322,8 @@ if __name__ == "__main__":
 
     #plot the results:
     kuka_class.table_results(results)
+    latency_file = "../pumafabrics/puma_extension/results/data_files/latency_kuka_2nd_"+network_yaml+".json"
+    if os.path.exists(latency_file):
+        print('\nTexttable Latex (latency):')
+        print(table_latency(latency_file))
 
@@ -10,7 +10,7 @@ class obtain_total_results():
         self.cases = ["PUMA$_free$", "PUMA$_obst$",  "Occlusion-IK", "Fabrics", "FPM", "CPM"]
         self.results_tot = {"PUMA$_free$": {"solver_times":[]}, "PUMA$_obst$": {"solver_times":[]},  "Occlusion-IK": {"solver_times":[]}, "Fabrics": {"solver_times":[]}, "FPM": {"solver_times":[]}, "CPM": {"solver_times":[]}}
         self.results = {"min_distance": [], "collision": [], "goal_reached": [], "time_to_goal": [], "xee_list": [], "qdot_diff_list": [],
-           "dist_to_NN": [],  "vel_to_NN": [], "solver_times": [], "solver_time": [], "solver_time_std": []}
+           "dist_to_NN": [],  "vel_to_NN": [], "solver_times": [], "solver_time": [], "solver_time_std": [], "latency": []}
         self.kuka_class_tomato = comparison_kuka_class()
         self.kuka_class_pouring= comparison_kuka_class()
 
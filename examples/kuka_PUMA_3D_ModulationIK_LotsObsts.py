@@ -59,7 +59,8 @@ class example_kuka_modulation_IK_1000(ExampleGeneric):
         self.utils_analysis = UtilsAnalysis(forward_kinematics=self.forward_kinematics,
                                             collision_links=self.params["collision_links"],
                                             collision_radii=self.params["collision_radii"],
-                                            kinematics=self.kuka_kinematics)
+                                            kinematics=self.kuka_kinematics,
+                                            spatial_index=True)
 
         # Parameters
         if self.params["mode_NN"] == "1st":
@@ -65,6 +65,7 @@ class example_kuka_TamedPUMA(TamedPUMAExample):
                 self.time_to_goal = float("nan")
                 break
         self.env.close()
+        self.stop_async_puma()
 
         results = {
             "min_distance": self.utils_analysis.get_min_dist(),
@@ -76,7 +77,10 @@ class example_kuka_TamedPUMA(TamedPUMAExample):
             "solver_times": np.array(self.solver_times)*1000,
             "solver_time": np.mean(self.solver_times),
             "solver_time_std": np.std(self.solver_times),
+            "latency": self.profiler.summary(),
         }
+        if self.async_puma is not None:
+            results["async_puma"] = self.async_puma.metrics()
         return results
 
 def main(render=True, n_steps=None):
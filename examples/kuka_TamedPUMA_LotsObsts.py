@@ -8,9 +8,11 @@ from pumafabrics.tamed_puma.create_environment.environments import trial_environ
 from pumafabrics.tamed_puma.kinematics.kinematics_kuka import KinematicsKuka
 from pumafabrics.tamed_puma.tamedpuma.energy_regulator import energy_regulation
 from pumafabrics.tamed_puma.tamedpuma.puma_controller import PUMAControl
+from pumafabrics.tamed_puma.tamedpuma.obstacle_culling import ObstacleCulling
 from pumafabrics.tamed_puma.nullspace_control.nullspace_controller import CartesianImpedanceController
 from pumafabrics.tamed_puma.utils.analysis_utils import UtilsAnalysis
 from pumafabrics.tamed_puma.utils.filters import PDController
+from pumafabrics.tamed_puma.utils.latency_profiler import LatencyProfiler
 from pumafabrics.tamed_puma.tamedpuma.example_generic import ExampleGeneric
 import copy
 import time
@@ -74,7 +76,17 @@ class example_kuka_TamedPUMA_1000(ExampleGeneric):
 
     def compute_action_fabrics(self, q, ob_robot):
         nr_obst = self.params["nr_obst"]
-        if nr_obst>19:
+        if self.obstacle_culling is not None:
+            # only the nearest obstacles of the collision links are passed to the planner
+            x_obsts, radius_obsts = self.obstacle_culling.select(q, obstacles=list(ob_robot['FullSensor']['obstacles'].values()))
+            arguments_dict = dict(
+                q=q,
+                qdot=ob_robot["joint_state"]["velocity"],
+                x_obsts=list(x_obsts),
+                radius_obsts=[radius_obsts[i:i+1] for i in range(nr_obst)],
+                radius_body_links=self.params["collision_radii"],
+                constraint_0=np.array([0, 0, 1, 0.0]))
+        elif nr_obst>19:
             x_obsts = [[10, 10, 10] for i in range(nr_obst)]
             x_obsts[0] = list(ob_robot['FullSensor']['obstacles'][2]['position'])
             x_obsts[1] = list(ob_robot['FullSensor']['obstacles'][3]['position'])
@@ -111,14 +123,27 @@ class example_kuka_TamedPUMA_1000(ExampleGeneric):
 
     def construct_example(self):
         self.initialize_environment()
+        self.obstacle_culling = None
+        if self.params.get("bool_obstacle_culling", False):
+            # planner with a few obstacle slots, filled by the nearest obstacles of the scene
+            self.params["nr_obst"] = self.params.get("culling_slots", 4)
         self.planner_avoidance, self.fk = self.set_planner(goal=None)
+        if self.params.get("bool_obstacle_culling", False):
+            self.obstacle_culling = ObstacleCulling(forward_kinematics=self.forward_kinematics,
+                                                    collision_links=self.params["collision_links"],
+                                                    collision_radii=self.params["collision_radii"],
+                                                    n_slots=self.params["nr_obst"],
+                                                    k_per_link=self.params.get("culling_k_per_link", 2),
+                                                    parent_link=self.params["root_link"])
         self.kuka_kinematics = KinematicsKuka(dt=self.params["dt"], end_link_name=self.params["end_links"][0], robot_name=self.params["robot_name"])
         self.utils_analysis = UtilsAnalysis(forward_kinematics=self.forward_kinematics,
                                             collision_links=self.params["collision_links"],
                                             collision_radii=self.params["collision_radii"],
-                                            kinematics=self.kuka_kinematics)
+                                            kinematics=self.kuka_kinematics,
+                                            spatial_index=True)
         self.pdcontroller = PDController(Kp=1.0, Kd=0.1, dt=self.params["dt"])
-        self.puma_controller = PUMAControl(params=self.params, kinematics=self.kuka_kinematics)
+        self.profiler = LatencyProfiler(deadlines={"total": self.params["dt"]}, enabled=self.params.get("bool_profiler", False))
+        self.puma_controller = PUMAControl(params=self.params, kinematics=self.kuka_kinematics, profiler=self.profiler)
         self.controller_nullspace = CartesianImpedanceController(robot_name=self.params["robot_name"])
 
     def run_kuka_example(self):
@@ -137,7 +162,8 @@ class example_kuka_TamedPUMA_1000(ExampleGeneric):
 
         # energization:
         energy_regulation_class = energy_regulation(dim_task=7, mode_NN=self.params["mode_NN"], dof=dof, dynamical_system=dynamical_system)
-        energy_regulation_class.relationship_dq_dx(offset_orientation, translation_cpu, self.kuka_kinematics, normalizations, self.fk)
+        energy_regulation_class.relationship_dq_dx_parametrized(offset_orientation, translation_cpu, self.kuka_kinematics, normalizations, self.fk,
+                                                                file_name=self.params.get("dxdq_function_file", None))
 
         # Initialize lists
         xee_list = []
@@ -155,7 +181,9 @@ class example_kuka_TamedPUMA_1000(ExampleGeneric):
                 self.obstacles = []
 
             # --- end-effector states and normalized states --- #
-            x_t, xee_orientation, _ = self.kuka_kinematics.get_state_task(q, quat_prev, mode_NN=self.params["mode_NN"], qdot=qdot)
+            time_tick = time.perf_counter()
+            with self.profiler.span("fk"):
+                x_t, xee_orientation, _ = self.kuka_kinematics.get_state_task(q, quat_prev, mode_NN=self.params["mode_NN"], qdot=qdot)
             quat_prev = copy.deepcopy(xee_orientation)
 
             # --- action by NN --- #
@@ -169,15 +197,17 @@ class example_kuka_TamedPUMA_1000(ExampleGeneric):
                                                                                 )
             if self.params["bool_combined"] == True:
                 # ----- Fabrics action ----#
-                action_avoidance, M_avoidance, f_avoidance, qddot_speed = self.compute_action_fabrics(q=q, ob_robot=ob_robot)
+                with self.profiler.span("fabrics"):
+                    action_avoidance, M_avoidance, f_avoidance, qddot_speed = self.compute_action_fabrics(q=q, ob_robot=ob_robot)
 
                 if self.params["bool_energy_regulator"] == True:
                     # ---- get action by CPM via theorem III.5 in https://arxiv.org/pdf/2309.07368.pdf ---#
-                    action_combined = energy_regulation_class.compute_action_theorem_III5(q=q, qdot=qdot,
-                                                                                          qddot_attractor = qddot_PUMA,
-                                                                                          action_avoidance=action_avoidance,
-                                                                                          M_avoidance=M_avoidance,
-                                                                                          transition_info=transition_info)
+                    with self.profiler.span("energy_regulation"):
+                        action_combined = energy_regulation_class.compute_action_theorem_III5(q=q, qdot=qdot,
+                                                                                              qddot_attractor = qddot_PUMA,
+                                                                                              action_avoidance=action_avoidance,
+                                                                                              M_avoidance=M_avoidance,
+                                                                                              transition_info=transition_info)
                 else:
                     # --- get action by FPM, sum of dissipative systems ---#
                     action_combined = qddot_PUMA + action_avoidance
@@ -193,13 +223,15 @@ class example_kuka_TamedPUMA_1000(ExampleGeneric):
             else:
                 action = action_combined
             self.solver_times.append(time.perf_counter() - time0)
+            self.profiler.record("total", time.perf_counter() - time_tick)
             ob, *_ = self.env.step(action)
 
             # result analysis:
             x_ee, _ = self.utils_analysis._request_ee_state(q, quat_prev)
             xee_list.append(x_ee[0])
             qdot_diff_list.append(np.mean(np.absolute(qddot_PUMA   - action_combined)))
-            self.IN_COLLISION = self.utils_analysis.check_distance_collision(q=q, obstacles=self.obstacles)
+            with self.profiler.span("collision_check"):
+                self.IN_COLLISION = self.utils_analysis.check_distance_collision(q=q, obstacles=self.obstacles)
             self.GOAL_REACHED, error = self.utils_analysis.check_goal_reaching(q, quat_prev, x_goal=goal_pos)
             if self.GOAL_REACHED:
                 self.time_to_goal = w*self.params["dt"]
@@ -220,10 +252,11 @@ class example_kuka_TamedPUMA_1000(ExampleGeneric):
             "solver_times": self.solver_times,
             "solver_time": np.mean(self.solver_times),
             "solver_time_std": np.std(self.solver_times),
+            "latency": self.profiler.summary(),
         }
         return results
 
-def main(render=True, n_steps=None):
+def main(render=True, n_steps=None, obstacle_culling=False):
     q_init_list = [
         np.array((0.531, 1.16, 0.070, -1.665, 0.294, -1.2, -0.242)),
     ]
@@ -233,6 +266,7 @@ def main(render=True, n_steps=None):
     example_class = example_kuka_TamedPUMA_1000()
     example_class.overwrite_defaults(params=example_class.params, init_pos=q_init_list[0], positions_obstacles=positions_obstacles_list[0],
                                      render=render, nr_obst=100, n_steps=n_steps)
+    example_class.params["bool_obstacle_culling"] = obstacle_culling
     # Note: the number of obstacles is set to a 100 here and overwritten to 1000 later, to avoid generating 1000 obstacles in Pybullet, but still considering 1000 obstacles in the controller.
     example_class.construct_example()
     res = example_class.run_kuka_example()
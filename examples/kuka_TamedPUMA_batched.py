@@ -0,0 +1,76 @@
+import numpy as np
+import time
+from pumafabrics.tamed_puma.examples_helpers.TamedPUMA import TamedPUMAExample
+from pumafabrics.tamed_puma.examples_helpers.TamedPUMA_batched import TamedPUMAbatchedExample
+"""
+Example of N KUKA iiwa 14 robots (or rollouts) controlled by one batched TamedPUMA controller.
+The joint states are integrated kinematically (no simulator), and the actions are compared with
+N separate single-robot TamedPUMA controllers.
+energy_regulator: combination by CPM (True) or FPM (False), None keeps the setting of the yaml file.
+"""
+
+def main(render=False, n_steps=None, n_robots=4, compare_single=True, energy_regulator=None):
+    network_yaml = "kuka_TamedPUMA_tomato"
+    batched_example = TamedPUMAbatchedExample(file_name=network_yaml, n_robots=n_robots)
+    params = batched_example.params
+    if energy_regulator is not None:
+        params["bool_energy_regulator"] = energy_regulator
+    if n_steps is None:
+        n_steps = 200
+    dof = params["dof"]
+    dt = params["dt"]
+
+    # --- different initial configurations, same goal and obstacles --- #
+    np.random.seed(0)
+    q_init = np.array(params["init_pos"]) + 0.1 * np.random.uniform(-1, 1, size=(n_robots, dof))
+    goal_pos = np.array(params["goal_pos"])
+    obstacles = [{"position": np.array(position), "size": np.array([0.1])} for position in params["positions_obstacles"]]
+
+    batched_example.construct_example()
+    batched_example.initialize_example(q_init)
+    if compare_single:
+        single_examples = []
+        for i in range(n_robots):
+            single_example = TamedPUMAExample(file_name=network_yaml)
+            single_example.params["bool_energy_regulator"] = params["bool_energy_regulator"]
+            single_example.construct_example()
+            single_example.initialize_example(q_init[i])
+            single_examples.append(single_example)
+
+    q = q_init.copy()
+    qdot = np.zeros((n_robots, dof))
+    max_difference = 0.
+    times_single = []
+    for w in range(n_steps):
+        runtime_arguments = {"q": q, "qdot": qdot, "goal_pos": goal_pos, "obstacles": obstacles}
+        action, goal_reached, errors, in_collision, _, _ = batched_example.run(runtime_arguments)
+
+        if compare_single:
+            time0 = time.perf_counter()
+            for i in range(n_robots):
+                runtime_arguments_i = {"q": q[i], "qdot": qdot[i], "goal_pos": goal_pos, "obstacles": obstacles}
+                action_i, *_ = single_examples[i].run(runtime_arguments_i)
+                max_difference = max(max_difference, np.max(np.abs(action_i - action[i])))
+            times_single.append(time.perf_counter() - time0)
+
+        # --- kinematic integration --- #
+        if params["mode_env"] == "vel":
+            qdot = action
+        else:
+            qdot = qdot + action * dt
+        q = q + qdot * dt
+        if np.all(goal_reached) or np.any(in_collision):
+            break
+
+    print(" -------------------- results -----------------------")
+    print("goal reached:", goal_reached, "errors:", errors)
+    print("collision occurred:", in_collision)
+    print("batched solver time [ms]: mean: ", np.mean(batched_example.solver_times)*1000, " , std: ", np.std(batched_example.solver_times)*1000)
+    if compare_single:
+        print("%i single controllers, total time [ms]: mean: " % n_robots, np.mean(times_single)*1000)
+        print("max difference batched vs single actions:", max_difference)
+        return {"max_difference": max_difference}
+    return {}
+
+if __name__ == "__main__":
+    main()
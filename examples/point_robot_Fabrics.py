@@ -88,8 +88,6 @@ class example_point_robot_fabrics():
 
         # (env, goal) = initalize_environment(render, mode=mode, dt=dt, init_pos=init_pos, goal_pos=goal_pos)
         planner = self.set_planner(goal, bool_speed_control=True, mode=mode, dt=dt)
-        planner_goal = self.set_planner(goal=goal, ONLY_GOAL=True, bool_speed_control=True, mode=mode, dt=dt)
-        planner_avoidance = self.set_planner(goal=None, bool_speed_control=True, mode=mode, dt=dt)
 
         # create class for combined functions on fabrics + safeMP combination
         v_min = -50*np.ones((dof,))
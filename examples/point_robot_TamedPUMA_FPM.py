@@ -98,9 +98,8 @@ class example_point_robot_TamedPUMA_FPM():
         else:
             print("this control mode is not defined")
 
+        # one planner, the full, attractor and avoidance geometries are evaluated together by compute_M_f_action_groups
         planner = self.set_planner(goal, bool_speed_control=True, mode=mode, dt=dt)
-        planner_goal = self.set_planner(goal=goal, ONLY_GOAL=True, bool_speed_control=True, mode=mode, dt=dt)
-        planner_avoidance = self.set_planner(goal=None, bool_speed_control=True, mode=mode, dt=dt)
 
         # create class for combined functions on fabrics + safeMP combination
         v_min = -50*np.ones((dof,))
@@ -134,7 +133,7 @@ class example_point_robot_TamedPUMA_FPM():
         normalizations = normalization_functions(x_min=self.params["x_min"], x_max=self.params["x_max"], dt=dt, mode_NN=mode_NN, learner=learner)
         goal_normalized = np.array((goal._sub_goals[0]._config["desired_position"]))/scaling_factor
         translation = normalizations.get_translation(goal_pos=goal_normalized, goal_pos_NN=goal_NN)
-        translation_gpu = torch.FloatTensor(translation).cuda()
+        translation_gpu = torch.FloatTensor(translation).to(learner.device)
 
         # Initialize dynamical system
         min_vel = learner.min_vel
@@ -190,10 +189,9 @@ class example_point_robot_TamedPUMA_FPM():
                 radius_obst_1=ob_robot['FullSensor']['obstacles'][4]['size'],
                 radius_body_base_link_y=np.array([0.2])
             )
-            action_fabrics[0:dof] = planner.compute_action(**arguments_dict)
-            M, f, action_forced, xddot_speed = planner.compute_M_f_action_avoidance(**arguments_dict)
-            M_avoidance, f_avoidance, action_avoidance, xddot_speed_avoidance = planner_avoidance.compute_M_f_action_avoidance(**arguments_dict)
-            M_attractor, f_attractor, action_attractor, xddot_speed_attractor = planner_goal.compute_M_f_action_attractor(**arguments_dict)
+            action_fabrics[0:dof], geometry_groups = planner.compute_M_f_action_groups(**arguments_dict)
+            M_avoidance, f_avoidance, action_avoidance, xddot_speed = geometry_groups["avoidance"]
+            M_attractor, f_attractor, action_attractor, xddot_speed_attractor = geometry_groups["attractor"]
 
             action_combined = combined_geometry.combine_action(M_avoidance, M_attractor, f_avoidance, f_attractor, xddot_speed, planner,
                                              qdot=ob_robot["joint_state"]["velocity"][0:dof])
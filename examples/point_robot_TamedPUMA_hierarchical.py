@@ -5,6 +5,7 @@ from forwardkinematics.urdfFks.generic_urdf_fk import GenericURDFFk
 from mpscenes.goals.goal_composition import GoalComposition
 
 from pumafabrics.tamed_puma.tamedpuma.parametrized_planner_extended import ParameterizedFabricPlannerExtended
+from pumafabrics.tamed_puma.tamedpuma.combining_actions import solve_metric
 from pumafabrics.puma_extension.tools.animation import TrajectoryPlotter
 import torch
 import matplotlib.pyplot as plt
@@ -77,7 +78,7 @@ class example_point_robot_hierarchical():
 
 
     def combine_action(self, M_avoidance, M_attractor, f_avoidance, f_attractor, xddot_speed, planner, qdot = []):
-        xddot_combined = -np.dot(planner.Minv(M_avoidance + M_attractor), f_avoidance + f_attractor) + xddot_speed
+        xddot_combined = -solve_metric(M_avoidance + M_attractor, f_avoidance + f_attractor) + xddot_speed
         if planner._mode == "vel":
             action_combined = qdot + planner._time_step * xddot_combined
         else:
@@ -128,7 +129,7 @@ class example_point_robot_hierarchical():
         state_goal = np.array((goal._sub_goals[0]._config["desired_position"]))
         goal_normalized = normalizations.call_normalize_state(state=state_goal)
         translation = normalizations.get_translation(goal_pos=goal_normalized, goal_pos_NN=goal_NN)
-        translation_gpu = torch.FloatTensor(translation).cuda()
+        translation_gpu = torch.FloatTensor(translation).to(learner.device)
 
         # Initialize dynamical system
         min_vel = learner.min_vel
@@ -41,6 +41,21 @@ def test_kuka_TamedPUMA():
     from examples.kuka_TamedPUMA import main
     blueprint_test(main)
 
+def test_kuka_TamedPUMA_batched():
+    from examples.kuka_TamedPUMA_batched import main
+    blueprint_test(main)
+
+@pytest.mark.parametrize("energy_regulator", [True, False])
+def test_kuka_TamedPUMA_batched_parity(energy_regulator):
+    """
+    The batched controller gives the actions of separate single-robot controllers (CPM and FPM).
+    """
+    from examples.kuka_TamedPUMA_batched import main
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore")
+        history = main(render=False, n_steps=20, n_robots=3, compare_single=True, energy_regulator=energy_regulator)
+    assert history["max_difference"] < 1e-5
+
 def test_kinova_TamedPUMA_3D_hierarchical():
     from examples.kinova_TamedPUMA_3D_hierarchical import main
     blueprint_test(main)
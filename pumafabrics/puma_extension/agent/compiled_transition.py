@@ -0,0 +1,142 @@
+import os
+import warnings
+import torch
+from pumafabrics.puma_extension.agent.dynamical_system import DynamicalSystem
+
+
+class TransitionStep(torch.nn.Module):
+    """
+    One dynamical system transition (encoder, decoder_dx, denormalization and integration) as a module, so it can be
+    traced into a single graph. The primitive encoding, space, order and limits are fixed at construction.
+    """
+    def __init__(self, dynamical_system):
+        super(TransitionStep, self).__init__()
+        self.model = dynamical_system.model
+        self.dynamical_system = dynamical_system
+        self.order = dynamical_system.order
+
+        # Primitive encoding of the dynamical system, computed once instead of at every transition
+        primitive_type = dynamical_system.primitive_type[:1].to(self.model.device)
+        if primitive_type.ndim == 1:
+            encoding = self.model.get_encoding_batch(primitive_type)
+        else:
+            encoding = primitive_type
+        self.register_buffer('encoding', encoding.detach().clone())
+
+    def forward(self, x_t):
+        encoding = self.encoding.expand(x_t.shape[0], -1)
+        y_t = self.model.encoder(x_t, encoding)
+        dx_t_d = self.dynamical_system.map_to_derivative(y_t)
+        if self.order == 1:
+            x_t_d, vel_t_d = self.dynamical_system.integrate_1st_order(x_t, dx_t_d)
+            return x_t_d, vel_t_d, y_t
+        else:
+            x_t_d, vel_t_d, acc_t_d = self.dynamical_system.integrate_2nd_order(x_t, dx_t_d)
+            return x_t_d, vel_t_d, acc_t_d, y_t
+
+
+def export_compiled_transition(dynamical_system, file_path, formats=('torchscript', 'onnx')):
+    """
+    Traces one transition of the dynamical system and saves it as TorchScript (file_path + '.pt') and/or
+    ONNX (file_path + '.onnx')
+    """
+    transition_step = TransitionStep(dynamical_system).eval()
+    x_t_example = dynamical_system.x_t_d[:1].detach().clone().to(dynamical_system.device)
+    if dynamical_system.order == 1:
+        output_names = ['desired state', 'desired velocity', 'latent state']
+    else:
+        output_names = ['desired state', 'desired velocity', 'desired acceleration', 'latent state']
+
+    with torch.no_grad():
+        if 'torchscript' in formats:
+            traced_transition = torch.jit.trace(transition_step, x_t_example, check_trace=False)
+            torch.jit.save(traced_transition, file_path + '.pt')
+        if 'onnx' in formats:
+            torch.onnx.export(transition_step, (x_t_example,), file_path + '.onnx',
+                              input_names=['state'],
+                              output_names=output_names,
+                              dynamic_axes={name: {0: 'batch'} for name in ['state'] + output_names})
+
+
+class CompiledDynamicalSystem:
+    """
+    Dynamical system whose transitions run through an exported TorchScript or ONNX graph. Everything else (model,
+    potentials, obstacle avoidance transitions) is delegated to the eager dynamical system.
+    """
+    def __init__(self, dynamical_system, file_path, backend='torchscript'):
+        self.dynamical_system = dynamical_system
+        self.backend = backend
+        if backend == 'torchscript':
+            self.transition_step = torch.jit.load(file_path + '.pt', map_location=dynamical_system.device)
+            self.transition_step = torch.jit.optimize_for_inference(torch.jit.freeze(self.transition_step.eval()))
+        elif backend == 'onnx':
+            import onnxruntime  # optional dependency, only needed for the onnx backend
+            if dynamical_system.device.type == 'cuda':
+                providers = ['CUDAExecutionProvider', 'CPUExecutionProvider']
+            else:
+                providers = ['CPUExecutionProvider']
+            self.transition_step = onnxruntime.InferenceSession(file_path + '.onnx', providers=providers)
+        else:
+            raise ValueError('Selected backend not valid, options: torchscript, onnx.')
+
+    def __getattr__(self, name):
+        return getattr(self.dynamical_system, name)
+
+    def transition(self, x_t=None, **kwargs):
+        """
+        Computes dynamical system one-step transition with the compiled graph
+        """
+        if 'obstacles' in kwargs:  # obstacle modulation is not part of the exported graph
+            return self.dynamical_system.transition(x_t=x_t, **kwargs)
+
+        if x_t is None:
+            x_t = self.dynamical_system.x_t_d
+
+        if self.backend == 'torchscript':
+            with torch.no_grad():
+                outputs = self.transition_step(x_t.to(self.dynamical_system.device))
+        else:
+            outputs = self.transition_step.run(None, {'state': x_t.detach().cpu().numpy().astype('float32')})
+            outputs = [torch.from_numpy(output).to(self.dynamical_system.device) for output in outputs]
+
+        if self.dynamical_system.order == 1:
+            x_t_d, vel_t_d, y_t = outputs
+            acc_t_d = None
+        else:
+            x_t_d, vel_t_d, acc_t_d, y_t = outputs
+
+        # Keep the eager dynamical system state in sync
+        self.dynamical_system.x_t_d = x_t_d
+        self.dynamical_system.y_t = y_t
+
+        transition_info = {'desired state': x_t_d,
+                           'desired velocity': vel_t_d,
+                           'desired acceleration': acc_t_d,
+                           'latent state': y_t}
+        return transition_info
+
+    # same rollout as the eager dynamical system, but through the compiled transition
+    rollout = DynamicalSystem.rollout
+
+
+def load_compiled_dynamical_system(dynamical_system, file_path, backend='torchscript', reference_path=None):
+    """
+    Wraps the dynamical system with its compiled transition. Both artifacts (TorchScript and ONNX) are exported first
+    if one of them does not exist (yet) or is older than the reference file (e.g., the model weights).
+    If only the export of the artifact of the other backend fails (e.g., onnx not installed), a warning is given.
+    """
+    extensions = {'torchscript': '.pt', 'onnx': '.onnx'}
+    if backend not in extensions:
+        raise ValueError('Selected backend not valid, options: torchscript, onnx.')
+    outdated = [format for format, extension in extensions.items() if not os.path.exists(file_path + extension) or
+                (reference_path is not None and os.path.exists(reference_path) and
+                 os.path.getmtime(reference_path) > os.path.getmtime(file_path + extension))]
+    if outdated:
+        export_compiled_transition(dynamical_system, file_path, formats=(backend,))
+        for format in extensions:
+            if format != backend:
+                try:
+                    export_compiled_transition(dynamical_system, file_path, formats=(format,))
+                except Exception as error:
+                    warnings.warn('Export of the %s transition failed: %s' % (format, error))
+    return CompiledDynamicalSystem(dynamical_system, file_path, backend=backend)
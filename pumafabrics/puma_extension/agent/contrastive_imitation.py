@@ -5,6 +5,7 @@ from pumafabrics.puma_extension.agent.neural_network import NeuralNetwork
 from pumafabrics.puma_extension.agent.utils.ranking_losses import TripletLoss, TripletAngleLoss, TripletCosineLoss, SoftTripletLoss, TripletAngleLossSquared
 from pumafabrics.puma_extension.agent.dynamical_system import DynamicalSystem
 from pumafabrics.puma_extension.agent.utils.dynamical_system_operations import normalize_state
+from pumafabrics.puma_extension.agent.utils.device_operations import get_device
 import os
 
 class ContrastiveImitation:
@@ -31,20 +32,23 @@ class ContrastiveImitation:
         self.load_model = params.load_model
         self.results_path = params.results_path
         self.interpolation_sigma = params.interpolation_sigma
+        self.latent_space_dim = params.latent_space_dim
+        self.neurons_hidden_layers = params.neurons_hidden_layers
         self.delta_t = 1  # used for training, can be anything
+        self.device = get_device(getattr(params, 'device', None))  # cuda if available and not specified
 
         # Parameters data processor
         self.primitive_ids = np.array(data['demonstrations primitive id'])
         self.n_primitives = data['n primitives']
-        self.goals_tensor = torch.FloatTensor(data['goals training']).cuda()
+        self.goals_tensor = torch.FloatTensor(data['goals training']).to(self.device)
         self.demonstrations_train = data['demonstrations train']
         self.n_demonstrations = data['n demonstrations']
         self.demonstrations_length = data['demonstrations length']
-        self.min_vel = torch.from_numpy(data['vel min train'].reshape([1, self.dim_space])).float().cuda()
-        self.max_vel = torch.from_numpy(data['vel max train'].reshape([1, self.dim_space])).float().cuda()
+        self.min_vel = torch.from_numpy(data['vel min train'].reshape([1, self.dim_space])).float().to(self.device)
+        self.max_vel = torch.from_numpy(data['vel max train'].reshape([1, self.dim_space])).float().to(self.device)
         if data['acc min train'] is not None:
-            min_acc = torch.from_numpy(data['acc min train'].reshape([1, self.dim_space])).float().cuda()
-            max_acc = torch.from_numpy(data['acc max train'].reshape([1, self.dim_space])).float().cuda()
+            min_acc = torch.from_numpy(data['acc min train'].reshape([1, self.dim_space])).float().to(self.device)
+            max_acc = torch.from_numpy(data['acc max train'].reshape([1, self.dim_space])).float().to(self.device)
         else:
             min_acc = None
             max_acc = None
@@ -79,8 +83,8 @@ class ContrastiveImitation:
                                    dynamical_system_order=self.dynamical_system_order,
                                    n_primitives=self.n_primitives,
                                    multi_motion=self.multi_motion,
-                                   latent_space_dim=params.latent_space_dim,
-                                   neurons_hidden_layers=params.neurons_hidden_layers).cuda()
+                                   latent_space_dim=self.latent_space_dim,
+                                   neurons_hidden_layers=self.neurons_hidden_layers).to(self.device)
 
         # Initialize optimizer
         self.optimizer = torch.optim.AdamW(self.model.parameters(),
@@ -90,10 +94,10 @@ class ContrastiveImitation:
         # Load Neural Network if requested
         if self.load_model:
             try:
-                self.model.load_state_dict(torch.load(self.results_path + 'model'), strict=False) #todo
+                self.model.load_state_dict(torch.load(self.results_path + 'model', map_location=self.device), strict=False) #todo
             except:
                 current_dir = os.path.dirname(os.path.abspath(__file__))
-                self.model.load_state_dict(torch.load(current_dir + self.results_path + 'model'), strict=False)
+                self.model.load_state_dict(torch.load(current_dir + self.results_path + 'model', map_location=self.device), strict=False)
         # Initialize latent goals
         self.model.update_goals_latent_space(self.goals_tensor)
 
@@ -140,7 +144,7 @@ class ContrastiveImitation:
             x_t_d = dynamical_system.transition()['desired state']
 
             # Compute and accumulate error
-            imitation_error_accumulated += self.mse_loss(x_t_d[:, :self.dim_manifold], state_sample[:, :self.dim_manifold, i + 1].cuda())
+            imitation_error_accumulated += self.mse_loss(x_t_d[:, :self.dim_manifold], state_sample[:, :self.dim_manifold, i + 1].to(self.device))
 
         imitation_error_accumulated = imitation_error_accumulated / (self.imitation_window_size - 1)
 
@@ -178,7 +182,7 @@ class ContrastiveImitation:
         limit_options = torch.FloatTensor([-1, 1])
         limits = limit_options[selected_limit]
         replaced_samples = torch.arange(start=0, end=self.batch_size)
-        state_sample[replaced_samples, selected_axis] = limits.cuda()
+        state_sample[replaced_samples, selected_axis] = limits.to(self.device)
 
         # Create dynamical systems
         self.params_dynamical_system['saturate transition'] = False
@@ -210,9 +214,9 @@ class ContrastiveImitation:
             dx_axis_lower = dx_t_d[distance_lower < epsilon]
 
             # Compute normal vectors for lower and upper limits
-            normal_upper = torch.zeros(dx_axis_upper.shape).cuda()
+            normal_upper = torch.zeros(dx_axis_upper.shape).to(self.device)
             normal_upper[:, i] = 1
-            normal_lower = torch.zeros(dx_axis_lower.shape).cuda()
+            normal_lower = torch.zeros(dx_axis_lower.shape).to(self.device)
             normal_lower[:, i] = -1
 
             # Compute dot product between boundary velocities and normal vectors
@@ -223,8 +227,8 @@ class ContrastiveImitation:
                                           normal_lower.view(-1, self.dim_space, 1)).reshape(-1)
 
             # Concat with zero in case no points sampled in boundaries, to avoid nans
-            dot_product_upper = torch.cat([dot_product_upper, torch.zeros(1).cuda()])
-            dot_product_lower = torch.cat([dot_product_lower, torch.zeros(1).cuda()])
+            dot_product_upper = torch.cat([dot_product_upper, torch.zeros(1).to(self.device)])
+            dot_product_lower = torch.cat([dot_product_lower, torch.zeros(1).to(self.device)])
 
             # Compute losses
             loss += F.relu(dot_product_upper).mean()
@@ -251,10 +255,10 @@ class ContrastiveImitation:
 
         # Get sampled positions from training data
         position_sample = self.demonstrations_train[selected_demos, i_samples]
-        position_sample = torch.FloatTensor(position_sample).cuda()
+        position_sample = torch.FloatTensor(position_sample).to(self.device)
 
         # Create empty state
-        state_sample = torch.empty([self.batch_size, self.dim_state, self.imitation_window_size]).cuda()
+        state_sample = torch.empty([self.batch_size, self.dim_state, self.imitation_window_size]).to(self.device)
 
         # Fill first elements of the state with position
         state_sample[:, :self.dim_space, :] = position_sample[:, :, (self.dynamical_system_order - 1):]
@@ -269,7 +273,7 @@ class ContrastiveImitation:
 
         # Finally, get primitive ids of sampled batch (necessary when multi-motion learning)
         primitive_type_sample = self.primitive_ids[selected_demos]
-        primitive_type_sample = torch.FloatTensor(primitive_type_sample).cuda()
+        primitive_type_sample = torch.FloatTensor(primitive_type_sample).to(self.device)
 
         return state_sample, primitive_type_sample
 
@@ -279,19 +283,19 @@ class ContrastiveImitation:
         """
         with torch.no_grad():
             # Sample state
-            state_sample_gen = torch.Tensor(self.batch_size, self.dim_state).uniform_(-1, 1).cuda()
+            state_sample_gen = torch.Tensor(self.batch_size, self.dim_state).uniform_(-1, 1).to(self.device)
 
             # Choose sampling methods
             if not self.multi_motion:
-                primitive_type_sample_gen = torch.randint(0, self.n_primitives, (self.batch_size,)).cuda()
+                primitive_type_sample_gen = torch.randint(0, self.n_primitives, (self.batch_size,)).to(self.device)
             else:
                 # If multi-motion learning also sample in interpolation space
                 # sigma of the samples are in the demonstration spaces
-                encodings = torch.eye(self.n_primitives).cuda()
-                primitive_type_sample_gen_demo = encodings[torch.randint(0, self.n_primitives, (round(self.batch_size * self.interpolation_sigma),)).cuda()]
+                encodings = torch.eye(self.n_primitives).to(self.device)
+                primitive_type_sample_gen_demo = encodings[torch.randint(0, self.n_primitives, (round(self.batch_size * self.interpolation_sigma),)).to(self.device)]
 
                 # 1 - sigma  of the samples are in the interpolation space
-                primitive_type_sample_gen_inter = torch.rand(round(self.batch_size * (1 - self.interpolation_sigma)), self.n_primitives).cuda()
+                primitive_type_sample_gen_inter = torch.rand(round(self.batch_size * (1 - self.interpolation_sigma)), self.n_primitives).to(self.device)
 
                 # Concatenate both samples
                 primitive_type_sample_gen = torch.cat((primitive_type_sample_gen_demo, primitive_type_sample_gen_inter), dim=0)
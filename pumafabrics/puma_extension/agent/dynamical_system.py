@@ -11,6 +11,7 @@ class DynamicalSystem():
                  model, dim_state, delta_t, x_min, x_max, radius):
         # Initialize NN model
         self.model = model
+        self.device = model.device
 
         # Initialize parameters
         self.space = space
@@ -30,6 +31,12 @@ class DynamicalSystem():
         self.x_min = np.array(x_min)
         self.x_max = np.array(x_max)
         self.radius = radius
+        self.reset(x_init)
+
+    def reset(self, x_init):
+        """
+        (Re)initializes the state of the dynamical system, the model and parameters are kept
+        """
         self.batch_size = x_init.shape[0]
 
         # Project points to sphere surface
@@ -248,6 +255,28 @@ class DynamicalSystem():
 
         return transition_info
 
+    def rollout(self, n_steps, x_t=None, stride=None, hold_velocity=False):
+        """
+        Integrates n_steps transitions on the device, without transfers in between.
+        Returns the transition info of the last step; if stride is given, every stride-th desired state is
+        included as 'rollout states' (n_steps // stride x batch_size x dim_state).
+        If hold_velocity (second order), only the position is propagated and the velocity of x_t is kept.
+        """
+        if x_t is None:
+            x_t = self.x_t_d
+        x_t_init = x_t
+        states = []
+        for step in range(n_steps):
+            transition_info = self.transition(x_t=x_t)
+            x_t = transition_info['desired state']
+            if hold_velocity and self.order == 2:
+                x_t = torch.cat([x_t[:, :self.dim_position], x_t_init[:, self.dim_position:]], dim=1)
+            if stride is not None and (step + 1) % stride == 0:
+                states.append(x_t)
+        if stride is not None:
+            transition_info['rollout states'] = torch.stack(states)
+        return transition_info
+
     def simulate(self, simulation_steps, **kwargs):
         """
         Simulates dynamical system
@@ -287,12 +316,12 @@ class DynamicalSystem():
             # Obstacles
             obs = torch.FloatTensor(normalize_state(np.array(obstacles['centers']),
                                                     x_min=self.x_min,
-                                                    x_max=self.x_max)).repeat(batch_size, 1, 1).cuda()
-            sf = torch.FloatTensor(obstacles['safety_margins']).repeat(batch_size, 1, 1).cuda()
+                                                    x_max=self.x_max)).repeat(batch_size, 1, 1).to(self.device)
+            sf = torch.FloatTensor(obstacles['safety_margins']).repeat(batch_size, 1, 1).to(self.device)
 
             a = torch.FloatTensor(get_derivative_normalized_state(np.array(obstacles['axes']),
                                                                   x_min=self.x_min,
-                                                                  x_max=self.x_max)).repeat(batch_size, 1, 1).cuda()
+                                                                  x_max=self.x_max)).repeat(batch_size, 1, 1).to(self.device)
 
             # Get modulation Ellipsoid
             x_ell = x_t - obs
@@ -306,21 +335,21 @@ class DynamicalSystem():
             # Get weights
             Gamma_k = Gamma.view(batch_size, n_obs, 1).repeat(1, 1, n_obs)
             Gamma_i = Gamma.repeat_interleave(repeats=n_obs, dim=1).view(batch_size, n_obs, n_obs).transpose(1, 2)
-            filter_i_eq_k = 1e30 * torch.eye(n_obs).repeat(batch_size, 1, 1).cuda() + torch.ones(n_obs).repeat(batch_size, 1, 1).cuda()  # Values to ignore when gamma i=k
+            filter_i_eq_k = 1e30 * torch.eye(n_obs, device=self.device).repeat(batch_size, 1, 1) + torch.ones(n_obs, device=self.device).repeat(batch_size, 1, 1)  # Values to ignore when gamma i=k
             Gamma_i = filter_i_eq_k * Gamma_i  # Apply filter
             w = torch.prod((Gamma_i - 1) / ((Gamma_k - 1) + (Gamma_i - 1)), dim=2)  # Compute w
 
             # Get basis matrix
             nv = (2 / a) * (x_ell / a)  # TODO: extend to p > 1
-            E = torch.zeros(batch_size, n_obs, self.dim_position, self.dim_position).cuda()
+            E = torch.zeros(batch_size, n_obs, self.dim_position, self.dim_position, device=self.device)
             E[:, :, :, 0] = nv
             E[:, :, 0, 1:self.dim_position] = nv[:, :, 1:self.dim_position]
 
-            I = torch.eye(self.dim_position-1).repeat(batch_size * n_obs, 1, 1).cuda()
+            I = torch.eye(self.dim_position-1, device=self.device).repeat(batch_size * n_obs, 1, 1)
             e_last = nv.view(batch_size * n_obs, self.dim_position)[:, 0].view(batch_size * n_obs, 1)[:, :, None]
             E[:, :, 1:self.dim_position, 1:self.dim_position] = (- I * e_last).view(batch_size, n_obs, self.dim_position-1, self.dim_position-1)
 
-            D = torch.zeros(batch_size, n_obs, self.dim_position, self.dim_position).cuda()
+            D = torch.zeros(batch_size, n_obs, self.dim_position, self.dim_position, device=self.device)
 
             D[:, :, 0, 0] = 1 - (w / Gamma)
 
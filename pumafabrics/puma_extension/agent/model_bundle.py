@@ -0,0 +1,163 @@
+import os
+import hashlib
+from dataclasses import fields
+import numpy as np
+import torch
+from pumafabrics.puma_extension.agent.neural_network import NeuralNetwork
+from pumafabrics.puma_extension.agent.dynamical_system import DynamicalSystem
+from pumafabrics.puma_extension.agent.utils.device_operations import get_device
+from pumafabrics.puma_extension.data_preprocessing.data_loader import get_dataset_primitives_names, select_primitives
+
+MODEL_BUNDLE_VERSION = 1
+
+# params fields that do not change the trained policy or its normalization
+BUNDLE_KEY_IGNORED_FIELDS = ('results_path', 'train', 'load_model', 'save_evaluation', 'show_plotly')
+
+
+def bundle_source_key(params):
+    """
+    Hash of what a model bundle is derived from: the model file, the fields of the params file and the demonstrations
+    of the selected primitives (the data files define the normalization boundaries and goals)
+    """
+    key = hashlib.sha256()
+    description = [(field.name, repr(getattr(params, field.name))) for field in fields(params)
+                   if field.name not in BUNDLE_KEY_IGNORED_FIELDS]
+    key.update(repr(description).encode())
+
+    # data files (as loaded by data_loader)
+    dataset_dir = os.path.dirname(os.path.abspath(__file__)) + '/../datasets/' + params.dataset_name + '/'
+    primitives_names, _ = select_primitives(get_dataset_primitives_names(params.dataset_name), params.selected_primitives_ids)
+    file_paths = {'model': params.results_path + 'model'}
+    if os.path.isdir(dataset_dir):
+        for file_name in sorted(os.listdir(dataset_dir)):
+            if any(file_name.startswith(name) for name in primitives_names):
+                path = dataset_dir + file_name
+                if os.path.isdir(path):
+                    for root, _, names in sorted(os.walk(path)):
+                        for name in sorted(names):
+                            file_paths[os.path.relpath(os.path.join(root, name), dataset_dir)] = os.path.join(root, name)
+                else:
+                    file_paths[file_name] = path
+    for label, path in file_paths.items():
+        key.update(label.encode())
+        if os.path.exists(path):
+            with open(path, 'rb') as file:
+                key.update(hashlib.sha256(file.read()).digest())
+    return key.hexdigest()[:16]
+
+
+def export_model_bundle(learner, file_path, source_key=None):
+    """
+    Saves the network weights together with all the metadata required to run the dynamical system (normalization
+    boundaries, goals, velocity/acceleration limits), so it can be used without the data preprocessor.
+    source_key (see bundle_source_key) identifies the model, params and data the bundle was exported from.
+    """
+    params_dynamical_system = learner.params_dynamical_system
+    bundle = {'version': MODEL_BUNDLE_VERSION,
+              'source key': source_key,
+              'network': {'dim_state': learner.dim_state,
+                          'dynamical_system_order': learner.dynamical_system_order,
+                          'n_primitives': learner.n_primitives,
+                          'multi_motion': learner.multi_motion,
+                          'latent_space_dim': learner.latent_space_dim,
+                          'neurons_hidden_layers': learner.neurons_hidden_layers},
+              'state dict': {key: value.cpu() for key, value in learner.model.state_dict().items()},
+              'space': learner.space,
+              'radius': None if learner.radius is None else float(learner.radius),
+              'saturate transition': params_dynamical_system['saturate transition'],
+              'x min': torch.as_tensor(np.array(params_dynamical_system['x min'], dtype=np.float64)),
+              'x max': torch.as_tensor(np.array(params_dynamical_system['x max'], dtype=np.float64)),
+              'goals training': learner.goals_tensor.cpu(),
+              'vel min train': learner.min_vel.cpu(),
+              'vel max train': learner.max_vel.cpu(),
+              'acc min train': None if params_dynamical_system['acc min train'] is None else params_dynamical_system['acc min train'].cpu(),
+              'acc max train': None if params_dynamical_system['acc max train'] is None else params_dynamical_system['acc max train'].cpu()}
+    torch.save(bundle, file_path)
+
+
+class ModelBundle:
+    """
+    Inference-only policy loaded from a model bundle, exposes the same interface as ContrastiveImitation for
+    creating dynamical systems
+    """
+    def __init__(self, file_path, device=None):
+        self.device = get_device(device)
+        bundle = torch.load(file_path, map_location='cpu', weights_only=True)
+        if bundle.get('version', None) != MODEL_BUNDLE_VERSION:
+            raise ValueError('Model bundle version %s not supported, expected %i. Export the bundle again.'
+                             % (bundle.get('version', None), MODEL_BUNDLE_VERSION))
+
+        self.source_key = bundle.get('source key', None)
+
+        # Network parameters
+        network = bundle['network']
+        self.dim_state = network['dim_state']
+        self.dynamical_system_order = network['dynamical_system_order']
+        self.n_primitives = network['n_primitives']
+        self.multi_motion = network['multi_motion']
+        self.latent_space_dim = network['latent_space_dim']
+        self.neurons_hidden_layers = network['neurons_hidden_layers']
+        self.space = bundle['space']
+        self.radius = bundle['radius']
+
+        # Data/normalization parameters
+        self.goals_tensor = bundle['goals training'].float().to(self.device)
+        self.min_vel = bundle['vel min train'].float().to(self.device)
+        self.max_vel = bundle['vel max train'].float().to(self.device)
+        min_acc = bundle['acc min train'].float().to(self.device) if bundle['acc min train'] is not None else None
+        max_acc = bundle['acc max train'].float().to(self.device) if bundle['acc max train'] is not None else None
+        self.data = {'x min': bundle['x min'].numpy(),
+                     'x max': bundle['x max'].numpy(),
+                     'goals training': bundle['goals training'].numpy(),
+                     'n primitives': self.n_primitives}
+        if self.radius is not None:
+            self.data['radius'] = self.radius
+
+        # Dynamical-system-only params
+        self.params_dynamical_system = {'saturate transition': bundle['saturate transition'],
+                                        'x min': self.data['x min'],
+                                        'x max': self.data['x max'],
+                                        'vel min train': self.min_vel,
+                                        'vel max train': self.max_vel,
+                                        'acc min train': min_acc,
+                                        'acc max train': max_acc}
+
+        # Initialize Neural Network
+        self.model = NeuralNetwork(dim_state=self.dim_state,
+                                   dynamical_system_order=self.dynamical_system_order,
+                                   n_primitives=self.n_primitives,
+                                   multi_motion=self.multi_motion,
+                                   latent_space_dim=self.latent_space_dim,
+                                   neurons_hidden_layers=self.neurons_hidden_layers).to(self.device)
+        self.model.load_state_dict(bundle['state dict'], strict=False)
+        self.model.eval()
+
+        # Initialize latent goals
+        self.model.update_goals_latent_space(self.goals_tensor)
+
+    def init_dynamical_system(self, initial_states, primitive_type=None, delta_t=1):
+        """
+        Creates dynamical system using the parameters/variables of the bundle
+        """
+        # If no primitive type, assume single-model learning
+        if primitive_type is None:
+            primitive_type = torch.FloatTensor([1])
+
+        # Create dynamical system
+        dynamical_system = DynamicalSystem(x_init=initial_states,
+                                           space=self.space,
+                                           model=self.model,
+                                           primitive_type=primitive_type,
+                                           order=self.dynamical_system_order,
+                                           min_state_derivative=[self.params_dynamical_system['vel min train'],
+                                                                 self.params_dynamical_system['acc min train']],
+                                           max_state_derivative=[self.params_dynamical_system['vel max train'],
+                                                                 self.params_dynamical_system['acc max train']],
+                                           saturate_transition=self.params_dynamical_system['saturate transition'],
+                                           dim_state=self.dim_state,
+                                           delta_t=delta_t,
+                                           x_min=self.params_dynamical_system['x min'],
+                                           x_max=self.params_dynamical_system['x max'],
+                                           radius=self.radius)
+
+        return dynamical_system
@@ -26,9 +26,15 @@ class NeuralNetwork(torch.nn.Module):
 
         # Initialize goals list
         self.goals_latent_space = list(np.zeros(n_primitives))
+        self.goals_latent_space_stacked = None  # (n_primitives + 1) x latent_space_dim, see stack_goals_latent_space
+        self.goals_latent_space_detached = None  # cache used by potential_and_gradient_from_encoder
+        self.primitive_index_cache = None  # (primitive_type, version, index) of the last call of get_primitive_index
 
-        # Primitives encodings
-        self.primitives_encodings = torch.eye(n_primitives).cuda()
+        # Primitives encodings (buffer, so it follows the model when moved to a device), with a row of zeros for ids
+        # without encoding
+        self.register_buffer('primitives_encodings', torch.eye(n_primitives), persistent=False)
+        self.register_buffer('primitives_encodings_padded', torch.cat([torch.eye(n_primitives), torch.zeros(1, n_primitives)]),
+                             persistent=False)
 
         # Initialize encoder layers: psi
         if multi_motion:
@@ -66,59 +72,91 @@ class NeuralNetwork(torch.nn.Module):
         self.norm_de_dx0_0 = torch.nn.LayerNorm(self.latent_space_dim)
         self.norm_de_dx0_1 = torch.nn.LayerNorm(self.latent_space_dim)
 
+    @property
+    def device(self):
+        """
+        Device on which the model is stored
+        """
+        return self.primitives_encodings.device
+
     def update_goals_latent_space(self, goals):
         """
         Maps task space goal to latent space goal
         """
         for i in range(self.n_primitives):
-            primitive_type = torch.FloatTensor([i]).cuda()
-            input = torch.zeros([1, self.n_input])  # add zeros as velocity goal for second order DS
+            primitive_type = torch.FloatTensor([i]).to(self.device)
+            input = torch.zeros([1, self.n_input], device=self.device)  # add zeros as velocity goal for second order DS
             input[:, :goals[i].shape[0]] = goals[i]
             self.goals_latent_space[i] = self.encoder(input, primitive_type)
+        self.goals_latent_space_stacked = self.stack_goals_latent_space(self.goals_latent_space)
+        self.goals_latent_space_detached = None
 
-    def get_goals_latent_space_batch(self, primitive_type):
+    def stack_goals_latent_space(self, goals_latent_space):
         """
-        Creates a batch with latent space goals computed in 'update_goals_latent_space'
+        Stacks the latent space goals of the primitives into one tensor, with a row of zeros for ids without goal
         """
-        goals_latent_space_batch = torch.zeros(primitive_type.shape[0], self.latent_space_dim).cuda()
-        if primitive_type.ndim > 1:  # TODO: ugly fix for multi case, fix
-            one_hot = torch.FloatTensor(np.identity(primitive_type.shape[1])).cuda()  # TODO: for ugly fix
-            one_hot = one_hot.reshape(1, primitive_type.shape[1], primitive_type.shape[1]).repeat(primitive_type.shape[0], 1, 1)
-        for i in range(self.n_primitives):
-            if primitive_type.ndim > 1:  # TODO: ugly fix for multi case, fix
-                mask = (primitive_type == one_hot[:, i])[:, 0]
-                goals_latent_space_batch[mask] = self.goals_latent_space[i]
-            else:
-                goals_latent_space_batch[primitive_type == i] = self.goals_latent_space[i]
+        goals = [torch.as_tensor(goal, dtype=torch.float32, device=self.device).reshape(1, -1).expand(1, self.latent_space_dim)
+                 for goal in goals_latent_space]
+        return torch.cat(goals + [torch.zeros(1, self.latent_space_dim, device=self.device)])
 
-        return goals_latent_space_batch
+    def get_primitive_index(self, primitive_type):
+        """
+        Row of each primitive id (or one-hot code) in the padded encodings and goals, ids that are not one of the
+        primitives (e.g. 1 for single-model learning) get the last row (zeros).
+        The index of the last primitive_type tensor is cached (e.g. that of a dynamical system at every transition),
+        except in inference mode: inference tensors have no version counter, and an index created in inference mode
+        cannot be used by autograd later.
+        """
+        use_cache = not (torch.is_inference_mode_enabled() or primitive_type.is_inference())
+        cache = self.primitive_index_cache
+        if use_cache and cache is not None and cache[0] is primitive_type and cache[1] == primitive_type._version:
+            return cache[2]
+        primitive_type_device = primitive_type.to(self.device)
+        if primitive_type.ndim > 1:  # one-hot codes
+            index = torch.argmax(primitive_type_device, dim=1)
+            valid = (primitive_type_device.sum(dim=1) == 1) & (primitive_type_device.gather(1, index[:, None])[:, 0] == 1)
+        else:
+            index = primitive_type_device.long()
+            valid = (index == primitive_type_device) & (index >= 0) & (index < self.n_primitives)
+        index = torch.where(valid, index, self.n_primitives)
+        if use_cache:
+            self.primitive_index_cache = (primitive_type, primitive_type._version, index)
+        return index
+
+    def get_goals_latent_space_batch(self, primitive_type, goals_latent_space=None):
+        """
+        Creates a batch with latent space goals computed in 'update_goals_latent_space', gathered from the stacked goals
+        (goals_latent_space: list of goals or stacked goals, default: the goals of the model)
+        """
+        if goals_latent_space is None:
+            if self.goals_latent_space_stacked is None:
+                self.goals_latent_space_stacked = self.stack_goals_latent_space(self.goals_latent_space)
+            goals_latent_space = self.goals_latent_space_stacked
+        elif not torch.is_tensor(goals_latent_space):
+            goals_latent_space = self.stack_goals_latent_space(goals_latent_space)
+        return goals_latent_space[self.get_primitive_index(primitive_type)]
 
     def get_encoding_batch(self, primitive_type):
         """
         When multi-model learning, encodes primitive id into one-hot code
         """
-        encoding_batch = torch.zeros(primitive_type.shape[0], self.n_primitives).cuda()
-        for i in range(self.n_primitives):
-            encoding_batch[primitive_type == i] = self.primitives_encodings[i]
-
-        return encoding_batch
+        return self.primitives_encodings_padded[self.get_primitive_index(primitive_type)]
 
     def encoder(self, x_t, primitive_type):
         """
         Maps task space state to latent space state (psi)
         """
-        # Get batch encodings
-        if primitive_type.ndim == 1:  # if primitive type needs to be encoded
-            encoding = self.get_encoding_batch(primitive_type)
-        else:  # we assume the code is ready
-            encoding = primitive_type
-
         # Encoder layer 1
         if self.multi_motion:
-            input_encoded = torch.cat((x_t.cuda(), encoding), dim=1)
+            # Get batch encodings
+            if primitive_type.ndim == 1:  # if primitive type needs to be encoded
+                encoding = self.get_encoding_batch(primitive_type)
+            else:  # we assume the code is ready
+                encoding = primitive_type
+            input_encoded = torch.cat((x_t.to(self.device), encoding), dim=1)
             e_1 = self.activation(self.norm_e_1(self.encoder1(input_encoded)))
         else:
-            e_1 = self.activation(self.norm_e_1(self.encoder1(x_t.cuda())))
+            e_1 = self.activation(self.norm_e_1(self.encoder1(x_t.to(self.device))))
 
         # Encoder layer 2
         e_2 = self.activation(self.norm_e_2(self.encoder2(e_1)))
@@ -128,15 +166,38 @@ class NeuralNetwork(torch.nn.Module):
         return e_3
 
     def potential_from_encoder(self, x_t_zero_vel):
-        y_t_zero_vel = self.encoder(x_t=x_t_zero_vel, primitive_type=torch.FloatTensor(1).cuda())
+        y_t_zero_vel = self.encoder(x_t=x_t_zero_vel, primitive_type=torch.zeros(1, device=self.device))
         y_goal = self.get_goals_latent_space_batch(
-            primitive_type=torch.FloatTensor(1).cuda())
+            primitive_type=torch.zeros(1, device=self.device))
 
         # potential and its gradient
         y_difference = y_goal - y_t_zero_vel
         potential_torch = torch.norm(y_difference, dim=1, keepdim=True)
         return potential_torch
 
+    def potential_and_gradient_from_encoder(self, x_t_zero_vel, primitive_type=None):
+        """
+        Computes the potential and its gradient wrt the (batch of) states in a single forward/backward pass.
+        The latent space goals are detached and cached until the goals are updated.
+        """
+        if primitive_type is None:
+            primitive_type = torch.zeros(x_t_zero_vel.shape[0], device=self.device)
+        if self.goals_latent_space_detached is None:
+            if self.goals_latent_space_stacked is None:
+                self.goals_latent_space_stacked = self.stack_goals_latent_space(self.goals_latent_space)
+            self.goals_latent_space_detached = self.goals_latent_space_stacked.detach()
+        y_goal = self.get_goals_latent_space_batch(primitive_type=primitive_type,
+                                                   goals_latent_space=self.goals_latent_space_detached)
+
+        with torch.enable_grad():
+            x_t = x_t_zero_vel.detach().to(self.device).clone().requires_grad_(True)
+            y_t = self.encoder(x_t=x_t, primitive_type=primitive_type)
+            potential_torch = torch.norm(y_goal - y_t, dim=1, keepdim=True)
+
+            # every potential only depends on its own state, so the gradient of the sum gives all gradients at once
+            grad_potential_torch = torch.autograd.grad(potential_torch.sum(), x_t)[0]
+        return potential_torch.detach(), grad_potential_torch
+
     def decoder_dx(self, y_t):
         """
         Maps latent space state to task space derivative (phi)
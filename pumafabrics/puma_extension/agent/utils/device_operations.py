@@ -0,0 +1,31 @@
+import torch
+
+
+"""""""""""""""""""""""""""""""""""""""""""""""
+        Device (cpu/gpu) useful functions
+"""""""""""""""""""""""""""""""""""""""""""""""
+
+def get_device(device=None):
+    """
+    Returns the torch device, if none is selected: cuda when available, otherwise cpu
+    """
+    if device is None:
+        device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    return torch.device(device)
+
+
+def set_inference_threads(device, n_threads=1):
+    """
+    Pins the number of intra-op threads used on the cpu.
+    For batch-size-1 control queries, a small fixed number of threads avoids the threading overhead of large pools.
+    """
+    if get_device(device).type == 'cpu' and n_threads is not None:
+        torch.set_num_threads(n_threads)
+
+
+def synchronize(device):
+    """
+    Waits for all kernels on the device to finish (only needed for timing on the gpu)
+    """
+    if get_device(device).type == 'cuda':
+        torch.cuda.synchronize()
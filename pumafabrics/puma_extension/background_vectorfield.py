@@ -42,7 +42,7 @@ class create_background_vectorfield():
 
         # Initialize dynamical system
 
-        dynamical_system = learner.init_dynamical_system(initial_states=torch.FloatTensor(x_t_init).cuda())
+        dynamical_system = learner.init_dynamical_system(initial_states=torch.FloatTensor(x_t_init).to(learner.device))
 
 
         # Initialize trajectory plotter
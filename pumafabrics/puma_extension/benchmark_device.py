@@ -0,0 +1,78 @@
+"""
+Benchmarks the per-step latency of a PUMA transition on cpu and gpu, in eager mode and with the compiled
+(TorchScript/ONNX) transition.
+
+A single state (batch size 1) is evaluated at every step, as in the TamedPUMA control loop, including the
+numpy -> device -> numpy transfers. The model weights are not loaded, they do not influence the latency.
+Run from the puma_extension folder, e.g.:
+    python benchmark_device.py --params 1st_order_3D_tomato_31may 2nd_order_R3S3_tomato_31may --backends eager torchscript onnx
+"""
+from simple_parsing import ArgumentParser
+from pumafabrics.puma_extension.initializer import initialize_framework
+from pumafabrics.puma_extension.agent.utils.device_operations import set_inference_threads, synchronize
+from pumafabrics.puma_extension.agent.compiled_transition import load_compiled_dynamical_system
+import numpy as np
+import importlib
+import tempfile
+import torch
+import time
+
+# Get arguments
+parser = ArgumentParser()
+parser.add_argument('--params', type=str, nargs='+', default=['1st_order_3D_tomato_31may', '2nd_order_R3S3_tomato_31may'], help='')
+parser.add_argument('--backends', type=str, nargs='+', default=['eager', 'torchscript'], help='eager, torchscript, onnx')
+parser.add_argument('--n-steps', type=int, default=1000, help='')
+parser.add_argument('--n-warmup', type=int, default=50, help='')
+parser.add_argument('--cpu-threads', type=int, default=1, help='')
+parser.add_argument('--results-base-directory', type=str, default='./', help='')
+args = parser.parse_args()
+
+
+def benchmark_transition(params_name, device, backend='eager'):
+    """
+    Returns the latency (ms) of every dynamical system transition of the given params file in the given device
+    """
+    # Load parameters
+    Params = getattr(importlib.import_module('params.' + params_name), 'Params')
+    params = Params(args.results_base_directory)
+    params.results_path += params.selected_primitives_ids + '/'
+    params.load_model = False
+    params.save_evaluation = False
+    params.device = device
+
+    # Initialize framework
+    learner, _, _ = initialize_framework(params, params_name, verbose=False)
+    set_inference_threads(learner.device, n_threads=args.cpu_threads)
+
+    # Initialize dynamical system (initial state is mapped to its manifold internally)
+    np.random.seed(0)
+    x_t_init = np.random.uniform(-1, 1, size=(1, learner.dim_state))
+    dynamical_system = learner.init_dynamical_system(initial_states=torch.FloatTensor(x_t_init).to(learner.device))
+    x_t = dynamical_system.x_t_d.cpu().numpy()
+    if backend != 'eager':
+        dynamical_system = load_compiled_dynamical_system(dynamical_system,
+                                                          file_path=tempfile.mkdtemp() + '/transition',
+                                                          backend=backend)
+
+    latencies = []
+    with torch.inference_mode():
+        for i in range(args.n_warmup + args.n_steps):
+            synchronize(learner.device)
+            time0 = time.perf_counter()
+            x_t_device = torch.from_numpy(x_t).to(learner.device)
+            transition_info = dynamical_system.transition(space='task', x_t=x_t_device)
+            x_t = transition_info['desired state'].cpu().numpy()
+            if i >= args.n_warmup:
+                latencies.append((time.perf_counter() - time0) * 1000)
+    return np.array(latencies)
+
+
+if __name__ == '__main__':
+    devices = ['cpu'] + (['cuda'] if torch.cuda.is_available() else [])
+    print('%-32s %-6s %-12s %10s %10s %10s %10s' % ('params', 'device', 'backend', 'mean [ms]', 'std [ms]', 'p50 [ms]', 'p95 [ms]'))
+    for params_name in args.params:
+        for device in devices:
+            for backend in args.backends:
+                latencies = benchmark_transition(params_name, device, backend)
+                print('%-32s %-6s %-12s %10.3f %10.3f %10.3f %10.3f' % (params_name, device, backend, latencies.mean(), latencies.std(),
+                                                                       np.percentile(latencies, 50), np.percentile(latencies, 95)))
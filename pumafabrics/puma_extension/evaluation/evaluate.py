@@ -99,10 +99,10 @@ class Evaluate():
             initial_positions_grid = torch.cat([initial_positions_grid,
                                                 torch.from_numpy(grid[i].reshape(-1, 1)).float()], dim=1)
 
-        initial_positions_grid = initial_positions_grid.cuda()
+        initial_positions_grid = initial_positions_grid.to(self.learner.device)
 
         # Get initial derivatives and append to initial states (for second order systems)
-        initial_derivatives_grid = torch.zeros([initial_positions_grid.shape[0], self.dim_state - self.dim_space]).cuda()
+        initial_derivatives_grid = torch.zeros([initial_positions_grid.shape[0], self.dim_state - self.dim_space]).to(self.learner.device)
 
         # Get initial states
         initial_states_grid = torch.cat([initial_positions_grid, initial_derivatives_grid], dim=1)
@@ -121,10 +121,10 @@ class Evaluate():
             initial_positions_demos = torch.cat([initial_positions_demos,
                                                  torch.from_numpy(demos[:, 0, i, 0].reshape(-1, 1)).float()], dim=1)
 
-        initial_positions_demos = initial_positions_demos.cuda()
+        initial_positions_demos = initial_positions_demos.to(self.learner.device)
 
         # Get initial derivatives and append to initial states (second order systems)
-        initial_derivatives_demos = torch.zeros([initial_positions_demos.shape[0], self.dim_state - self.dim_space]).cuda()
+        initial_derivatives_demos = torch.zeros([initial_positions_demos.shape[0], self.dim_state - self.dim_space]).to(self.learner.device)
 
         # Get initial states
         initial_states_demos = torch.cat([initial_positions_demos, initial_derivatives_demos], dim=1)
@@ -145,7 +145,7 @@ class Evaluate():
         n_trajectories_primitive = self.demonstrations_train[self.primitive_ids == primitive_id].shape[0]
 
         # Get primitive number to feed model
-        primitive_type = torch.ones(self.density ** self.dim_manifold + n_trajectories_primitive).cuda() * primitive_id
+        primitive_type = torch.ones(self.density ** self.dim_manifold + n_trajectories_primitive).to(self.learner.device) * primitive_id
 
         # Combine states
         initial_states = torch.cat([initial_states_demos, initial_states_grid], dim=0)
@@ -171,7 +171,7 @@ class Evaluate():
         Computes velocity of initial states
         """
         # Get primitive number to feed model
-        primitive_type = torch.ones(self.density ** self.dim_manifold).cuda() * primitive_id
+        primitive_type = torch.ones(self.density ** self.dim_manifold).to(self.learner.device) * primitive_id
 
         # Compute evaluation delta t
         delta_t_eval = np.mean(self.delta_t_eval)
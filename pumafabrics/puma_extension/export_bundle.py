@@ -0,0 +1,28 @@
+"""
+Exports a trained model and its normalization metadata into a model bundle, which is loaded by the TamedPUMA
+controllers without re-running the data preprocessor. Run from the puma_extension folder, e.g.:
+    python export_bundle.py --params 2nd_order_R3S3_tomato_31may
+"""
+from simple_parsing import ArgumentParser
+from pumafabrics.puma_extension.initializer import initialize_framework
+from pumafabrics.puma_extension.agent.model_bundle import export_model_bundle, bundle_source_key
+import importlib
+
+# Get arguments
+parser = ArgumentParser()
+parser.add_argument('--params', type=str, default='2nd_order_R3S3_tomato_31may', help='')
+parser.add_argument('--results-base-directory', type=str, default='./', help='')
+parser.add_argument('--bundle-name', type=str, default='model_bundle', help='')
+args = parser.parse_args()
+
+# Load parameters
+Params = getattr(importlib.import_module('params.' + args.params), 'Params')
+params = Params(args.results_base_directory)
+params.results_path += params.selected_primitives_ids + '/'
+params.load_model = True
+params.save_evaluation = False
+
+# Initialize framework and export
+learner, _, _ = initialize_framework(params, args.params, verbose=False)
+export_model_bundle(learner, params.results_path + args.bundle_name, source_key=bundle_source_key(params))
+print('Model bundle saved in:', params.results_path + args.bundle_name)
@@ -1,9 +1,11 @@
 import os
 import time
+import warnings
 from dataclasses import fields
 from pumafabrics.puma_extension.data_preprocessing.data_preprocessor import DataPreprocessor
 from pumafabrics.puma_extension.agent.contrastive_imitation import ContrastiveImitation
 from pumafabrics.puma_extension.evaluation.evaluator_init import evaluator_init
+from pumafabrics.puma_extension.agent.model_bundle import ModelBundle, bundle_source_key
 
 
 def initialize_framework(params, name_params, verbose=True):
@@ -40,6 +42,27 @@ def initialize_framework(params, name_params, verbose=True):
     return learner, evaluator, data
 
 
+def initialize_policy(params, name_params, bundle_name='model_bundle', verbose=True):
+    """
+    Loads the trained policy for inference from its model bundle (exported with export_bundle.py), skipping the data
+    preprocessor. If there is no bundle, or the model, params or demonstrations changed since the export
+    (see bundle_source_key), the full framework is initialized instead
+    """
+    bundle_path = params.results_path + bundle_name
+    if os.path.exists(bundle_path):
+        learner = ModelBundle(bundle_path, device=getattr(params, 'device', None))
+        if learner.source_key == bundle_source_key(params):
+            return learner, learner.data
+        warnings.warn('Model bundle %s is outdated, the full framework is initialized instead. '
+                      'Export the bundle again with export_bundle.py.' % bundle_path)
+
+    # Otherwise, initialize full framework
+    params.load_model = True
+    params.save_evaluation = False
+    learner, _, data = initialize_framework(params, name_params, verbose=verbose)
+    return learner, data
+
+
 def create_directories(results_path):
     """
     Creates the requested directory and subfolders
@@ -53,7 +53,7 @@ learner, _, data = initialize_framework(params, params_name, verbose=False)
 
 # Initialize dynamical system
 
-dynamical_system = learner.init_dynamical_system(initial_states=torch.FloatTensor(x_t_init).cuda())
+dynamical_system = learner.init_dynamical_system(initial_states=torch.FloatTensor(x_t_init).to(learner.device))
 
 # Initialize trajectory plotter
 fig, ax = plt.subplots()
@@ -120,7 +120,7 @@ plt.show()
 #
 # # Initialize dynamical system
 #
-# dynamical_system = learner.init_dynamical_system(initial_states=torch.FloatTensor(x_t_init).cuda())
+# dynamical_system = learner.init_dynamical_system(initial_states=torch.FloatTensor(x_t_init).to(learner.device))
 #
 # # Initialize trajectory plotter
 # fig, ax = plt.subplots()
@@ -10,8 +10,10 @@ from pumafabrics.tamed_puma.utils.filters import PDController
 from pumafabrics.tamed_puma.utils.normalizations_2 import normalization_functions
 from pumafabrics.tamed_puma.kinematics.kinematics_kuka import KinematicsKuka
 from pumafabrics.tamed_puma.utils.analysis_utils import UtilsAnalysis
-from pumafabrics.puma_extension.initializer import initialize_framework
+from pumafabrics.puma_extension.initializer import initialize_policy
+from pumafabrics.puma_extension.agent.utils.device_operations import set_inference_threads
 from pumafabrics.tamed_puma.modulation_ik.Modulation_ik import IKGomp
+from pumafabrics.tamed_puma.tamedpuma.goal_context import GoalContext
 from pumafabrics.tamed_puma.tamedpuma.example_generic import ExampleGeneric
 import os
 
@@ -65,9 +67,11 @@ class PUMA_modulationIK(ExampleGeneric):
         params = Params(results_base_directory)
         params.results_path += params.selected_primitives_ids + '/'
         params.load_model = True
+        params.device = self.params.get("device", None)  # cpu or cuda, default: cuda if available
 
-        # Initialize framework
-        self.learner, _, data = initialize_framework(params, self.params_name, verbose=False)
+        # Initialize policy (from model bundle if available)
+        self.learner, data = initialize_policy(params, self.params_name, verbose=False)
+        set_inference_threads(self.learner.device, n_threads=self.params.get("cpu_threads", 1))
         self.goal_NN = data['goals training'][0]
 
         # Initialize GOMP
@@ -78,23 +82,41 @@ class PUMA_modulationIK(ExampleGeneric):
         self.gomp_class.construct_ik(nr_obst=self.params["nr_obst"], collision_links=self.params["collision_links"])
 
         # Normalization class
-        self.normalizations = normalization_functions(x_min=data["x min"], x_max=data["x max"], dof_task=self.params["dim_task"], dt=self.params["dt"], mode_NN=self.params["mode_NN"])
+        self.normalizations = normalization_functions(x_min=data["x min"], x_max=data["x max"], dof_task=self.params["dim_task"], dt=self.params["dt"], mode_NN=self.params["mode_NN"], device=self.learner.device)
 
     def initialize_example(self, q_init):
         self.offset_orientation = np.array(self.params["orientation_goal"])
 
-        # Translation of goal:
+        # Translation of goal (only recomputed if the goal moves):
         goal_pos = self.params["goal_pos"]
-        translation_gpu, translation_cpu = self.normalizations.translation_goal(state_goal = np.array(goal_pos), goal_NN=self.goal_NN)
+        self.goal_context = GoalContext(self.normalizations, self.goal_NN, dim_task=self.params["dim_task"],
+                                        tolerance=self.params.get("goal_tolerance", 0.))
+        self.goal_context.update(goal_pos)
+        translation_cpu = self.goal_context.translation_cpu
 
         # initial state:
         x_t_init = self.gomp_class.get_initial_pose(q_init=q_init, offset_orientation=self.offset_orientation)
         x_init_gpu = self.normalizations.normalize_state_to_NN(x_t=[x_t_init], translation_cpu=translation_cpu, offset_orientation=self.offset_orientation)
-        self.dynamical_system = self.learner.init_dynamical_system(initial_states=x_init_gpu[:, :3].clone(), delta_t=1)
+        if getattr(self, "dynamical_system", None) is not None and self.dynamical_system.model is self.learner.model:
+            self.dynamical_system.reset(x_init_gpu[:, :3].clone())
+        else:
+            self.dynamical_system = self.learner.init_dynamical_system(initial_states=x_init_gpu[:, :3].clone(), delta_t=1)
 
         # Initialize lists
         self.quat_prev = copy.deepcopy(x_t_init[3:])
 
+    def reset(self, q_init, goal=None, obstacles=None):
+        """
+        Prepares a new run of the constructed example from q_init, with a new goal position and obstacle positions
+        (params["goal_pos"] and params["positions_obstacles"]) if given.
+        The IK problem, kinematics and the loaded PUMA model are kept and the run state is cleared.
+        The state is initialized once, by initialize_example at the start of the run (run_kuka_example).
+        """
+        self.overwrite_defaults(params=self.params, init_pos=q_init, goal_pos=goal, positions_obstacles=obstacles)
+        self.reset_run_state()
+        self.gomp_class.q_home = self.params["init_pos"]
+        self.gomp_class.planner.set_init_guess(self.gomp_class.q_home)
+
     def run(self, runtime_arguments:dict):
         q = runtime_arguments["q"]
         qdot = runtime_arguments["qdot"]
@@ -102,9 +124,9 @@ class PUMA_modulationIK(ExampleGeneric):
         positions_obstacles = runtime_arguments["positions_obstacles"]
         obstacles = runtime_arguments["obstacles"]
 
-        # recompute translation to goal pose:
-        translation_gpu, translation_cpu = self.normalizations.translation_goal(state_goal=np.array(goal_pos),
-                                                                                goal_NN=self.goal_NN)
+        # recompute translation to goal pose (if the goal moved):
+        self.goal_context.update(goal_pos)
+        translation_cpu = self.goal_context.translation_cpu
 
         # --- end-effector states and normalized states --- #
         x_t, xee_orientation, _ = self.kuka_kinematics.get_state_task(q, self.quat_prev)
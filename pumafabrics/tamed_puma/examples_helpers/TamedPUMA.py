@@ -5,8 +5,11 @@ from pumafabrics.tamed_puma.kinematics.kinematics_kuka import KinematicsKuka
 from pumafabrics.tamed_puma.tamedpuma.energy_regulator import energy_regulation
 from pumafabrics.tamed_puma.tamedpuma.puma_controller import PUMAControl
 from pumafabrics.tamed_puma.tamedpuma.fabrics_controller import FabricsController
+from pumafabrics.tamed_puma.tamedpuma.async_puma import AsyncPUMAExecutor
+from pumafabrics.tamed_puma.tamedpuma.goal_context import GoalContext
 from pumafabrics.tamed_puma.utils.analysis_utils import UtilsAnalysis
 from pumafabrics.tamed_puma.utils.filters import PDController
+from pumafabrics.tamed_puma.utils.latency_profiler import LatencyProfiler
 from pumafabrics.tamed_puma.tamedpuma.example_generic import ExampleGeneric
 import copy
 import time
@@ -32,7 +35,10 @@ class TamedPUMAExample(ExampleGeneric):
                                             collision_radii=self.params["collision_radii"],
                                             kinematics=self.kuka_kinematics)
         self.pdcontroller = PDController(Kp=1.0, Kd=0.1, dt=self.params["dt"])
-        self.puma_controller = PUMAControl(params=self.params, kinematics=self.kuka_kinematics)
+        self.profiler = LatencyProfiler(deadlines={"total": self.params.get("deadline", self.params["dt"])},
+                                        enabled=self.params.get("bool_profiler", False))
+        self.puma_controller = PUMAControl(params=self.params, kinematics=self.kuka_kinematics, profiler=self.profiler)
+        self.async_puma = None
 
     def initialize_example(self, q_init):
         self.offset_orientation = np.array(self.params["orientation_goal"])
@@ -45,50 +51,106 @@ class TamedPUMAExample(ExampleGeneric):
         self.dynamical_system, self.normalizations = self.puma_controller.return_classes()
         self.quat_prev = copy.deepcopy(x_t_init[3:7])
 
-        # energization:
-        self.energy_regulation_class = energy_regulation(dim_task=self.params["dim_task"], mode_NN=self.params["mode_NN"], dof=dof, dynamical_system=self.dynamical_system)
-        self.energy_regulation_class.relationship_dq_dx(self.offset_orientation, translation_cpu, self.kuka_kinematics, self.normalizations, self.fk)
+        # energization (the symbolic dx/dq function is kept as long as the PUMA model is the same):
+        if self.puma_controller.model_reloaded or getattr(self, "energy_regulation_class", None) is None:
+            self.energy_regulation_class = energy_regulation(dim_task=self.params["dim_task"], mode_NN=self.params["mode_NN"], dof=dof, dynamical_system=self.dynamical_system)
+            self.energy_regulation_class.relationship_dq_dx_parametrized(self.offset_orientation, translation_cpu,
+                                                                         self.kuka_kinematics, self.normalizations, self.fk,
+                                                                         file_name=self.params.get("dxdq_function_file", None))
+        else:
+            self.energy_regulation_class.set_dqdx_parameters(self.offset_orientation, translation_cpu)
+
+        # translation and dq/dx parameters, only recomputed if the goal moves (more than params["goal_tolerance"]):
+        self.goal_context = GoalContext(self.normalizations, self.goal_NN, dim_task=self.params["dim_task"],
+                                        tolerance=self.params.get("goal_tolerance", 0.),
+                                        energy_regulation_class=self.energy_regulation_class)
+
+        # PUMA in a worker thread at its own rate (params["puma_rate"], Hz), fabrics at the control rate.
+        # Its output is at least one tick old, which the energy regulator (CPM) does not support:
+        if self.params.get("bool_async_puma", False):
+            if self.params["bool_combined"] and self.params["bool_energy_regulator"]:
+                raise ValueError("The asynchronous PUMA output belongs to an earlier state, which the energy regulator (CPM) "
+                                 "does not support, set bool_async_puma to False or bool_energy_regulator to False.")
+            if self.async_puma is None or self.puma_controller.model_reloaded:
+                self.stop_async_puma()
+                self.async_puma = AsyncPUMAExecutor(self.puma_controller, rate=self.params.get("puma_rate", 1. / self.params["dt"]),
+                                                    goal_context=self.goal_context)
+            self.async_puma.start()
+        else:
+            self.stop_async_puma()
+            self.async_puma = None
+
+    def stop_async_puma(self):
+        if getattr(self, "async_puma", None) is not None:
+            self.async_puma.stop()
+
+    def reset(self, q_init, goal=None, obstacles=None):
+        """
+        Prepares a new run of the constructed example from q_init, with a new goal position and obstacle positions
+        (params["goal_pos"] and params["positions_obstacles"]) if given.
+        The planners, kinematics and the loaded PUMA model are kept and the run state is cleared.
+        The state is initialized once, by initialize_example at the start of the run (run_kuka_example).
+        """
+        self.overwrite_defaults(params=self.params, init_pos=q_init, goal_pos=goal, positions_obstacles=obstacles)
+        self.reset_run_state()
+        self.stop_async_puma()
 
     def run(self, runtime_arguments):
         q = runtime_arguments["q"]
         qdot = runtime_arguments["qdot"]
         goal_pos = runtime_arguments["goal_pos"]
         obstacles = runtime_arguments["obstacles"]
+        with self.profiler.span("total"):
+            action, error, qddot_PUMA = self._run(q, qdot, goal_pos, obstacles)
+        return action, self.GOAL_REACHED, error, self.IN_COLLISION, {}, qddot_PUMA
 
-        translation_gpu, translation_cpu = self.normalizations.translation_goal(
-            state_goal=np.append(goal_pos, self.offset_orientation), goal_NN=self.goal_NN)
-        self.energy_regulation_class.relationship_dq_dx(self.offset_orientation, translation_cpu, self.kuka_kinematics,
-                                                        self.normalizations, self.fk)
+    def _run(self, q, qdot, goal_pos, obstacles):
+        self.goal_context.update(goal_pos, self.offset_orientation)
+        translation_cpu = self.goal_context.translation_cpu
 
         # --- end-effector states and normalized states --- #
-        x_t, xee_orientation, _ = self.kuka_kinematics.get_state_task(q, self.quat_prev, mode_NN=self.params["mode_NN"],
-                                                                      qdot=qdot)
+        with self.profiler.span("fk"):
+            x_t, xee_orientation, _ = self.kuka_kinematics.get_state_task(q, self.quat_prev, mode_NN=self.params["mode_NN"],
+                                                                          qdot=qdot)
         self.quat_prev = copy.deepcopy(xee_orientation)
 
         # --- action by NN --- #
         time0 = time.perf_counter()
-        qddot_PUMA, transition_info = self.puma_controller.request_PUMA(q=q,
-                                                                        qdot=qdot,
-                                                                        x_t=x_t,
-                                                                        xee_orientation=xee_orientation,
-                                                                        offset_orientation=self.offset_orientation,
-                                                                        translation_cpu=translation_cpu
-                                                                        )
+        if self.async_puma is not None:
+            # most recent output of the PUMA worker (computed from the state of an earlier tick)
+            self.async_puma.submit(q=q, qdot=qdot, x_t=x_t, xee_orientation=xee_orientation,
+                                   offset_orientation=self.offset_orientation, goal_pos=goal_pos)
+            qddot_PUMA, transition_info = self.async_puma.latest()
+        else:
+            qddot_PUMA, transition_info = self.puma_controller.request_PUMA(q=q,
+                                                                            qdot=qdot,
+                                                                            x_t=x_t,
+                                                                            xee_orientation=xee_orientation,
+                                                                            offset_orientation=self.offset_orientation,
+                                                                            translation_cpu=translation_cpu
+                                                                            )
 
         if self.params["bool_combined"] == True:
             # ----- Fabrics action ----#
-            action_avoidance, M_avoidance, f_avoidance, qddot_speed = self.fabrics_controller.compute_action_avoidance(
-                q=q, qdot=qdot, obstacles=obstacles)
+            with self.profiler.span("fabrics"):
+                if self.fabrics_controller.prepared_avoidance is not None:
+                    self.fabrics_controller.set_obstacles_prepared(self.fabrics_controller.prepared_avoidance, obstacles, q=q)
+                    action_avoidance, M_avoidance, f_avoidance, qddot_speed = self.fabrics_controller.compute_action_avoidance_prepared(
+                        q=q, qdot=qdot)
+                else:
+                    action_avoidance, M_avoidance, f_avoidance, qddot_speed = self.fabrics_controller.compute_action_avoidance(
+                        q=q, qdot=qdot, obstacles=obstacles)
 
             if self.params["bool_energy_regulator"] == True:
                 weight_attractor = 1.
                 # ---- get action by CPM via theorem III.5 in https://arxiv.org/pdf/2309.07368.pdf ---#
-                action_combined = self.energy_regulation_class.compute_action_theorem_III5(q=q, qdot=qdot,
-                                                                                           qddot_attractor=qddot_PUMA,
-                                                                                           action_avoidance=action_avoidance,
-                                                                                           M_avoidance=M_avoidance,
-                                                                                           transition_info=transition_info,
-                                                                                           weight_attractor=weight_attractor)
+                with self.profiler.span("energy_regulation"):
+                    action_combined = self.energy_regulation_class.compute_action_theorem_III5(q=q, qdot=qdot,
+                                                                                               qddot_attractor=qddot_PUMA,
+                                                                                               action_avoidance=action_avoidance,
+                                                                                               M_avoidance=M_avoidance,
+                                                                                               transition_info=transition_info,
+                                                                                               weight_attractor=weight_attractor)
             else:
                 # --- get action by FPM, sum of dissipative systems ---#
                 action_combined = qddot_PUMA + action_avoidance
@@ -106,6 +168,7 @@ class TamedPUMAExample(ExampleGeneric):
 
         self.solver_times.append(time.perf_counter() - time0)
 
-        self.IN_COLLISION = self.utils_analysis.check_distance_collision(q=q, obstacles=obstacles)
-        self.GOAL_REACHED, error = self.utils_analysis.check_goal_reaching(q, self.quat_prev, x_goal=goal_pos)
-        return action, self.GOAL_REACHED, error, self.IN_COLLISION, {}, qddot_PUMA
\ No newline at end of file
+        with self.profiler.span("collision_check"):
+            self.IN_COLLISION = self.utils_analysis.check_distance_collision(q=q, obstacles=obstacles)
+            self.GOAL_REACHED, error = self.utils_analysis.check_goal_reaching(q, self.quat_prev, x_goal=goal_pos)
+        return action, error, qddot_PUMA
\ No newline at end of file
@@ -0,0 +1,137 @@
+import numpy as np
+import torch
+import copy
+import time
+from pumafabrics.tamed_puma.examples_helpers.TamedPUMA import TamedPUMAExample
+from pumafabrics.tamed_puma.tamedpuma.goal_context import GoalContext
+
+class TamedPUMAbatchedExample(TamedPUMAExample):
+    """
+    TamedPUMA for N robots (or scenarios) at once, with stacked q/qdot (N x dof).
+    PUMA is evaluated in one batched transition, the fabrics avoidance terms in one casadi map over the batch and the
+    CPM/FPM combination with batched linear algebra. The kinematics, goal contexts and collision checks are still
+    evaluated per robot: every robot keeps its own kinematics and quaternion history, so the actions are the same as
+    those of N separate TamedPUMAExample's.
+    """
+    def __init__(self, file_name="kuka_TamedPUMA_tomato", n_robots=2):
+        super().__init__(file_name=file_name)
+        self.n_robots = n_robots
+
+    def construct_example(self):
+        super().construct_example()
+        self.kinematics_list = [self.kuka_kinematics.independent_copy() for _ in range(self.n_robots)]
+        self.utils_analysis_list = []
+        for kinematics in self.kinematics_list:
+            utils_analysis = copy.copy(self.utils_analysis)
+            utils_analysis.kuka_kinematics = kinematics
+            self.utils_analysis_list.append(utils_analysis)
+
+    def initialize_example(self, q_init):
+        """
+        q_init: (N x dof) initial configurations, or a single configuration used for all robots
+        """
+        q_init = np.atleast_2d(q_init)
+        if len(q_init) == 1:
+            q_init = np.repeat(q_init, self.n_robots, axis=0)
+        dof = self.params["dof"]
+
+        # PUMA, normalizations and energy regulator are shared by all robots
+        super().initialize_example(q_init=q_init[0])
+
+        # Per robot: PUMA controller (with its own kinematics), quaternion history and goal context
+        self.puma_controllers = []
+        self.quat_prev_list = []
+        self.goal_contexts = [GoalContext(self.normalizations, self.goal_NN, dim_task=self.params["dim_task"],
+                                          tolerance=self.params.get("goal_tolerance", 0.)) for _ in range(self.n_robots)]
+        self.dqdx_parameters_batched = False  # the shared initialization sets the parameters of a single goal
+        for i in range(self.n_robots):
+            puma_controller = copy.copy(self.puma_controller)
+            puma_controller.kuka_kinematics = self.kinematics_list[i]
+            self.puma_controllers.append(puma_controller)
+            x_t_init = self.kinematics_list[i].get_initial_state_task(q_init=q_init[i], qdot_init=np.zeros((dof, 1)),
+                                                                      offset_orientation=self.offset_orientation,
+                                                                      mode_NN=self.params["mode_NN"])
+            self.quat_prev_list.append(copy.deepcopy(x_t_init[3:7]))
+        self.GOAL_REACHED = np.zeros(self.n_robots, dtype=bool)
+        self.IN_COLLISION = np.zeros(self.n_robots, dtype=bool)
+
+    def run(self, runtime_arguments):
+        """
+        runtime_arguments: q, qdot (N x dof), goal_pos (3,) or (N x 3), obstacles (list of obstacles shared by all robots, or N lists)
+        """
+        q = np.asarray(runtime_arguments["q"])
+        qdot = np.asarray(runtime_arguments["qdot"])
+        goal_pos = np.asarray(runtime_arguments["goal_pos"])
+        obstacles = runtime_arguments["obstacles"]
+        if goal_pos.ndim == 1:
+            goal_pos = np.repeat(goal_pos[None], self.n_robots, axis=0)
+        if len(obstacles) > 0 and isinstance(obstacles[0], (list, tuple)):
+            obstacles_list = obstacles
+        else:
+            obstacles_list = [obstacles] * self.n_robots
+
+        # --- end-effector states and normalized states (per robot) --- #
+        translations_cpu = []
+        xee_orientations = []
+        x_t_gpu_list = []
+        goals_updated = False
+        for i in range(self.n_robots):
+            goals_updated = self.goal_contexts[i].update(goal_pos[i], self.offset_orientation) or goals_updated
+            translation_cpu = self.goal_contexts[i].translation_cpu
+            x_t, xee_orientation, _ = self.kinematics_list[i].get_state_task(q[i], self.quat_prev_list[i],
+                                                                             mode_NN=self.params["mode_NN"], qdot=qdot[i])
+            self.quat_prev_list[i] = copy.deepcopy(xee_orientation)
+            translations_cpu.append(translation_cpu)
+            xee_orientations.append(xee_orientation)
+            x_t_gpu_list.append(self.puma_controllers[i].normalize_PUMA_state(x_t=x_t, offset_orientation=self.offset_orientation,
+                                                                               translation_cpu=translation_cpu))
+
+        # --- action by NN, one transition for all robots --- #
+        time0 = time.perf_counter()
+        with torch.inference_mode():
+            transition_info = self.dynamical_system.transition(space='task', x_t=torch.cat(x_t_gpu_list, dim=0))
+        qddot_PUMA = np.zeros((self.n_robots, self.params["dof"]))
+        for i in range(self.n_robots):
+            transition_info_i = {key: value[i:i+1] if value is not None else None for key, value in transition_info.items()}
+            qddot_PUMA[i], _ = self.puma_controllers[i].action_from_transition(q=q[i], qdot=qdot[i],
+                                                                               transition_info=transition_info_i,
+                                                                               xee_orientation=xee_orientations[i],
+                                                                               offset_orientation=self.offset_orientation)
+
+        if self.params["bool_combined"] == True:
+            # ----- Fabrics action, one casadi map for all robots ----#
+            action_avoidance, M_avoidance, f_avoidance, qddot_speed = self.fabrics_controller.compute_action_avoidance_batch(
+                q=q, qdot=qdot, obstacles=obstacles_list)
+
+            if self.params["bool_energy_regulator"] == True:
+                weight_attractor = 1.
+                # ---- get action by CPM via theorem III.5 in https://arxiv.org/pdf/2309.07368.pdf ---#
+                if goals_updated or not self.dqdx_parameters_batched:
+                    self.energy_regulation_class.set_dqdx_parameters(np.repeat(self.offset_orientation[None], self.n_robots, axis=0),
+                                                                     np.stack(translations_cpu))
+                    self.dqdx_parameters_batched = True
+                action_combined = self.energy_regulation_class.compute_action_theorem_III5_batch(q=q, qdot=qdot,
+                                                                                                 qddot_attractor=qddot_PUMA,
+                                                                                                 action_avoidance=action_avoidance,
+                                                                                                 M_avoidance=M_avoidance,
+                                                                                                 x_t_NN=transition_info["desired state"],
+                                                                                                 weight_attractor=weight_attractor)
+            else:
+                # --- get action by FPM, sum of dissipative systems ---#
+                action_combined = qddot_PUMA + action_avoidance
+        else:  # otherwise only apply action by PUMA
+            action_combined = qddot_PUMA
+
+        if self.params["mode_env"] is not None and self.params["mode_env"] == "vel":
+            action = self.integrate_to_vel(qdot=qdot, action_acc=action_combined, dt=self.params["dt"])
+            action = np.clip(action, -1 * np.array(self.params["vel_limits"]), np.array(self.params["vel_limits"]))
+        else:
+            action = action_combined
+
+        self.solver_times.append(time.perf_counter() - time0)
+
+        errors = np.zeros(self.n_robots)
+        for i in range(self.n_robots):
+            self.IN_COLLISION[i] = self.utils_analysis_list[i].check_distance_collision(q=q[i], obstacles=obstacles_list[i])
+            self.GOAL_REACHED[i], errors[i] = self.utils_analysis_list[i].check_goal_reaching(q[i], self.quat_prev_list[i], x_goal=goal_pos[i])
+        return action, self.GOAL_REACHED, errors, self.IN_COLLISION, {}, qddot_PUMA
@@ -7,8 +7,7 @@ from forwardkinematics.urdfFks.generic_urdf_fk import GenericURDFFk
 from pumafabrics.tamed_puma.utils.analysis_utils import UtilsAnalysis
 from pumafabrics.tamed_puma.tamedpuma.fabrics_controller import FabricsController
 from pumafabrics.tamed_puma.tamedpuma.puma_controller import PUMAControl
-import importlib
-from pumafabrics.puma_extension.initializer import initialize_framework
+from pumafabrics.tamed_puma.tamedpuma.goal_context import GoalContext
 from pumafabrics.tamed_puma.create_environment.goal_defaults import goal_default
 import copy
 import yaml
@@ -63,21 +62,6 @@ class TamedPUMAhierarchical(ExampleGeneric):
                                  goal_pos=self.params["goal_pos"])
         self.planner, fk = self.fabrics_controller.set_full_planner(goal=self.goal)
 
-        # Parameters
-        if self.params["mode_NN"] == "1st":
-            self.params_name = self.params["params_name_1st"]
-        else:
-            self.params_name = self.params["params_name_2nd"]
-
-        # Load parameters
-        Params = getattr(importlib.import_module('pumafabrics.puma_extension.params.' + self.params_name), 'Params')
-        params = Params(results_base_directory)
-        params.results_path += params.selected_primitives_ids + '/'
-        params.load_model = True
-
-        # Initialize framework
-        self.learner, _, data = initialize_framework(params, self.params_name, verbose=False)
-        self.goal_NN = data['goals training'][0]
         self.puma_controller = PUMAControl(params=self.params, kinematics=self.kuka_kinematics, NULLSPACE=False)
 
     def initialize_example(self, q_init):
@@ -85,23 +69,32 @@ class TamedPUMAhierarchical(ExampleGeneric):
 
         # # initial state:
         goal_pos = self.params["goal_pos"]
-        x_t_init, x_init_gpu, translation_cpu, goal_NN = self.puma_controller.initialize_PUMA(q_init=q_init, goal_pos=goal_pos, offset_orientation=self.offset_orientation, results_base_directory=self.results_base_directory)
+        x_t_init, x_init_gpu, translation_cpu, self.goal_NN = self.puma_controller.initialize_PUMA(q_init=q_init, goal_pos=goal_pos, offset_orientation=self.offset_orientation, results_base_directory=self.results_base_directory)
         self.dynamical_system, self.normalizations = self.puma_controller.return_classes()
+        self.goal_context = GoalContext(self.normalizations, self.goal_NN, dim_task=self.params["dim_task"],
+                                        tolerance=self.params.get("goal_tolerance", 0.))
 
         self.quat_prev = copy.deepcopy(x_t_init[3:7])
 
+    def reset(self, q_init, goal=None, obstacles=None):
+        """
+        Prepares a new run of the constructed example from q_init, with a new goal position and obstacle positions
+        (params["goal_pos"] and params["positions_obstacles"]) if given.
+        The fabrics planner, kinematics and the loaded PUMA model are kept and the run state is cleared.
+        The state is initialized once, by initialize_example at the start of the run (run_kuka_example).
+        """
+        self.overwrite_defaults(params=self.params, init_pos=q_init, goal_pos=goal, positions_obstacles=obstacles)
+        self.reset_run_state()
+
     def run(self, runtime_arguments: dict):
         q = runtime_arguments["q"]
         qdot = runtime_arguments["qdot"]
         goal_pos = runtime_arguments["goal_pos"]
         obstacles = runtime_arguments["obstacles"]
 
-        if self.params["dim_task"] == 7:
-            state_goal = np.append(goal_pos, self.offset_orientation)
-        elif self.params["dim_task"] == 3:
-            state_goal = goal_pos
-
-        translation_gpu, translation_cpu = self.normalizations.translation_goal(state_goal=state_goal, goal_NN=self.goal_NN)
+        # translation of the goal, only recomputed if the goal moves:
+        self.goal_context.update(goal_pos, self.offset_orientation)
+        translation_cpu = self.goal_context.translation_cpu
 
         # --- end-effector states and normalized states --- #
         x_t, xee_orientation, _ = self.kuka_kinematics.get_state_task(q, self.quat_prev, mode_NN=self.params["mode_NN"], qdot=qdot)
@@ -112,20 +105,14 @@ class TamedPUMAhierarchical(ExampleGeneric):
         # --- action by NN --- #
         time0 = time.perf_counter()
 
-        # get one action further away to avoid small drag
+        # get one action further away to avoid small drag, rollout of PUMA on the device
         x_t_propagate = copy.deepcopy(x_t)
-        for z in range(50):
-            x_t_action, transition_info = self.puma_controller.request_PUMA(q=q,
-                                                                            qdot=qdot,
-                                                                            x_t=x_t_propagate,
-                                                                            xee_orientation=xee_orientation,
-                                                                            offset_orientation=self.offset_orientation,
-                                                                            translation_cpu=translation_cpu,
-                                                                            POS_OUTPUT=True
-                                                                            )
-            if len(x_t_action) == 1:
-                x_t_action = x_t_action[0]
-            x_t_propagate[0][:self.params["dim_task"]] = x_t_action
+        x_t_action, transition_info = self.puma_controller.request_PUMA_rollout(x_t=x_t_propagate,
+                                                                                offset_orientation=self.offset_orientation,
+                                                                                translation_cpu=translation_cpu,
+                                                                                n_steps=self.params.get("lookahead_steps", 50))
+        if len(x_t_action) == 1:
+            x_t_action = x_t_action[0]
 
         # ----- Fabrics action ----#
         action, _, _, _ = self.fabrics_controller.compute_action_full(q=q, qdot=qdot,
@@ -66,7 +66,7 @@ class example_kinova_TamedPUMA(ExampleGeneric):
 
         # energization:
         self.energy_regulation_class = energy_regulation(dim_task=7, mode_NN=self.params["mode_NN"], dof=dof, dynamical_system=self.dynamical_system)
-        self.energy_regulation_class.relationship_dq_dx(self.offset_orientation, self.translation_cpu, self.kuka_kinematics, self.normalizations, self.fk)
+        self.energy_regulation_class.relationship_dq_dx_parametrized(self.offset_orientation, self.translation_cpu, self.kuka_kinematics, self.normalizations, self.fk)
         self.quat_prev = copy.deepcopy(x_t_init[3:7])
         
     def run(self, runtime_arguments):
@@ -79,8 +79,7 @@ class example_kinova_TamedPUMA(ExampleGeneric):
         # recompute translation to goal pose:
         goal_pos = [goal_pos[i] + self.params["goal_vel"][i]*self.params["dt"] for i in range(len(goal_pos))]
         self.translation_gpu, self.translation_cpu = self.normalizations.translation_goal(state_goal=np.append(goal_pos, self.orientation_goal), goal_NN=self.goal_NN)
-        self.energy_regulation_class.relationship_dq_dx(self.offset_orientation, self.translation_cpu, self.kuka_kinematics,
-                                                       self.normalizations, self.fk)
+        self.energy_regulation_class.set_dqdx_parameters(self.offset_orientation, self.translation_cpu)
 
         # --- end-effector states and normalized states --- #
         x_t, xee_orientation, _ = self.kuka_kinematics.get_state_task(q, self.quat_prev, mode_NN=self.params["mode_NN"], qdot=qdot)
@@ -1,9 +1,11 @@
 import torch
 import os
+import copy
 import numpy as np
 import pytorch_kinematics as pk
-from scipy.linalg import block_diag
 from pumafabrics.tamed_puma.kinematics.quaternion_operations import QuaternionOperations
+from pumafabrics.tamed_puma.kinematics.quaternions import matrix_to_quat
+from pumafabrics.tamed_puma.kinematics.kinematics_frame import KinematicsFrame
 import casadi as ca
 
 class KinematicsBasics():
@@ -13,10 +15,11 @@ class KinematicsBasics():
         self.root_link_name = root_link_name
         self.construct_chain(end_link_name=end_link_name, root_link_name=root_link_name)
         self.dt=dt
-        self.Jacobian_vec = torch.empty(0, requires_grad=True)
         self.len_max_list=10
+        self.reset_jacobian_history()
         self.Jac_dot_list = []
         self.quaternion_operations = QuaternionOperations()
+        self.frame = KinematicsFrame(self.chain, self.quaternion_operations, end_link_name=end_link_name, root_link_name=root_link_name)
 
     def construct_chain(self, end_link_name="iiwa_link_7", root_link_name="iiwa_link_0"):
         """
@@ -29,26 +32,72 @@ class KinematicsBasics():
 
     ### ---------------- Jacobians ------------------###
     def call_jacobian(self, q):
-        self.Jacobian, self.pose = self.chain.jacobian(q, ret_eef_pose=True)
-
-        self.Jacobian_vec = self.update_J_vec()
-        if len(self.Jacobian_vec)>1:
-            self.Jacobian_grad_tot = torch.gradient(self.Jacobian_vec, axis=0)
-            self.Jacobian_grad = self.Jacobian_grad_tot[-1][-1]
+        # the Jacobian is computed once per configuration, and the history gets one entry per configuration
+        new_configuration = self.frame.update(q)
+        self.Jacobian, self.pose = self.frame.jacobian(), self.frame.eef_pose()
+        if not new_configuration and self.n_jacobians > 0:
+            return self.Jacobian
+
+        self.update_J_vec()
+        if self.n_jacobians>1:
+            # last element of torch.gradient over the history (backward difference)
+            self.Jacobian_grad = self.Jacobian_buffer[self.index_jacobian] - self.Jacobian_buffer[self.index_jacobian - 1]
         else:
-            self.Jacobian_grad = torch.zeros((6, 7))
+            self.Jacobian_grad = torch.zeros_like(self.Jacobian_buffer[0])
         return self.Jacobian
 
+    def reset_jacobian_history(self):
+        """
+        Ring buffer of the last len_max_list Jacobians, allocated at the first Jacobian
+        """
+        self.Jacobian_buffer = None
+        self.index_jacobian = -1
+        self.n_jacobians = 0
+
+    def independent_copy(self):
+        """
+        Kinematics with its own Jacobian history and kinematics frame, sharing the (read-only) kinematic chain
+        """
+        kinematics_copy = copy.copy(self)
+        kinematics_copy.reset_jacobian_history()
+        kinematics_copy.Jac_dot_list = []
+        kinematics_copy.frame = KinematicsFrame(self.chain, self.quaternion_operations,
+                                                end_link_name=self.end_link_name, root_link_name=self.root_link_name)
+        return kinematics_copy
+
+    def reset_history(self):
+        """
+        Clears the Jacobian history and the kinematics frame, e.g. at the start of a new run
+        """
+        self.reset_jacobian_history()
+        self.frame.q = None
+        self.frame.clear()
+
     def update_J_vec(self):
-        self.Jacobian_vec = torch.cat((self.Jacobian_vec, self.Jacobian), 0)
-        if len(self.Jacobian_vec)>self.len_max_list:
-            self.Jacobian_vec = self.Jacobian_vec[-self.len_max_list:]
-        return self.Jacobian_vec
+        """
+        Writes the current Jacobian into the ring buffer (in place), see Jacobian_vec for the history in order
+        """
+        if self.Jacobian_buffer is None or self.Jacobian_buffer.shape[1:] != self.Jacobian.shape[1:] \
+                or self.Jacobian_buffer.dtype != self.Jacobian.dtype:
+            self.Jacobian_buffer = torch.zeros((self.len_max_list,) + tuple(self.Jacobian.shape[1:]), dtype=self.Jacobian.dtype)
+        self.index_jacobian = (self.index_jacobian + 1) % self.len_max_list
+        self.Jacobian_buffer[self.index_jacobian] = self.Jacobian[0]
+        self.n_jacobians += 1
+
+    @property
+    def Jacobian_vec(self):
+        """
+        Jacobian history in chronological order (copy of the ring buffer)
+        """
+        n = min(self.n_jacobians, self.len_max_list)
+        if n == 0:
+            return torch.empty(0)
+        indices = torch.arange(self.index_jacobian - n + 1, self.index_jacobian + 1) % self.len_max_list
+        return self.Jacobian_buffer[indices]
 
     def diff_kinematics_quat(self, q, angle_quaternion):
         self.Jacobian = self.call_jacobian(q=q)
-        H = self.quaternion_operations.map_angular_quat(angle_quaternion=angle_quaternion)
-        E_inv = block_diag(np.eye(3), 0.5 * H.transpose())
+        _, _, E_inv = self.frame.quaternion_maps(angle_quaternion)
         J_quat = E_inv @ self.Jacobian.numpy()[0]
         self.J_quat = J_quat
         return J_quat
@@ -56,14 +105,20 @@ class KinematicsBasics():
     def check_instability_jacobian(self, invJ):
         norm_invJ = np.linalg.norm(invJ)
         if norm_invJ > 30:
-            print("invJ has a norm that is too large: norm_invJ={}".format(norm_invJ))
+            print("invJ has a norm that is too large: norm_invJ={}, condition number J={}".format(norm_invJ, self.frame.condition_number()))
+
+    def get_condition_number(self):
+        """
+        Condition number of the current Jacobian, a by-product of its (cached) SVD
+        """
+        return self.frame.condition_number()
 
     ### ----------------- Forward (differentiable) kinematics -------------------###
     def forward_kinematics(self, q, end_link_name="iiwa_link_7"):
-        x_fk = self.chain.forward_kinematics(q, end_only=False)[end_link_name]
-        m = x_fk.get_matrix()
+        self.frame.update(q)
+        m = self.frame.link_matrix(end_link_name)
         pos = torch.Tensor.numpy(m[:, :3, 3])[0]
-        rot = torch.Tensor.numpy(pk.matrix_to_quaternion(m[:, :3, :3]))[0]
+        rot = matrix_to_quat(torch.Tensor.numpy(m[:, :3, :3]))[0]
         x_pose = np.append(pos, rot)
         return x_pose
 
@@ -78,7 +133,7 @@ class KinematicsBasics():
         Uses position + velocity
         y vectors to compute inverse differentiable kinematics
         """
-        invJ = torch.linalg.pinv(self.Jacobian)
+        invJ = self.frame.pseudo_inverse()
         qdot = invJ @ xdot
 
         #check if unstable:
@@ -104,37 +159,44 @@ class KinematicsBasics():
         """
         xdot must be [vel_linear, vel_quaternion]
         """
-        H = self.quaternion_operations.map_angular_quat(angle_quaternion=angle_quaternion)
-        E_tot = block_diag(np.eye(3), 2*H)
-
-        invJ_quat = torch.linalg.pinv(self.Jacobian) @ E_tot
+        invJ_quat = self.frame.pseudo_inverse_quat(angle_quaternion)
         qdot =  invJ_quat @ xdot
 
         self.check_instability_jacobian(invJ=invJ_quat)
         return qdot
 
     ### ----------------- Inverse 2nd-order differentiable kinematics -------------------###
-    def inverse_2nd_kinematics_quat(self, q, qdot, xddot, angle_quaternion, Jac_prev):
+    def inverse_2nd_kinematics_quat(self, q, qdot, xddot, angle_quaternion):
         """
         xdot must be [vel_linear, vel_quaternion]
+        Jdot is the analytic derivative of the quaternion Jacobian at joint velocity qdot.
         """
-        H = self.quaternion_operations.map_angular_quat(angle_quaternion=angle_quaternion)
-        E_tot = block_diag(np.eye(3), 2*H)
         self.Jac_quat = self.diff_kinematics_quat(q, angle_quaternion)
-
-        invJ_quat = torch.linalg.pinv(self.Jacobian) @ E_tot
-        self.Jdot = (self.J_quat - Jac_prev)/self.dt
+        invJ_quat = self.frame.pseudo_inverse_quat(angle_quaternion)
+        self.Jdot = self.jacobian_quat_dot(qdot, angle_quaternion)
         qdot =  invJ_quat @ xddot - invJ_quat @ (self.Jdot @ qdot)
 
         self.check_instability_jacobian(invJ=invJ_quat)
         return qdot, self.Jac_quat, self.Jdot
 
+    def jacobian_quat_dot(self, qdot, angle_quaternion):
+        """
+        Time derivative of J_quat = E_inv J: E_inv Jdot + d(E_inv)/dt J,
+        with d(E_inv)/dt = diag(0, 0.5 H(quat_dot)^T) and quat_dot = 0.5 H^T J_w qdot (H is linear in the quaternion).
+        """
+        H, _, E_inv = self.frame.quaternion_maps(angle_quaternion)
+        qdot = np.asarray(qdot, dtype=float).reshape(-1)
+        J_w = self.Jacobian.numpy()[0][3:].astype(float)
+        quat_dot = 0.5 * H.transpose() @ (J_w @ qdot)
+        H_dot = self.quaternion_operations.map_angular_quat(angle_quaternion=quat_dot)
+        Jdot_quat = E_inv @ self.frame.jacobian_dot(qdot)
+        Jdot_quat[3:] += 0.5 * H_dot.transpose() @ J_w
+        return Jdot_quat
+
     def order2_inverse_diff_kinematics_quat(self, xddot, angle_quaternion, qdot):
-        H = self.quaternion_operations.map_angular_quat(angle_quaternion=angle_quaternion)
-        E_tot = block_diag(np.eye(3), 2*H)
-        E_inv = block_diag(np.eye(3), 0.5*H.transpose())
+        _, _, E_inv = self.frame.quaternion_maps(angle_quaternion)
 
-        invJ_quat = torch.linalg.pinv(self.Jacobian) @ E_tot
+        invJ_quat = self.frame.pseudo_inverse_quat(angle_quaternion)
         J_quat = E_inv @ self.Jacobian.numpy()[0]
         qddot =  invJ_quat @ (xddot - J_quat @ qdot)
         return qddot
@@ -0,0 +1,145 @@
+import numpy as np
+import torch
+from scipy.linalg import block_diag
+
+class KinematicsFrame():
+    """
+    Kinematics of the robot at one joint configuration q (one control tick), shared by all consumers of that tick:
+    the poses of all links, the end-effector Jacobian, its SVD (pseudo-inverse, nullspace projector, conditioning)
+    and the quaternion maps of the end-effector orientation.
+    Everything is computed lazily and cached until update() is called with a different q.
+    damping > 0 turns the pseudo-inverse into a damped least-squares inverse.
+    """
+    def __init__(self, chain, quaternion_operations, end_link_name="iiwa_link_7", root_link_name="iiwa_link_0", damping=0.):
+        self.chain = chain
+        self.quaternion_operations = quaternion_operations
+        self.end_link_name = end_link_name
+        self.root_link_name = root_link_name
+        self.damping = damping
+        self.q = None
+        self.clear()
+
+    def clear(self):
+        self._link_transforms = None
+        self._jacobian = None
+        self._eef_pose = None
+        self._svd = None
+        self._pseudo_inverse = None
+        self._nullspace_projector = None
+        self._quaternion = None
+        self._quaternion_maps = None
+        self._pseudo_inverse_quat = None
+
+    def update(self, q) -> bool:
+        """
+        Sets the configuration of the frame, returns True if it differs from the current one (a new tick).
+        """
+        q = np.array(q, dtype=float)
+        if self.q is not None and q.shape == self.q.shape and np.array_equal(q, self.q):
+            return False
+        self.q = q
+        self.clear()
+        return True
+
+    def link_matrix(self, link_name):
+        """
+        Homogeneous transformation (1 x 4 x 4 tensor) of link_name wrt the root of the chain
+        """
+        if self._link_transforms is None:
+            self._link_transforms = self.chain.forward_kinematics(self.q, end_only=False)
+        return self._link_transforms[link_name].get_matrix()
+
+    def jacobian(self):
+        """
+        Geometric Jacobian of the end-effector (1 x 6 x dof tensor)
+        """
+        if self._jacobian is None:
+            self._jacobian, self._eef_pose = self.chain.jacobian(self.q, ret_eef_pose=True)
+        return self._jacobian
+
+    def eef_pose(self):
+        self.jacobian()
+        return self._eef_pose
+
+    def jacobian_dot(self, qdot):
+        """
+        Analytic time derivative of the geometric Jacobian (6 x dof array) at joint velocity qdot.
+        Uses only the columns of J: with w_i = sum_{j<i} z_j qdot_j the angular velocity carrying joint axis i,
+            Jdot_v,i = w_i x J_v,i + z_i x sum_{j>=i} J_v,j qdot_j,    Jdot_w,i = w_i x z_i
+        (z_i = J_w,i for revolute joints, zero for prismatic ones).
+        """
+        J = self.jacobian()[0].numpy().astype(float)
+        J_v, J_w = J[:3], J[3:]
+        qdot = np.asarray(qdot, dtype=float).reshape(-1)
+        angular_parts = J_w * qdot
+        omega = np.cumsum(angular_parts, axis=1) - angular_parts
+        linear_tail = np.cumsum((J_v * qdot)[:, ::-1], axis=1)[:, ::-1]
+        Jdot = np.empty_like(J)
+        Jdot[:3] = np.cross(omega, J_v, axis=0) + np.cross(J_w, linear_tail, axis=0)
+        Jdot[3:] = np.cross(omega, J_w, axis=0)
+        return Jdot
+
+    ### ---------------- factorization of the Jacobian ------------------###
+    def factorization(self):
+        """
+        Reduced SVD (U, S, Vh) of the end-effector Jacobian, computed once per configuration
+        """
+        if self._svd is None:
+            self._svd = torch.linalg.svd(self.jacobian(), full_matrices=False)
+        return self._svd
+
+    def singular_values(self):
+        return self.factorization()[1][0].numpy()
+
+    def condition_number(self):
+        singular_values = self.singular_values()
+        if singular_values[-1] <= 0.:
+            return np.inf
+        return float(singular_values[0] / singular_values[-1])
+
+    def pseudo_inverse(self):
+        """
+        Pseudo-inverse of the Jacobian (1 x dof x 6 tensor), same cutoff as torch.linalg.pinv,
+        or the damped least-squares inverse V diag(s/(s^2 + damping^2)) U^T if damping > 0.
+        """
+        if self._pseudo_inverse is None:
+            U, S, Vh = self.factorization()
+            if self.damping > 0.:
+                S_inv = S / (S ** 2 + self.damping ** 2)
+            else:
+                cutoff = S[..., :1] * max(U.shape[-2], Vh.shape[-1]) * torch.finfo(S.dtype).eps
+                S_inv = torch.where(S > cutoff, 1. / S, torch.zeros_like(S))
+            self._pseudo_inverse = Vh.mH @ (S_inv[..., None] * U.mH)
+        return self._pseudo_inverse
+
+    def nullspace_projector(self):
+        """
+        Projector onto the nullspace of the Jacobian, I - J^+ J (dof x dof array)
+        """
+        if self._nullspace_projector is None:
+            J = self.jacobian()[0].numpy()
+            self._nullspace_projector = np.identity(J.shape[1]) - self.pseudo_inverse()[0].numpy() @ J
+        return self._nullspace_projector
+
+    def pseudo_inverse_quat(self, angle_quaternion):
+        """
+        Inverse of the quaternion Jacobian, J^+ E_tot (1 x dof x 7 tensor)
+        """
+        _, E_tot, _ = self.quaternion_maps(angle_quaternion)
+        if self._pseudo_inverse_quat is None:
+            self._pseudo_inverse_quat = self.pseudo_inverse() @ E_tot
+        return self._pseudo_inverse_quat
+
+    def quaternion_maps(self, angle_quaternion):
+        """
+        Maps between angular and quaternion velocities at the end-effector orientation:
+        H, E_tot = diag(I, 2H) and E_inv = diag(I, 0.5H^T)
+        """
+        if self._quaternion_maps is None or not np.array_equal(angle_quaternion, self._quaternion):
+            H = self.quaternion_operations.map_angular_quat(angle_quaternion=angle_quaternion)
+            E_tot = block_diag(np.eye(3), 2 * H)
+            E_inv = block_diag(np.eye(3), 0.5 * H.transpose())
+            self._quaternion = np.array(angle_quaternion, dtype=float)
+            self._quaternion_maps = (H, E_tot, E_inv)
+            self._pseudo_inverse_quat = None
+        return self._quaternion_maps
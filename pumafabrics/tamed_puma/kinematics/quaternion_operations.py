@@ -1,6 +1,6 @@
 import torch
-import pytorch_kinematics as pk
 import numpy as np
+from pumafabrics.tamed_puma.kinematics import quaternions
 import spatial_casadi as sc
 from scipy.linalg import block_diag
 import copy
@@ -17,9 +17,7 @@ class QuaternionOperations():
         q_v = q[1:4]
 
         if isinstance(p, np.ndarray):
-            pq_w = p_w*q_w - np.matmul(p_v, q_v)
-            pq_v = p_w*q_v + q_w*p_v + np.cross(p_v, q_v)
-            pq = np.append(pq_w, pq_v)
+            pq = quaternions.quat_product(p, q)
         elif isinstance(p, ca.SX):
             pq_w = p_w*q_w - ca.dot(p_v, q_v)
             pq_v = p_w*q_v + q_w*p_v + ca.cross(p_v, q_v)
@@ -29,38 +27,21 @@ class QuaternionOperations():
         return pq
 
     def quat_to_rot_matrix(self, quat):
-        if type(quat) == list:
-            quat = torch.FloatTensor(quat).cuda()
-        rot_matrix = pk.quaternion_to_matrix(quat)
-        return rot_matrix.cpu().detach().numpy()
+        if torch.is_tensor(quat):
+            quat = quat.cpu().detach().numpy()
+        return quaternions.quat_to_matrix(quat)
 
     def rot_matrix_to_quat(self, rot_matrix):
-        if type(rot_matrix) == list or type(rot_matrix) == np.ndarray:
-            rot_matrix = torch.FloatTensor(rot_matrix).cuda()
-        quat = pk.matrix_to_quaternion(rot_matrix)
-        return quat.T.cpu().detach().numpy()
+        if torch.is_tensor(rot_matrix):
+            rot_matrix = rot_matrix.cpu().detach().numpy()
+        quat = quaternions.matrix_to_quat(np.asarray(rot_matrix, dtype=float))
+        return quat.T
 
     def quat_vel_with_offset(self, quat_vel_NN, quat_offset):
-        a1 = quat_vel_NN[0]
-        v1 = quat_vel_NN[1:]
-        a2 = quat_offset[0]
-        v2 = quat_offset[1:]
-
-        qv_a = a1*a2 - np.dot(v1, v2)
-        qv_v = a1*v2 + a2*v1 + np.cross(v1, v2)
-        qv = np.append(qv_a, qv_v)
-        return qv
+        return quaternions.quat_product(quat_vel_NN, quat_offset)
 
     def map_angular_quat(self, angle_quaternion):
-        q0 = angle_quaternion[0]
-        q1 = angle_quaternion[1]
-        q2 = angle_quaternion[2]
-        q3 = angle_quaternion[3]
-        H = np.array([[-q1, q0, -q3, q2],
-                   [-q2, q3, q0, -q1],
-                   [-q3, -q2, q1, q0]
-                   ])
-        return H
+        return quaternions.map_angular_quat(angle_quaternion)
 
     def quat_vel_to_angular_vel(self, angle_quaternion, vel_quaternion):
         """
@@ -90,13 +71,7 @@ class QuaternionOperations():
 
     # --------------------------- check flips of quaternions -------------------------------#
     def check_quaternion_flipped(self, quat, quat_prev):
-        dist_quat = np.linalg.norm(quat - quat_prev)
-        if dist_quat > 1.0:
-            quat_new = -1*copy.deepcopy(quat)
-            "flip quaternion!"
-        else:
-            quat_new = copy.deepcopy(quat)
-        return quat_new
+        return quaternions.quat_flip(quat, quat_prev)
 
     def check_quaternion_initial(self, x_orientation, quat_offset):
         """Check that we start in hemisphere nearest to goal"""
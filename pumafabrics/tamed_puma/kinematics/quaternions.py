@@ -0,0 +1,117 @@
+"""
+Quaternion kernels on numpy arrays of shape (4,) or (N, 4), real part first ([w, x, y, z]).
+Same conventions as spatialmath (UnitQuaternion) and pytorch_kinematics, without constructing objects or tensors.
+"""
+import numpy as np
+
+def quat_product(p, q):
+    """
+    Quaternion product p * q
+    """
+    p = np.asarray(p, dtype=float)
+    q = np.asarray(q, dtype=float)
+    p_w, p_x, p_y, p_z = p[..., 0], p[..., 1], p[..., 2], p[..., 3]
+    q_w, q_x, q_y, q_z = q[..., 0], q[..., 1], q[..., 2], q[..., 3]
+    pq = np.empty(np.broadcast_shapes(p.shape, q.shape))
+    pq[..., 0] = p_w * q_w - p_x * q_x - p_y * q_y - p_z * q_z
+    pq[..., 1] = p_w * q_x + p_x * q_w + p_y * q_z - p_z * q_y
+    pq[..., 2] = p_w * q_y - p_x * q_z + p_y * q_w + p_z * q_x
+    pq[..., 3] = p_w * q_z + p_x * q_y - p_y * q_x + p_z * q_w
+    return pq
+
+def quat_right_matrix(quat):
+    """
+    Matrix R(q) with p * q = R(q) p (quaternion product), (4, 4) or (N, 4, 4)
+    """
+    quat = np.asarray(quat, dtype=float)
+    w, x, y, z = quat[..., 0], quat[..., 1], quat[..., 2], quat[..., 3]
+    R = np.empty(quat.shape[:-1] + (4, 4))
+    R[..., 0, 0], R[..., 0, 1], R[..., 0, 2], R[..., 0, 3] = w, -x, -y, -z
+    R[..., 1, 0], R[..., 1, 1], R[..., 1, 2], R[..., 1, 3] = x, w, z, -y
+    R[..., 2, 0], R[..., 2, 1], R[..., 2, 2], R[..., 2, 3] = y, -z, w, x
+    R[..., 3, 0], R[..., 3, 1], R[..., 3, 2], R[..., 3, 3] = z, y, -x, w
+    return R
+
+def quat_conjugate(quat):
+    return np.asarray(quat, dtype=float) * np.array([1., -1., -1., -1.])
+
+def quat_unit(quat):
+    """
+    Unit quaternion in the hemisphere w >= 0, as UnitQuaternion(quat).A
+    """
+    quat = np.asarray(quat, dtype=float)
+    quat = quat / np.linalg.norm(quat, axis=-1, keepdims=True)
+    return np.where(quat[..., :1] < 0, -quat, quat)
+
+def quat_inverse(quat):
+    """
+    Inverse of a unit quaternion, as UnitQuaternion(quat).inv().A
+    """
+    return quat_conjugate(quat_unit(quat))
+
+def quat_divide(p, q):
+    """
+    p / q of unit quaternions, as (UnitQuaternion(p) / UnitQuaternion(q)).A
+    """
+    return quat_unit(quat_product(quat_unit(p), quat_inverse(q)))
+
+def quat_flip(quat, quat_prev, threshold=1.0):
+    """
+    Flips quaternions to the hemisphere of the previous quaternions (distance of the quaternions above the threshold)
+    """
+    quat = np.asarray(quat, dtype=float)
+    distance = np.linalg.norm(quat - np.asarray(quat_prev, dtype=float), axis=-1, keepdims=True)
+    return np.where(distance > threshold, -quat, quat)
+
+def quat_to_matrix(quat):
+    """
+    Rotation matrix of a (not necessarily unit) quaternion, as pytorch_kinematics.quaternion_to_matrix
+    """
+    quat = np.asarray(quat, dtype=float)
+    w, x, y, z = quat[..., 0], quat[..., 1], quat[..., 2], quat[..., 3]
+    two_s = 2.0 / (w * w + x * x + y * y + z * z)
+    M = np.empty(quat.shape[:-1] + (3, 3))
+    M[..., 0, 0], M[..., 0, 1], M[..., 0, 2] = 1 - two_s * (y * y + z * z), two_s * (x * y - z * w), two_s * (x * z + y * w)
+    M[..., 1, 0], M[..., 1, 1], M[..., 1, 2] = two_s * (x * y + z * w), 1 - two_s * (x * x + z * z), two_s * (y * z - x * w)
+    M[..., 2, 0], M[..., 2, 1], M[..., 2, 2] = two_s * (x * z - y * w), two_s * (y * z + x * w), 1 - two_s * (x * x + y * y)
+    return M
+
+def matrix_to_quat(matrix):
+    """
+    Quaternion of a rotation matrix (..., 3, 3), as pytorch_kinematics.matrix_to_quaternion
+    (the best-conditioned of the four candidates, with the same sign)
+    """
+    matrix = np.asarray(matrix)
+    if not np.issubdtype(matrix.dtype, np.floating):
+        matrix = matrix.astype(float)
+    m00, m01, m02 = matrix[..., 0, 0], matrix[..., 0, 1], matrix[..., 0, 2]
+    m10, m11, m12 = matrix[..., 1, 0], matrix[..., 1, 1], matrix[..., 1, 2]
+    m20, m21, m22 = matrix[..., 2, 0], matrix[..., 2, 1], matrix[..., 2, 2]
+    q_abs = np.empty(matrix.shape[:-2] + (4,), dtype=matrix.dtype)
+    q_abs[..., 0] = 1. + m00 + m11 + m22
+    q_abs[..., 1] = 1. + m00 - m11 - m22
+    q_abs[..., 2] = 1. - m00 + m11 - m22
+    q_abs[..., 3] = 1. - m00 - m11 + m22
+    q_abs = np.sqrt(np.maximum(q_abs, 0.))
+    q_squared = q_abs ** 2
+    candidates = np.empty(matrix.shape[:-2] + (4, 4), dtype=matrix.dtype)
+    C = candidates
+    C[..., 0, 0], C[..., 0, 1], C[..., 0, 2], C[..., 0, 3] = q_squared[..., 0], m21 - m12, m02 - m20, m10 - m01
+    C[..., 1, 0], C[..., 1, 1], C[..., 1, 2], C[..., 1, 3] = m21 - m12, q_squared[..., 1], m10 + m01, m02 + m20
+    C[..., 2, 0], C[..., 2, 1], C[..., 2, 2], C[..., 2, 3] = m02 - m20, m10 + m01, q_squared[..., 2], m12 + m21
+    C[..., 3, 0], C[..., 3, 1], C[..., 3, 2], C[..., 3, 3] = m10 - m01, m20 + m02, m21 + m12, q_squared[..., 3]
+    candidates = candidates / (2.0 * np.maximum(q_abs[..., None], 0.1))
+    best = np.argmax(q_abs, axis=-1)[..., None, None]
+    return np.take_along_axis(candidates, best, axis=-2)[..., 0, :]
+
+def map_angular_quat(quat):
+    """
+    H(q) (3 x 4, or N x 3 x 4) with angular velocity = 2 H(q) qdot
+    """
+    quat = np.asarray(quat, dtype=float)
+    q0, q1, q2, q3 = quat[..., 0], quat[..., 1], quat[..., 2], quat[..., 3]
+    H = np.empty(quat.shape[:-1] + (3, 4))
+    H[..., 0, 0], H[..., 0, 1], H[..., 0, 2], H[..., 0, 3] = -q1, q0, -q3, q2
+    H[..., 1, 0], H[..., 1, 1], H[..., 1, 2], H[..., 1, 3] = -q2, q3, q0, -q1
+    H[..., 2, 0], H[..., 2, 1], H[..., 2, 2], H[..., 2, 3] = -q3, -q2, q1, q0
+    return H
@@ -10,6 +10,7 @@ import pytorch_kinematics as pk
 import torch
 from pumafabrics.tamed_puma.nullspace_control.iiwa_robotics_toolbox import iiwa
 from spatialmath import UnitQuaternion
+from pumafabrics.tamed_puma.kinematics.quaternions import matrix_to_quat
 
 class CartesianImpedanceController:
     def __init__(self, robot_name="iiwa14"):
@@ -74,11 +75,21 @@ class CartesianImpedanceController:
         D[5, 5] = rot_factor * D[5, 5]
         return D
 
-    def _elbow_cartesian_impedance_controller(self, q, qdot):
+    def frame_applicable(self, frame):
+        """
+        The kinematics frame of the controller can be used if it is the same chain (iiwa_link_0 to iiwa_link_7)
+        """
+        return frame is not None and frame.end_link_name == "iiwa_link_7" and frame.root_link_name == "iiwa_link_0"
+
+    def _elbow_cartesian_impedance_controller(self, q, qdot, frame=None):
         # Get elbow position and orientation from its pose
-        elbow_T = self.chain_elbow.forward_kinematics(q, end_only=False)["iiwa_link_3"].get_matrix()
+        if self.frame_applicable(frame):
+            frame.update(q)
+            elbow_T = frame.link_matrix("iiwa_link_3")
+        else:
+            elbow_T = self.chain_elbow.forward_kinematics(q, end_only=False)["iiwa_link_3"].get_matrix()
         position_elbow = torch.Tensor.numpy(elbow_T[:, :3, 3])[0]
-        orientation_elbow = torch.Tensor.numpy(pk.matrix_to_quaternion(elbow_T[:, :3, :3]))[0]
+        orientation_elbow = matrix_to_quat(torch.Tensor.numpy(elbow_T[:, :3, :3]))[0]
 
         #differentiable kinematics
         J_elbow = self.robot.jacob0(q, end='iiwa_link_3', start='iiwa_link_0')
@@ -98,14 +109,21 @@ class CartesianImpedanceController:
         torque_arm[:3] = torque_elbow
         return torque_arm
 
-    def _nullspace_control(self, q, qdot):
+    def _nullspace_control(self, q, qdot, frame=None):
+        """
+        frame: optional KinematicsFrame of the current tick, to reuse its elbow pose and end-effector Jacobian
+        """
         # Get torque elbow's control
-        torque = self._elbow_cartesian_impedance_controller(q, qdot)
-
-        # Get nullspace matrix
-        J = self.chain_endeff.jacobian(q, ret_eef_pose=False)[0].numpy()
-        #J = self.robot.jacob0(q, end='iiwa_link_7', start='iiwa_link_0')
-        nullspace = (np.identity(self.n_joints) - np.matmul(J.T, np.linalg.pinv(J).T))
+        torque = self._elbow_cartesian_impedance_controller(q, qdot, frame=frame)
+
+        # Get nullspace matrix (from the SVD of the tick's Jacobian if a frame is given)
+        if self.frame_applicable(frame):
+            frame.update(q)
+            nullspace = frame.nullspace_projector().T
+        else:
+            J = self.chain_endeff.jacobian(q, ret_eef_pose=False)[0].numpy()
+            #J = self.robot.jacob0(q, end='iiwa_link_7', start='iiwa_link_0')
+            nullspace = (np.identity(self.n_joints) - np.matmul(J.T, np.linalg.pinv(J).T))
 
         # Map elbow's torque to ee's nullspace
         nullspace_torque = np.matmul(nullspace, torque)
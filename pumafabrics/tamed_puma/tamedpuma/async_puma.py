@@ -0,0 +1,154 @@
+import copy
+import threading
+import time
+import numpy as np
+from pumafabrics.tamed_puma.utils.latency_profiler import LatencyProfiler
+from pumafabrics.tamed_puma.tamedpuma.goal_context import GoalContext
+
+class DoubleBuffer():
+    """
+    Single-writer double buffer: the writer fills the slot that is not published and then flips the published index.
+    A reader always gets a complete value without locking (the flip is one attribute assignment).
+    """
+    def __init__(self):
+        self.slots = [None, None]
+        self.published = 0
+        self.sequence = 0
+
+    def write(self, value):
+        slot = 1 - self.published
+        self.slots[slot] = value
+        self.sequence += 1
+        self.published = slot
+
+    def read(self):
+        return self.slots[self.published]
+
+class AsyncPUMAExecutor():
+    """
+    Runs PUMAControl.request_PUMA in a worker thread at its own rate (rate [Hz]), while the control loop
+    (fabrics and CPM/FPM combination) keeps running at the control rate with the most recent PUMA output.
+    The control loop publishes the state of every tick with submit(...), the worker evaluates PUMA on the latest
+    submitted state and publishes (qddot_PUMA, transition_info) with latest().
+    The worker has its own kinematics (Jacobian history and frame), normalizations and goal context (a copy of
+    goal_context, without energy regulator), the network is shared. Only the worker evaluates the network.
+
+    The output of latest() is computed from the state of an earlier tick (at least one tick old): its desired state
+    does not belong to the q and qdot of the current tick. It can be used by the FPM combination, but not by the
+    energy regulator of CPM, which needs the desired state at the current configuration.
+
+    Metrics: staleness, the age of the state the returned PUMA output was computed from at the moment it is used,
+    and deadline misses of the worker (PUMA evaluations that took longer than its period).
+    """
+    def __init__(self, puma_controller, rate: float, goal_context: GoalContext, max_staleness=None, capacity=4096):
+        self.puma_controller = copy.copy(puma_controller)
+        self.puma_controller.kuka_kinematics = puma_controller.kuka_kinematics.independent_copy()
+        self.puma_controller.normalizations = puma_controller.normalizations.independent_copy()
+        self.puma_controller.profiler = LatencyProfiler(enabled=False)
+        self.goal_context = GoalContext(self.puma_controller.normalizations, goal_context.goal_NN, goal_context.dim_task,
+                                        tolerance=goal_context.tolerance)
+        self.period = 1. / rate
+        self.max_staleness = max_staleness if max_staleness is not None else self.period
+        self.inputs = DoubleBuffer()
+        self.outputs = DoubleBuffer()
+        self.staleness = np.zeros(capacity)
+        self.capacity = capacity
+        self.n_used = 0
+        self.n_stale = 0
+        self.n_updates = 0
+        self.deadline_misses = 0
+        self.worker_times = np.zeros(capacity)
+        self._new_input = threading.Event()
+        self._first_output = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.exception = None
+
+    def start(self):
+        """
+        Starts the worker, outputs of a previous start are discarded
+        """
+        self.stop()
+        self.outputs = DoubleBuffer()
+        self.goal_context.reset()
+        self.exception = None
+        self._first_output.clear()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._worker, name="PUMA", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._new_input.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def submit(self, q, qdot, x_t, xee_orientation, offset_orientation, goal_pos):
+        """
+        Publishes the state and goal of the current tick of the control loop to the worker
+        """
+        self.inputs.write((time.perf_counter(), np.array(q), np.array(qdot), copy.deepcopy(x_t), np.array(xee_orientation),
+                           np.array(offset_orientation), np.array(goal_pos)))
+        self._new_input.set()
+
+    def latest(self, timeout=None):
+        """
+        Most recent (qddot_PUMA, transition_info), waits for the first output of the worker (at most timeout [s]).
+        """
+        if not self._first_output.wait(timeout):
+            raise TimeoutError("PUMA worker did not publish an output within %s s" % timeout)
+        if self.exception is not None:
+            raise self.exception
+        time_input, qddot_PUMA, transition_info = self.outputs.read()
+        staleness = time.perf_counter() - time_input
+        self.staleness[self.n_used % self.capacity] = staleness
+        self.n_used += 1
+        if staleness > self.max_staleness:
+            self.n_stale += 1
+        return qddot_PUMA, transition_info
+
+    def _worker(self):
+        sequence = 0
+        try:
+            while not self._stop.is_set():
+                self._new_input.wait()
+                self._new_input.clear()
+                if self._stop.is_set() or self.inputs.sequence == sequence:
+                    continue
+                time_start = time.perf_counter()
+                sequence = self.inputs.sequence
+                time_input, q, qdot, x_t, xee_orientation, offset_orientation, goal_pos = self.inputs.read()
+                self.goal_context.update(goal_pos, offset_orientation)
+                qddot_PUMA, transition_info = self.puma_controller.request_PUMA(q=q, qdot=qdot, x_t=x_t,
+                                                                                xee_orientation=xee_orientation,
+                                                                                offset_orientation=offset_orientation,
+                                                                                translation_cpu=self.goal_context.translation_cpu)
+                self.outputs.write((time_input, qddot_PUMA, transition_info))
+                self._first_output.set()
+                worker_time = time.perf_counter() - time_start
+                self.worker_times[self.n_updates % self.capacity] = worker_time
+                self.n_updates += 1
+                if worker_time > self.period:
+                    self.deadline_misses += 1
+                else:
+                    self._stop.wait(self.period - worker_time)
+        except Exception as exception:
+            self.exception = exception
+            self._first_output.set()
+
+    def metrics(self) -> dict:
+        """
+        Staleness of the used PUMA outputs and worker times in ms (p50, p95, max), stale ticks and worker deadline misses
+        """
+        staleness = self.staleness[:min(self.n_used, self.capacity)] * 1000
+        worker_times = self.worker_times[:min(self.n_updates, self.capacity)] * 1000
+        metrics = {"n_used": self.n_used,
+                   "n_updates": self.n_updates,
+                   "stale_ticks": self.n_stale,
+                   "deadline_misses": self.deadline_misses}
+        for name, values in [("staleness", staleness), ("worker_time", worker_times)]:
+            if len(values) > 0:
+                p50, p95 = np.percentile(values, [50, 95])
+                metrics[name] = {"p50": float(p50), "p95": float(p95), "max": float(np.max(values))}
+        return metrics
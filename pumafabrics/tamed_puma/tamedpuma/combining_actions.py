@@ -1,4 +1,33 @@
 import numpy as np
+from scipy.linalg import cho_factor, cho_solve, LinAlgError
+
+def solve_metric(M, f, eps=1e-6):
+    """
+    Solution x of (M + eps*I) x = f for a numeric (symmetric positive semi-definite) metric M, via the Cholesky factor
+    of the regularized metric. Equal to pinv(M + eps*I) f as in planner.Minv, which is the fallback if M + eps*I is not
+    positive definite.
+    """
+    M_reg = np.array(M, dtype=float) + eps * np.identity(len(M))
+    f = np.asarray(f, dtype=float)
+    try:
+        factor = cho_factor(M_reg, check_finite=False)
+    except LinAlgError:
+        return np.linalg.pinv(M_reg) @ f
+    return cho_solve(factor, f, check_finite=False)
+
+def solve_metric_batch(M, f, eps=1e-6):
+    """
+    Batched solve_metric for M (N x n x n) and f (N x n), e.g. N time steps or robots.
+    """
+    M_reg = np.array(M, dtype=float) + eps * np.identity(M.shape[-1])
+    f = np.asarray(f, dtype=float)[..., None]
+    try:
+        L = np.linalg.cholesky(M_reg)
+    except np.linalg.LinAlgError:
+        return (np.linalg.pinv(M_reg) @ f)[..., 0]
+    y = np.linalg.solve(L, f)
+    return np.linalg.solve(np.swapaxes(L, -1, -2), y)[..., 0]
+
 class combine_fabrics_safeMP():
     def __init__(self, v_min=0, v_max=0, acc_min=0, acc_max=0):
         self.v_min = v_min
@@ -7,7 +36,7 @@ class combine_fabrics_safeMP():
         self.acc_max = acc_max
 
     def combine_action(self, M_avoidance, M_attractor, f_avoidance, f_attractor, xddot_speed, planner, qdot = []):
-        xddot_combined = -np.dot(planner.Minv(M_avoidance + M_attractor), f_avoidance + f_attractor) + xddot_speed
+        xddot_combined = -solve_metric(M_avoidance + M_attractor, f_avoidance + f_attractor) + xddot_speed
         if planner._mode == "vel":
             action_combined = qdot + planner._time_step * xddot_combined
         else:
@@ -17,9 +46,20 @@ class combine_fabrics_safeMP():
         action = self.get_action_in_limits(action_combined, mode=planner._mode)
         return action
 
+    def combine_action_batch(self, M_avoidance, M_attractor, f_avoidance, f_attractor, xddot_speed, planner, qdot=None):
+        """
+        combine_action for a batch (N x dof x dof metrics, N x dof forces and speed terms, N x dof qdot)
+        """
+        xddot_combined = -solve_metric_batch(M_avoidance + M_attractor, f_avoidance + f_attractor) + xddot_speed
+        if planner._mode == "vel":
+            action_combined = qdot + planner._time_step * xddot_combined
+        else:
+            action_combined = xddot_combined
+        return self.get_action_in_limits(action_combined, mode=planner._mode)
+
     def get_action_in_limits(self, action_old, mode="acc"):
         if mode == "vel":
             action = np.clip(action_old, self.v_min, self.v_max)
         else:
             action = np.clip(action_old, self.acc_min, self.acc_max)
-        return action
\ No newline at end of file
+        return action
@@ -1,14 +1,24 @@
+import os
+import hashlib
 import numpy as np
 import torch
 import casadi as ca
 
+# version of the saved dq/dx function, increase if the symbolic construction changes
+DXDQ_FUNCTION_VERSION = 1
+
 class energy_regulation():
     def __init__(self, dim_task=2, dof=7, mode_NN="2nd", dynamical_system=None):
         self.dim_task=dim_task
         self.dof = dof
         self.mode_NN = mode_NN
         self.potential_NN = dynamical_system.model.potential_from_encoder
+        self.potential_NN_gradient = dynamical_system.model.potential_and_gradient_from_encoder
+        self.device = dynamical_system.device
         self.dxdq_fun = None
+        self.dxdq_fun_map = None
+        self.dxdq_map_size = None
+        self.dxdq_parameters = {}
 
     def gpu_to_cpu(self, x_gpu):
         x_cpu = x_gpu.cpu().detach().numpy()
@@ -20,27 +30,60 @@ class energy_regulation():
         x_NN = normalizations.normalize_pose_to_NN([x_pose], translation_cpu, offset_orientation)
         dxdq = ca.jacobian(x_NN[0], qq)
         self.dxdq_fun = ca.Function("q_to_x", [qq], [dxdq], ["q"], ["dxdq"])
+        self.dxdq_fun_map = None
+        self.dxdq_parameters = {}
+        return self.dxdq_fun
+
+    def relationship_dq_dx_parametrized(self, offset_orientation, translation_cpu, kuka_kinematics, normalizations, fk, file_name=None):
+        """
+        Same as relationship_dq_dx, but the translation and orientation offset of the goal are inputs of the function.
+        The symbolic Jacobian is therefore only constructed once, a change of goal only requires set_dqdx_parameters.
+        If file_name is given, the function is loaded from that file if it exists, otherwise it is saved to it.
+        The file name gets a hash of the robot and normalization (see dxdq_function_key), a different urdf or dof
+        therefore does not reuse the function of another robot.
+        """
+        if file_name is not None:
+            root, extension = os.path.splitext(file_name)
+            file_name = root + "_" + self.dxdq_function_key(kuka_kinematics, normalizations, fk) + extension
+        if file_name is not None and os.path.exists(file_name):
+            self.dxdq_fun = ca.Function.load(file_name)
+        else:
+            qq = fk._q_ca
+            translation_sym = ca.SX.sym("translation", normalizations.dof_task)
+            offset_orientation_sym = ca.SX.sym("offset_orientation", 4)
+            x_pose, _ = kuka_kinematics.forward_kinematics_symbolic(fk=fk)
+            x_NN = normalizations.normalize_pose_to_NN([x_pose], translation_sym, offset_orientation_sym)
+            dxdq = ca.jacobian(x_NN[0], qq)
+            self.dxdq_fun = ca.Function("q_to_x", [qq, translation_sym, offset_orientation_sym], [dxdq],
+                                        ["q", "translation", "offset_orientation"], ["dxdq"])
+            if file_name is not None:
+                self.dxdq_fun.save(file_name)
+        self.dxdq_fun_map = None
+        self.set_dqdx_parameters(offset_orientation, translation_cpu)
         return self.dxdq_fun
 
+    def dxdq_function_key(self, kuka_kinematics, normalizations, fk):
+        """
+        Hash of everything that determines the symbolic dq/dx function: urdf, links, dof, task dimension,
+        casadi version and DXDQ_FUNCTION_VERSION
+        """
+        description = [getattr(fk, "_urdf", None), kuka_kinematics.root_link_name, kuka_kinematics.end_link_name,
+                       fk._q_ca.shape[0], normalizations.dof_task, ca.__version__, DXDQ_FUNCTION_VERSION]
+        return hashlib.sha256(repr(description).encode()).hexdigest()[:16]
+
+    def set_dqdx_parameters(self, offset_orientation, translation_cpu):
+        """
+        Update the goal-dependent inputs of the function created by relationship_dq_dx_parametrized.
+        For read_dqdx_batch, they can also be stacked per configuration: (N x 4) and (N x dim_task).
+        """
+        self.dxdq_parameters = {"translation": translation_cpu, "offset_orientation": offset_orientation}
+
     def compute_potential_and_gradient(self, x_t, mode_NN="2nd", dxdq=None, q=None):
         """
         Compute the gradient of the potential function at position x_t
         """
-        if torch.is_tensor(x_t):
-            if mode_NN=="2nd":
-                x_t_zero_vel = x_t
-                x_t_zero_vel[0][self.dim_task:] = torch.zeros((1, self.dim_task))
-            else:
-                x_t_zero_vel = x_t
-        else:
-            print("x_t must be torch tensor")
-            x_t_zero_vel = torch.FloatTensor([x_t]).cuda() #todo adapt!!
-
-        #---  gradient using Jacobian function of Pytorch ---#
-        with torch.no_grad():
-            potential_torch = self.potential_NN(x_t_zero_vel)
-            grad_potential_torch = torch.autograd.functional.jacobian(self.potential_NN, x_t_zero_vel)
-            grad_potential = self.gpu_to_cpu(grad_potential_torch[0][0][0])
+        potential_torch, grad_potential_batch = self.compute_potential_and_gradient_batch(x_t, mode_NN=mode_NN)
+        grad_potential = grad_potential_batch[0]
         if self.dxdq_fun is not None:
             dxdq = self.read_dqdx(q=q)
             grad_potential_q = grad_potential[0:self.dim_task] @ dxdq
@@ -48,6 +91,28 @@ class energy_regulation():
         else:
             return potential_torch, grad_potential
 
+    def compute_potential_and_gradient_batch(self, x_t, mode_NN="2nd", q=None):
+        """
+        Compute the potential and its gradient for a batch of states x_t (batch_size x dim_state) in one pass.
+        If q (batch_size x dof) is given and the dq/dx relationship is constructed, the gradient is given wrt q.
+        """
+        if not torch.is_tensor(x_t):
+            x_t = torch.FloatTensor(np.atleast_2d(np.array(x_t))).to(self.device)
+        if mode_NN == "2nd":
+            x_t_zero_vel = x_t.clone()
+            x_t_zero_vel[:, self.dim_task:] = 0.
+        else:
+            x_t_zero_vel = x_t
+
+        potential_torch, grad_potential_torch = self.potential_NN_gradient(x_t_zero_vel)
+        grad_potential = grad_potential_torch.cpu().numpy()
+        if q is not None and self.dxdq_fun is not None:
+            dxdq = self.read_dqdx_batch(q=q)
+            grad_potential_q = np.einsum("bi,bij->bj", grad_potential[:, 0:self.dim_task], dxdq)
+            return potential_torch, grad_potential_q
+        else:
+            return potential_torch, grad_potential
+
     def compute_energy_regulator(self, x_t_NN, qdot, M, beta=0., alpha=0.05, mode_NN="2nd", dxdq=None, q=None):
         """get energy regulator by NN via theorem III.5 in https://arxiv.org/pdf/2309.07368.pdf"""
         _, grad_potential = self.compute_potential_and_gradient(x_t_NN, mode_NN=mode_NN, dxdq=dxdq, q=q)
@@ -76,11 +141,50 @@ class energy_regulation():
         system_energized = h_tilde + f_energized
         return system_energized
 
+    def compute_energy_regulator_batch(self, x_t_NN, qdot, M, q=None, beta=0., alpha=0.05, mode_NN="2nd"):
+        """
+        Batched version of compute_energy_regulator for N states: x_t_NN (N x dim_state), qdot (N x dof), M (N x dof x dof).
+        """
+        _, grad_potential = self.compute_potential_and_gradient_batch(x_t_NN, mode_NN=mode_NN, q=q)
+        qdot = np.asarray(qdot)
+        fraction_denominator = np.einsum("bi,bij,bj->b", qdot, M, qdot) + 0.000001
+        fraction_term = np.einsum("bi,bj->bij", qdot, qdot) / fraction_denominator[:, None, None]
+        energy_regulator = -alpha * np.einsum("bij,bj->bi", fraction_term, grad_potential[:, 0:self.dof]) - beta * qdot
+        return energy_regulator
+
+    def energized_system_batch(self, qdot, M_lambda, h_tilde, f, beta=0, gamma=0):
+        """
+        Batched version of energized_system for N states: qdot, h_tilde, f (N x dof), M_lambda (N x dof x dof).
+        """
+        qdot = np.asarray(qdot)
+        denumerator = np.einsum("bi,bij,bj->b", qdot, M_lambda, qdot) + 0.00001
+        alpha_f = - np.einsum("bi,bij,bj->b", qdot, M_lambda, f) / denumerator
+        lambdda = gamma * alpha_f
+        f_energized = f + lambdda[:, None] * qdot - beta * qdot
+        system_energized = h_tilde + f_energized
+        return system_energized
+
     def read_dqdx(self, q):
-        dxdq_dict = self.dxdq_fun(q=q)
+        dxdq_dict = self.dxdq_fun(q=q, **self.dxdq_parameters)
         dxdq = dxdq_dict["dxdq"].full()
         return dxdq
 
+    def read_dqdx_batch(self, q):
+        """
+        Evaluates dx/dq for a batch of joint configurations q (N x dof) in one call, returns (N x dim_x x dof).
+        The goal parameters are either shared or given per configuration (N x dim), see set_dqdx_parameters.
+        """
+        q = np.asarray(q)
+        batch_size = q.shape[0]
+        parameters = {key: np.asarray(value).T if np.ndim(value) == 2 else value for key, value in self.dxdq_parameters.items()}
+        if batch_size == 1:
+            return self.dxdq_fun(q=q[0], **parameters)["dxdq"].full()[None]
+        if self.dxdq_fun_map is None or self.dxdq_map_size != batch_size:
+            self.dxdq_fun_map = self.dxdq_fun.map(batch_size)
+            self.dxdq_map_size = batch_size
+        dxdq = self.dxdq_fun_map(q=q.T, **parameters)["dxdq"].full()
+        return dxdq.reshape(dxdq.shape[0], batch_size, self.dof).transpose(1, 0, 2)
+
     def compute_action_theorem_III5(self, q, qdot, qddot_attractor, action_avoidance, M_avoidance, transition_info, weight_attractor=0.25):
         energy_regulator = self.compute_energy_regulator(transition_info["desired state"], qdot,
                                                          M_avoidance,
@@ -90,4 +194,16 @@ class energy_regulation():
                                               h_tilde=action_avoidance,
                                               f=weight_attractor * qddot_attractor[0:self.dof])
         action_fabrics_safeMP = h_f_energized + energy_regulator
-        return action_fabrics_safeMP
\ No newline at end of file
+        return action_fabrics_safeMP
+
+    def compute_action_theorem_III5_batch(self, q, qdot, qddot_attractor, action_avoidance, M_avoidance, x_t_NN, weight_attractor=0.25):
+        """
+        Batched version of compute_action_theorem_III5 for N (candidate) states, all inputs are stacked along the first axis.
+        """
+        qddot_attractor = np.asarray(qddot_attractor)
+        energy_regulator = self.compute_energy_regulator_batch(x_t_NN, qdot, M_avoidance, q=q, mode_NN=self.mode_NN)
+        h_f_energized = self.energized_system_batch(qdot=qdot, M_lambda=M_avoidance,
+                                                    h_tilde=action_avoidance,
+                                                    f=weight_attractor * qddot_attractor[:, 0:self.dof])
+        action_fabrics_safeMP = h_f_energized + energy_regulator
+        return action_fabrics_safeMP
@@ -35,6 +35,26 @@ class ExampleGeneric:
         if n_steps is not None:
             self.params["n_steps"] = n_steps
 
+    def reset_run_state(self):
+        """
+        Clears the results of a previous run: flags, solver times, latency profile, minimal distance and the histories of
+        the kinematics and PD controller. Constructed planners, kinematic chains and loaded models are kept.
+        """
+        self.GOAL_REACHED = False
+        self.IN_COLLISION = False
+        self.time_to_goal = float("nan")
+        self.solver_times = []
+        if hasattr(self, "utils_analysis"):
+            self.utils_analysis.reset()
+        if hasattr(self, "fabrics_controller"):
+            self.fabrics_controller.solver_times = []
+        if hasattr(self, "kuka_kinematics"):
+            self.kuka_kinematics.reset_history()
+        if hasattr(self, "pdcontroller"):
+            self.pdcontroller.reset()
+        if hasattr(self, "profiler"):
+            self.profiler.reset()
+
     def integrate_to_vel(self, qdot, action_acc, dt):
         qdot_action = action_acc *dt +qdot
         return qdot_action
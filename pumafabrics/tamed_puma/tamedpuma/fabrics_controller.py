@@ -1,15 +1,23 @@
 import os, time
+import hashlib
 import numpy as np
+import casadi as ca
 from forwardkinematics.urdfFks.generic_urdf_fk import GenericURDFFk
 from mpscenes.goals.goal_composition import GoalComposition
-from pumafabrics.tamed_puma.tamedpuma.parametrized_planner_extended import ParameterizedFabricPlannerExtended
-import pytorch_kinematics as pk
-import torch
+from pumafabrics.tamed_puma.tamedpuma.parametrized_planner_extended import ParameterizedFabricPlannerExtended, COMPILED_FORMAT_VERSION
+from pumafabrics.tamed_puma.tamedpuma.obstacle_culling import ObstacleCulling
+from pumafabrics.tamed_puma.utils.analysis_utils import DistanceEngine
+from pumafabrics.tamed_puma.kinematics.quaternions import quat_to_matrix
+
+# unused obstacle slots are parked far away from the robot
+DUMMY_OBSTACLE_POSITION = (10., 10., 10.)
+DUMMY_OBSTACLE_SIZE = 0.5
 
 class FabricsController:
     def __init__(self, params):
         self.update_params(params)
         self.solver_times = []
+        self.obstacle_culling = None
 
     def update_params(self, params):
         self.params = params
@@ -44,15 +52,38 @@ class FabricsController:
         absolute_path = os.path.dirname(os.path.abspath(__file__))
         with open(absolute_path + "/../config/urdfs/"+self.params["robot_name"]+".urdf", "r", encoding="utf-8") as file:
             urdf = file.read()
+        self.urdf = urdf
         self.forward_kinematics = GenericURDFFk(
             urdf,
             root_link=self.params["root_link"],
             end_links=self.params["end_links"],
         )
 
+    def planner_cache_key(self, planner, goal, nr_plane_constraints):
+        """
+        Hash of everything that determines the symbolic fabric: urdf, links, number of obstacles and constraints,
+        limits, modes and the geometry/finsler strings of the planner, and the format version of the compiled
+        functions and the casadi version. Goal positions and weights are inputs of the fabric, so only the structure
+        of the goal is included.
+        """
+        goal_structure = None
+        if goal is not None:
+            goal_structure = {name: {key: str(value) for key, value in dict(sub_goal).items() if key not in ("desired_position", "weight")}
+                              for name, sub_goal in dict(goal._config).items()}
+        description = [self.urdf, self.params["root_link"], self.params["end_links"], self.params["collision_links"],
+                       self.params["nr_obst"], nr_plane_constraints, self.params["iiwa_limits"], self.params["dof"],
+                       self.params["mode"], self.params["dt"], self.params["bool_extensive_concretize"],
+                       self.params["bool_speed_control"], goal_structure, repr(getattr(planner, "_config", None)),
+                       self.params.get("bool_obstacle_slots", False), COMPILED_FORMAT_VERSION, ca.__version__]
+        return hashlib.sha256(repr(description).encode()).hexdigest()[:16]
+
     def set_planner(self, goal: GoalComposition, nr_plane_constraints=1):
         """
         Initializes the fabric planner.
+        If params["bool_obstacle_slots"] is True, the params["nr_obst"] obstacles are slots with an activation weight,
+        see obstacle_slots. Scenes with fewer obstacles then do not require a new planner.
+        If params["fabrics_codegen"] is True, the concretized functions are compiled to C and cached on disk, later
+        runs with the same fabric load the shared libraries instead of constructing the symbolic fabric.
         """
         self.construct_fk()
         planner = ParameterizedFabricPlannerExtended(
@@ -60,24 +91,95 @@ class FabricsController:
             self.forward_kinematics,
             time_step=self.params["dt"],
         )
+        if self.params.get("fabrics_codegen", False):
+            cache_dir = self.params.get("fabrics_cache_dir", os.path.expanduser("~/.cache/pumafabrics/fabrics"))
+            cache_dir = os.path.join(cache_dir, self.planner_cache_key(planner, goal, nr_plane_constraints))
+            if planner.load_compiled(cache_dir):
+                return planner, self.forward_kinematics
+
         planner.set_components(
             collision_links=self.params["collision_links"],
             goal=goal,
             number_obstacles=self.params["nr_obst"],
             number_plane_constraints=nr_plane_constraints, #todo
             limits=self.params["iiwa_limits"],
+            obstacle_activation=self.params.get("bool_obstacle_slots", False),
         )
         planner.concretize_extensive(mode=self.params["mode"], time_step=self.params["dt"], extensive_concretize=self.params["bool_extensive_concretize"], bool_speed_control=self.params["bool_speed_control"])
+        if self.params.get("fabrics_codegen", False):
+            planner.export_compiled(cache_dir)
         return planner, self.forward_kinematics
 
+    def static_arguments(self):
+        """
+        Arguments that do not change between steps: the collision radii of the links and the plane constraint.
+        """
+        arguments_dict = dict(constraint_0=np.array([0, 0, 1, 0.0]))
+        for i, collision_link in enumerate(self.params["collision_links"]):
+            arguments_dict["radius_body_" + collision_link] = list(self.params["collision_radii"].values())[i]
+        return arguments_dict
+
+    def obstacle_slots(self, obstacles: list, q=None):
+        """
+        Fills the params["nr_obst"] obstacle slots: the obstacles get weight 1, the remaining slots are parked far away
+        with weight 0. If there are more obstacles than slots, the nearest ones are selected by the obstacle culling
+        (if set and q is given), otherwise the first ones.
+        Returns x_obsts (nr_obst x 3), radius_obsts (nr_obst,) and weight_obsts (nr_obst,), overwritten by the next call.
+        """
+        n_slots = self.params["nr_obst"]
+        if not hasattr(self, "_slots_x_obsts") or len(self._slots_x_obsts) != n_slots:
+            self._slots_x_obsts = np.zeros((n_slots, 3))
+            self._slots_radius_obsts = np.zeros(n_slots)
+            self._slots_weight_obsts = np.zeros(n_slots)
+        if q is not None and len(obstacles) > n_slots and self.obstacle_culling is not None:
+            x_obsts, radius_obsts = self.obstacle_culling.select(q, obstacles=obstacles)
+            n_active = len(self.obstacle_culling.selected_indices)
+            self._slots_x_obsts[:] = x_obsts
+            self._slots_radius_obsts[:] = radius_obsts
+        else:
+            n_active = min(len(obstacles), n_slots)
+            self._slots_x_obsts[:] = DUMMY_OBSTACLE_POSITION
+            self._slots_radius_obsts[:] = DUMMY_OBSTACLE_SIZE
+            if n_active > 0:
+                positions, sizes = DistanceEngine.obstacle_arrays(obstacles[:n_active])
+                self._slots_x_obsts[:n_active] = positions
+                self._slots_radius_obsts[:n_active] = sizes
+        self._slots_weight_obsts[:n_active] = 1.
+        self._slots_weight_obsts[n_active:] = 0.
+        return self._slots_x_obsts, self._slots_radius_obsts, self._slots_weight_obsts
+
+    def obstacle_arguments(self, obstacles: list, q=None):
+        """
+        Obstacle arguments of the dictionary based planner calls
+        """
+        if not self.params.get("bool_obstacle_slots", False):
+            return dict(x_obsts=[obstacles[i]["position"] for i in range(len(obstacles))],
+                        radius_obsts=[obstacles[i]["size"] for i in range(len(obstacles))])
+        x_obsts, radius_obsts, weight_obsts = self.obstacle_slots(obstacles, q=q)
+        arguments_dict = dict(x_obsts=list(x_obsts), radius_obsts=[radius_obsts[i:i+1] for i in range(len(radius_obsts))])
+        for i, weight in enumerate(weight_obsts):
+            arguments_dict["weight_obst_%i" % i] = weight
+        return arguments_dict
+
     def set_avoidance_planner(self, goal=None):
         self.planner_avoidance, self.fk = self.set_planner(goal=goal, nr_plane_constraints=0)
+        # prepared call with a fixed argument layout, see compute_action_avoidance_prepared
+        self.prepared_avoidance = None
+        if getattr(self.planner_avoidance, "_funs_avoidance", None) is not None:
+            self.prepared_avoidance = self.planner_avoidance.prepare_call("_funs_avoidance", **self.static_arguments())
+            self.set_obstacles_prepared(self.prepared_avoidance, [])
+        self.prepared_avoidance_batch = None
+        self.qddot_speed_prepared = np.zeros((self.params["dof"],))
         return self.planner_avoidance, self.fk
 
     def set_full_planner(self, goal:GoalComposition):
         self.planner_full, self.fk = self.set_planner(goal=goal)
         # rotation matrix for the goal orientation:
-        self.rot_matrix = pk.quaternion_to_matrix(torch.FloatTensor(self.params["orientation_goal"]).cuda()).cpu().detach().numpy()
+        self.rot_matrix = quat_to_matrix(self.params["orientation_goal"])
+        # prepared call with a fixed argument layout, see compute_action_full_prepared
+        self.prepared_full = self.planner_full.prepare_call("_funs", **self.static_arguments())
+        self.set_obstacles_prepared(self.prepared_full, [])
+        self.goal_prepared = False
         return self.planner_full, self.fk
 
     def compute_action_full(self, q, qdot, obstacles: list, goal_pos=None, weight_goal_0=None, weight_goal_3=1., x_goal_3=0., goal_orient=None, weight_goal_1=None, weight_goal_2=None):
@@ -94,7 +196,7 @@ class FabricsController:
         if weight_goal_2 is None:
             weight_goal_2 = self.weight_goal_2
         if goal_orient is not None:
-            self.rot_matrix = pk.quaternion_to_matrix(torch.FloatTensor(goal_orient).cuda()).cpu().detach().numpy()
+            self.rot_matrix = quat_to_matrix(goal_orient)
 
         arguments_dict = dict(
             q=q,
@@ -107,10 +209,9 @@ class FabricsController:
             weight_goal_2= weight_goal_2,
             x_goal_3=x_goal_3,
             weight_goal_3 = weight_goal_3,
-            x_obsts=[obstacles[i]["position"] for i in range(len(obstacles))],
-            radius_obsts=[obstacles[i]["size"] for i in range(len(obstacles))],
             # radius_body_links=self.params["collision_radii"],
             constraint_0=[0, 0, 1, 0],
+            **self.obstacle_arguments(obstacles, q=q),
         )
         for i, collision_link in enumerate(self.params["collision_links"]):
             arguments_dict["radius_body_"+collision_link] = list(self.params["collision_radii"].values())[i]
@@ -119,15 +220,14 @@ class FabricsController:
         self.solver_times.append(time.perf_counter() - time0)
         return action, [], [], []
 
-    def compute_action_avoidance(self, q, qdot, obstacles):
+    def avoidance_arguments(self, q, qdot, obstacles):
         nr_obst = self.params["nr_obst"]
         if nr_obst>0:
             arguments_dict = dict(
                 q=q,
                 qdot=qdot,
-                x_obsts=[obstacles[i]["position"] for i in range(len(obstacles))],
-                radius_obsts=[obstacles[i]["size"] for i in range(len(obstacles))],
-                constraint_0=np.array([0, 0, 1, 0.0]))
+                constraint_0=np.array([0, 0, 1, 0.0]),
+                **self.obstacle_arguments(obstacles, q=q))
             for i, collision_link in enumerate(self.params["collision_links"]):
                 arguments_dict["radius_body_" + collision_link] = list(self.params["collision_radii"].values())[i]
         else:
@@ -137,11 +237,143 @@ class FabricsController:
                 constraint_0=np.array([0, 0, 1, 0.0]))
             for i, collision_link in enumerate(self.params["collision_links"]):
                 arguments_dict["radius_body_" + collision_link] = list(self.params["collision_radii"].values())[i]
+        return arguments_dict
 
+    def compute_action_avoidance(self, q, qdot, obstacles):
+        arguments_dict = self.avoidance_arguments(q=q, qdot=qdot, obstacles=obstacles)
         M_avoidance, f_avoidance, action_avoidance, xddot_speed_avoidance = self.planner_avoidance.compute_M_f_action_avoidance(
             **arguments_dict)
         qddot_speed = np.zeros((self.params["dof"],))  # todo: think about what to do with speed regulation term!!
         return action_avoidance, M_avoidance, f_avoidance, qddot_speed
 
+    def compute_action_avoidance_batch(self, q, qdot, obstacles):
+        """
+        Avoidance action for N robots/scenarios in one (casadi map) call of the prepared avoidance planner.
+        q and qdot are (N x dof), obstacles is either one list of obstacles shared by all, or a list of N lists.
+        The inputs of every robot are written into its row of one (N x n_inputs) buffer, in the layout of
+        prepared_avoidance (the obstacle slots per robot, as set_obstacles_prepared).
+        Returns action (N x dof), M (N x dof x dof), f (N x dof), qddot_speed (N x dof), overwritten by the next call.
+        """
+        batch_size = len(q)
+        if len(obstacles) > 0 and isinstance(obstacles[0], (list, tuple)):
+            obstacles_list = obstacles
+        else:
+            obstacles_list = [obstacles] * batch_size
+        if self.prepared_avoidance_batch is None or self.prepared_avoidance_batch.batch_size != batch_size:
+            self.prepared_avoidance_batch = self.prepared_avoidance.batch(batch_size)
+            self.qddot_speed_batch = np.zeros((batch_size, self.params["dof"]))
+        for i, item in enumerate(self.prepared_avoidance_batch.items):
+            item.set_inputs(q=q[i], qdot=qdot[i])
+            self.set_obstacles_prepared(item, obstacles_list[i], q=q[i])
+        outputs = self.prepared_avoidance_batch.evaluate()
+        return outputs["action"], outputs["M"], outputs["f"], self.qddot_speed_batch
+
+    def set_goal_prepared(self, goal_pos=None, weight_goal_0=None, goal_orient=None, weight_goal_1=None, weight_goal_2=None,
+                          x_goal_3=0., weight_goal_3=1.):
+        """
+        Writes the goal into the buffers of the prepared full planner, with the same defaults as compute_action_full.
+        """
+        if goal_pos is None:
+            goal_pos = self.goal_pos
+        if weight_goal_0 is None:
+            weight_goal_0 = self.weight_goal_0
+        if weight_goal_1 is None:
+            weight_goal_1 = self.weight_goal_1
+        if weight_goal_2 is None:
+            weight_goal_2 = self.weight_goal_2
+        if goal_orient is not None:
+            self.rot_matrix = quat_to_matrix(goal_orient)
+
+        buffers = self.prepared_full.buffers
+        goal_arguments = dict(x_goal_0=goal_pos[0:3], weight_goal_0=weight_goal_0, weight_goal_1=weight_goal_1,
+                              weight_goal_2=weight_goal_2, x_goal_3=x_goal_3, weight_goal_3=weight_goal_3)
+        self.prepared_full.set_inputs(**{name: value for name, value in goal_arguments.items() if name in buffers})
+        if "x_goal_1" in buffers:
+            np.matmul(self.rot_matrix, self.x_goal_1_x, out=buffers["x_goal_1"])
+        if "x_goal_2" in buffers:
+            np.matmul(self.rot_matrix, self.x_goal_2_z, out=buffers["x_goal_2"])
+        self.goal_prepared = True
+
+    def compute_action_full_prepared(self, q, qdot, x_obsts=None, radius_obsts=None, weight_obsts=None, **goal_arguments):
+        """
+        Same as compute_action_full, but with the argument layout fixed at set_full_planner.
+        x_obsts (nr_obst x 3), radius_obsts (nr_obst,) and weight_obsts (nr_obst,) for planners with obstacle slots
+        are arrays, None keeps the values in the buffers, which can also be written directly via
+        self.prepared_full.buffers["x_obsts"] (or by set_obstacles_prepared). The goal is only rewritten if goal_arguments
+        (see set_goal_prepared) are given. The returned action is overwritten by the next call.
+        """
+        time0 = time.perf_counter()
+        if len(goal_arguments) > 0 or not self.goal_prepared:
+            self.set_goal_prepared(**goal_arguments)
+        self.prepared_full.set_inputs(q=q, qdot=qdot, x_obsts=x_obsts, radius_obsts=radius_obsts, weight_obsts=weight_obsts)
+        action = self.prepared_full.evaluate()["action"]
+        self.solver_times.append(time.perf_counter() - time0)
+        return action, [], [], []
+
+    def set_obstacles_prepared(self, prepared, obstacles: list, q=None):
+        """
+        Copies the positions and sizes of a list of obstacle dictionaries into the buffers of a prepared call
+        (or of one item of a prepared batch call),
+        for planners with obstacle slots including the activation weights (see obstacle_slots).
+        Without obstacle slots, the slots that are not used by the obstacles are parked far away.
+        """
+        if "x_obsts" not in prepared.buffers:
+            return
+        if "weight_obsts" in prepared.buffers:
+            x_obsts, radius_obsts, weight_obsts = self.obstacle_slots(obstacles, q=q)
+            prepared.set_inputs(x_obsts=x_obsts, radius_obsts=radius_obsts, weight_obsts=weight_obsts)
+            return
+        x_obsts = prepared.buffers["x_obsts"]
+        radius_obsts = prepared.buffers["radius_obsts"]
+        n_obstacles = min(len(obstacles), len(x_obsts))
+        for i in range(n_obstacles):
+            x_obsts[i] = obstacles[i]["position"]
+            radius_obsts[i:i+1] = obstacles[i]["size"]
+        x_obsts[n_obstacles:] = DUMMY_OBSTACLE_POSITION
+        radius_obsts[n_obstacles:] = DUMMY_OBSTACLE_SIZE
+
+    def compute_action_avoidance_prepared(self, q, qdot, x_obsts=None, radius_obsts=None, weight_obsts=None):
+        """
+        Same as compute_action_avoidance, but with the argument layout fixed at set_avoidance_planner.
+        x_obsts (nr_obst x 3), radius_obsts (nr_obst,) and weight_obsts (nr_obst,) for planners with obstacle slots
+        are arrays, None keeps the values in the buffers.
+        The returned arrays are overwritten by the next call.
+        """
+        self.prepared_avoidance.set_inputs(q=q, qdot=qdot, x_obsts=x_obsts, radius_obsts=radius_obsts, weight_obsts=weight_obsts)
+        outputs = self.prepared_avoidance.evaluate()
+        return outputs["action"], outputs["M"], outputs["f"], self.qddot_speed_prepared
+
+    def set_obstacle_culling(self, k_per_link=None):
+        """
+        Culling of large obstacle sets: every tick the nearest obstacles of the collision links fill the
+        params["nr_obst"] obstacle slots of the planners, see compute_action_avoidance_culled.
+        """
+        if k_per_link is None:
+            k_per_link = self.params.get("culling_k_per_link", 2)
+        self.obstacle_culling = ObstacleCulling(forward_kinematics=self.fk,
+                                                collision_links=self.params["collision_links"],
+                                                collision_radii=self.params["collision_radii"],
+                                                n_slots=self.params["nr_obst"],
+                                                k_per_link=k_per_link,
+                                                parent_link=self.params["root_link"])
+        return self.obstacle_culling
+
+    def compute_action_avoidance_culled(self, q, qdot, obstacles=None):
+        """
+        Same as compute_action_avoidance, but only the culled obstacles are passed to the planner.
+        obstacles: list of all obstacles of the scene, None keeps the obstacles of the previous call.
+        """
+        x_obsts, radius_obsts = self.obstacle_culling.select(q, obstacles=obstacles)
+        n_culled = len(x_obsts)
+        weight_obsts = None
+        if self.params.get("bool_obstacle_slots", False):
+            # only the selected obstacles are active, the padded slots are parked
+            n_culled = len(self.obstacle_culling.selected_indices)
+            weight_obsts = (np.arange(len(x_obsts)) < n_culled).astype(float)
+        if self.prepared_avoidance is not None:
+            return self.compute_action_avoidance_prepared(q, qdot, x_obsts=x_obsts, radius_obsts=radius_obsts, weight_obsts=weight_obsts)
+        obstacles_culled = [{"position": x_obsts[i], "size": radius_obsts[i:i+1]} for i in range(n_culled)]
+        return self.compute_action_avoidance(q, qdot, obstacles_culled)
+
     def request_solver_times(self):
         return self.solver_times
\ No newline at end of file
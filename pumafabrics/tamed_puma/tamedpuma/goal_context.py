@@ -0,0 +1,51 @@
+import numpy as np
+
+class GoalContext():
+    """
+    Goal-dependent state of PUMA: the translation of the goal wrt the goal of the network (cpu and device), the
+    quaternion offset and the goal inputs of the dq/dx function of the energy regulator (if given).
+    update(...) only recomputes them if the goal position or orientation moved more than tolerance (per coordinate)
+    since the last recomputation, otherwise the cached values (and device tensor) are reused.
+    The goal in latent space used by the potential is that of the goal of the network, which the translation and offset
+    map the system goal onto, it is cached by the network itself.
+    """
+    def __init__(self, normalizations, goal_NN, dim_task, tolerance=0., energy_regulation_class=None):
+        self.normalizations = normalizations
+        self.goal_NN = goal_NN
+        self.dim_task = dim_task
+        self.tolerance = tolerance
+        self.energy_regulation_class = energy_regulation_class
+        self.reset()
+
+    def reset(self):
+        self.goal_pos = None
+        self.offset_orientation = None
+        self.translation_cpu = None
+        self.translation_gpu = None
+        self.n_updates = 0
+
+    def changed(self, goal_pos, offset_orientation=None) -> bool:
+        if self.goal_pos is None:
+            return True
+        if np.max(np.abs(np.asarray(goal_pos, dtype=float) - self.goal_pos)) > self.tolerance:
+            return True
+        return offset_orientation is not None and np.max(np.abs(np.asarray(offset_orientation, dtype=float) - self.offset_orientation)) > self.tolerance
+
+    def update(self, goal_pos, offset_orientation=None) -> bool:
+        """
+        Recomputes the goal-dependent state if the goal changed, returns True if it was recomputed
+        """
+        if not self.changed(goal_pos, offset_orientation):
+            return False
+        self.goal_pos = np.array(goal_pos, dtype=float)
+        self.offset_orientation = np.array(offset_orientation, dtype=float) if offset_orientation is not None else None
+        if self.dim_task == 7 and self.offset_orientation is not None:
+            state_goal = np.append(self.goal_pos, self.offset_orientation)
+        else:
+            state_goal = self.goal_pos
+        self.translation_gpu, self.translation_cpu = self.normalizations.translation_goal(state_goal=state_goal,
+                                                                                         goal_NN=self.goal_NN)
+        if self.energy_regulation_class is not None:
+            self.energy_regulation_class.set_dqdx_parameters(self.offset_orientation, self.translation_cpu)
+        self.n_updates += 1
+        return True
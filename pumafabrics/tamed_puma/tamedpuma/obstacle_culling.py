@@ -0,0 +1,72 @@
+import numpy as np
+from scipy.spatial import cKDTree
+from pumafabrics.tamed_puma.utils.analysis_utils import DistanceEngine
+
+class ObstacleCulling():
+    """
+    Selects the obstacles that are passed to a fabric planner concretized for a fixed number of obstacle slots.
+    A KD-tree over the obstacle centers (rebuilt only when the obstacles move) gives the k nearest obstacles of every
+    collision link; the candidates with the smallest clearance fill the slots, the remaining slots get a dummy obstacle
+    far away. The cost per tick depends on the number of links and slots, not on the number of obstacles in the scene.
+    """
+    def __init__(self, forward_kinematics, collision_links: list, collision_radii: dict, n_slots: int, k_per_link=2,
+                 parent_link="iiwa_link_0", dummy_position=(10., 10., 10.), dummy_size=0.5):
+        self.distance_engine = DistanceEngine(forward_kinematics=forward_kinematics,
+                                              collision_links=collision_links,
+                                              collision_radii=collision_radii)
+        self.n_slots = n_slots
+        self.k_per_link = k_per_link
+        self.parent_link = parent_link
+        self.dummy_position = np.array(dummy_position, dtype=float)
+        self.dummy_size = dummy_size
+        self.x_obsts = np.tile(self.dummy_position, (n_slots, 1))
+        self.radius_obsts = np.full(n_slots, dummy_size, dtype=float)
+        self.selected_indices = np.zeros(0, dtype=int)
+        self._tree = None
+        self._positions = np.zeros((0, 3))
+        self._sizes = np.zeros(0)
+
+    def set_obstacles(self, obstacles: list):
+        """
+        Obstacles of the scene as a list of dictionaries with "position" and "size".
+        """
+        positions, sizes = self.distance_engine.obstacle_arrays(obstacles)
+        self.set_obstacle_arrays(positions, sizes)
+
+    def set_obstacle_arrays(self, positions: np.ndarray, sizes: np.ndarray):
+        """
+        Obstacles of the scene as arrays, positions (n_obstacles x 3) and sizes (n_obstacles,).
+        """
+        sizes = np.asarray(sizes, dtype=float).reshape(-1)
+        if self._tree is not None and positions.shape == self._positions.shape and np.array_equal(positions, self._positions):
+            self._sizes = sizes
+            return
+        self._positions = np.array(positions, dtype=float).reshape(-1, 3)
+        self._sizes = sizes
+        self._tree = cKDTree(self._positions) if len(self._positions) > 0 else None
+
+    def select(self, q: np.ndarray, obstacles=None):
+        """
+        Fills the slots for configuration q, returns x_obsts (n_slots x 3) and radius_obsts (n_slots,).
+        The returned arrays are overwritten by the next call.
+        """
+        if obstacles is not None:
+            self.set_obstacles(obstacles)
+        self.x_obsts[:] = self.dummy_position
+        self.radius_obsts[:] = self.dummy_size
+        n_obstacles = len(self._positions)
+        if n_obstacles == 0 or self.n_slots == 0:
+            self.selected_indices = np.zeros(0, dtype=int)
+            return self.x_obsts, self.radius_obsts
+
+        link_positions = self.distance_engine.link_positions(q, parent_link=self.parent_link)
+        k = min(self.k_per_link, n_obstacles)
+        _, indices = self._tree.query(link_positions, k=k)
+        candidates = np.unique(np.reshape(indices, -1))
+        if len(candidates) > self.n_slots:
+            clearances = self.distance_engine.clearance_matrix(link_positions, self._positions[candidates], self._sizes[candidates])
+            candidates = candidates[np.argsort(np.min(clearances, axis=0))[:self.n_slots]]
+        self.selected_indices = candidates
+        self.x_obsts[:len(candidates)] = self._positions[candidates]
+        self.radius_obsts[:len(candidates)] = self._sizes[candidates]
+        return self.x_obsts, self.radius_obsts
@@ -1,13 +1,268 @@
 import logging
+import os
+import pickle
+import subprocess
+from copy import deepcopy
 import casadi as ca
 import numpy as np
 from fabrics.planner.parameterized_planner import ParameterizedFabricPlanner
 from fabrics.helpers.casadiFunctionWrapper import CasadiFunctionWrapper
+from fabrics.diffGeometry.energized_geometry import WeightedGeometry
+from fabrics.diffGeometry.energy import Lagrangian
+from fabrics.components.leaves.geometry import ObstacleLeaf, LimitLeaf, SelfCollisionLeaf
 from forwardkinematics.fksCommon.fk import ForwardKinematics
+
+# version of the functions and metadata written by export_compiled, increase if the concretized functions change
+COMPILED_FORMAT_VERSION = 3
+
+class CasadiFunctionWrapperCompiled(CasadiFunctionWrapper):
+    """
+    CasadiFunctionWrapper of a compiled function (shared library) loaded with ca.external.
+    No symbolic variables are needed: the input names come from the library and the default arguments are stored
+    next to it by ParameterizedFabricPlannerExtended.export_compiled.
+    """
+    def __init__(self, name: str, library_path: str, argument_dictionary: dict, expression_keys: list):
+        self._name = name
+        self._function = ca.external(name, library_path)
+        self._inputs = {input_name: None for input_name in self._function.name_in()}
+        self._expressions = {key: None for key in expression_keys}
+        self._argument_dictionary = argument_dictionary
+
+    def evaluate(self, **kwargs):
+        self.process_inputs(**kwargs)
+        output_dict = self._function(**{name: self._argument_dictionary[name] for name in self._inputs})
+        for key, value in output_dict.items():
+            if value.size()[1] == 1:
+                output_dict[key] = np.array(value)[:, 0]
+            else:
+                output_dict[key] = np.array(value)
+        return output_dict
+
+class CasadiFunctionWrapperCSE(CasadiFunctionWrapper):
+    """
+    CasadiFunctionWrapper with common subexpression elimination, for functions with many outputs that share terms.
+    """
+    def create_function(self):
+        try:
+            self._function = ca.Function(self._name, list(self._inputs.values()), list(self._expressions.values()),
+                                         list(self._inputs.keys()), list(self._expressions.keys()), {"cse": True})
+        except RuntimeError:
+            # casadi < 3.6 has no cse option, the outputs still share the nodes of the SX graph
+            super().create_function()
+
+def processed_arguments(funs: CasadiFunctionWrapper, arguments: dict) -> dict:
+    """
+    Argument dictionary of funs updated with the given keyword arguments (as in funs.evaluate), without changing the
+    argument dictionary of funs itself.
+    """
+    argument_dictionary = funs._argument_dictionary
+    funs._argument_dictionary = dict(argument_dictionary)
+    try:
+        funs.process_inputs(**arguments)
+        return funs._argument_dictionary
+    finally:
+        funs._argument_dictionary = argument_dictionary
+
+def bind_buffers(function: ca.Function, inputs: list, outputs: list):
+    """
+    Binds flat (column-major) input and output arrays to a casadi function, returns (buffer, evaluate).
+    evaluate() evaluates the function on the current values of the inputs and writes into the outputs.
+    """
+    try:
+        buffer, evaluate = function.buffer()
+        for i, array in enumerate(inputs):
+            buffer.set_arg(i, memoryview(array))
+        for i, array in enumerate(outputs):
+            buffer.set_res(i, memoryview(array))
+        return buffer, evaluate
+    except AttributeError:
+        # casadi < 3.6 has no function buffers, evaluate with positional arguments instead
+        def evaluate():
+            results = function.call([np.reshape(array, function.size_in(i), order="F") for i, array in enumerate(inputs)])
+            for array, result in zip(outputs, results):
+                array[:] = np.reshape(result.full(), (-1,), order="F")
+        return None, evaluate
+
+class PreparedInputs(object):
+    """
+    Named views (buffers) into the input buffer of a prepared call.
+    """
+    def __init__(self, buffers: dict):
+        self.buffers = buffers
+
+    def set_inputs(self, **kwargs):
+        """
+        Copies the given values into the input buffers, None values (and empty obstacle lists) are skipped.
+        """
+        for name, value in kwargs.items():
+            if value is None or (name not in self.buffers and np.size(value) == 0):
+                continue
+            np.copyto(self.buffers[name], np.reshape(value, self.buffers[name].shape))
+
+class PreparedCall(PreparedInputs):
+    """
+    Evaluation of a concretized function with an argument layout that is fixed once.
+    All inputs are views into one flat buffer (the obstacles contiguous, as x_obsts (n x 3), radius_obsts (n,) and
+    for planners with obstacle slots weight_obsts (n,)),
+    the outputs are preallocated arrays. A step only writes the changing values into the buffers and evaluates,
+    without constructing dictionaries or matching input names.
+    Note that the output arrays are overwritten by the next evaluation.
+    """
+    def __init__(self, funs: CasadiFunctionWrapper, arguments: dict):
+        super().__init__(buffers={})
+        argument_dictionary = processed_arguments(funs, arguments)
+        function = funs.function()
+        if not all(function.sparsity_out(i).is_dense() for i in range(function.n_out())):
+            inputs_mx = function.mx_in()
+            function = ca.Function(function.name() + "_dense", inputs_mx, [ca.densify(output) for output in function.call(inputs_mx)],
+                                   function.name_in(), function.name_out())
+        self._function = function
+
+        # --- inputs: obstacles are placed after the other inputs, in order of their index --- #
+        input_names = function.name_in()
+        obstacle_prefixes = {"x_obsts": "x_obst_", "radius_obsts": "radius_obst_", "weight_obsts": "weight_obst_"}
+        def obstacle_index(name, prefix):
+            return int(name[len(prefix):]) if name.startswith(prefix) and name[len(prefix):].isdigit() else None
+        obstacle_names = {key: sorted([name for name in input_names if obstacle_index(name, prefix) is not None],
+                                      key=lambda name: obstacle_index(name, prefix))
+                          for key, prefix in obstacle_prefixes.items()}
+        layout = [name for name in input_names if not any(name in names for names in obstacle_names.values())]
+        layout += obstacle_names["x_obsts"] + obstacle_names["radius_obsts"] + obstacle_names["weight_obsts"]
+
+        self.flat_buffer = np.zeros(sum(function.numel_in(name) for name in input_names))
+        self.offsets = {}
+        offset = 0
+        for name in layout:
+            size = function.numel_in(name)
+            self.offsets[name] = offset
+            self.buffers[name] = self.flat_buffer[offset:offset + size]
+            if name in argument_dictionary:
+                self.buffers[name][:] = np.reshape(np.array(argument_dictionary[name], dtype=float), (-1,), order="F")
+            offset += size
+        for key, names in obstacle_names.items():
+            if len(names) > 0:
+                start, size = self.offsets[names[0]], function.numel_in(names[0])
+                self.offsets[key] = start
+                self.buffers[key] = self.flat_buffer[start:start + size * len(names)].reshape(len(names), size)
+        self._inputs = [self.buffers[name] for name in input_names]
+
+        # --- outputs: vectors as (n,), matrices as (n x m) views on column-major buffers --- #
+        self._outputs_flat = [np.zeros(function.numel_out(i)) for i in range(function.n_out())]
+        self.outputs = {}
+        for i, name in enumerate(function.name_out()):
+            n_rows, n_columns = function.size_out(i)
+            if n_columns == 1:
+                self.outputs[name] = self._outputs_flat[i]
+            else:
+                self.outputs[name] = self._outputs_flat[i].reshape(n_columns, n_rows).T
+        self._buffer, self._evaluate = bind_buffers(function, self._inputs, self._outputs_flat)
+
+    def evaluate(self) -> dict:
+        self._evaluate()
+        return self.outputs
+
+    def batch(self, batch_size: int) -> "PreparedBatchCall":
+        return PreparedBatchCall(self, batch_size)
+
+class PreparedBatchCall(object):
+    """
+    Evaluation of a prepared call for a batch (e.g. one item per robot) in one casadi map.
+    The inputs of all items are one (batch_size x n) buffer, whose rows have the layout of the flat buffer of the
+    prepared call and start as copies of it (with its static arguments). items[i].buffers are the views into row i,
+    with the names and shapes of prepared.buffers.
+    The outputs are stacked along the first axis, (N x n) vectors and (N x n x m) matrices, overwritten by the next
+    evaluation.
+    """
+    def __init__(self, prepared: PreparedCall, batch_size: int):
+        self.batch_size = batch_size
+        function = prepared._function
+
+        # function of the flat buffer of one item, mapped over the columns of an (n x batch_size) input
+        inputs_flat = ca.MX.sym("inputs", len(prepared.flat_buffer))
+        arguments = [ca.reshape(inputs_flat[prepared.offsets[name]:prepared.offsets[name] + function.numel_in(name)],
+                                function.size_in(name)) for name in function.name_in()]
+        function_flat = ca.Function(function.name() + "_flat", [inputs_flat], function.call(arguments),
+                                    ["inputs"], function.name_out())
+        self._function = function_flat.map(batch_size)
+
+        # --- inputs: row i of the (batch_size x n) buffer is column i of the column-major input of the map --- #
+        self.flat_buffer = np.tile(prepared.flat_buffer, (batch_size, 1))
+        self.items = []
+        for i in range(batch_size):
+            buffers = {name: self.flat_buffer[i, prepared.offsets[name]:prepared.offsets[name] + buffer.size].reshape(buffer.shape)
+                       for name, buffer in prepared.buffers.items()}
+            self.items.append(PreparedInputs(buffers))
+
+        # --- outputs: (r x c*batch_size) column-major, as (N x r) vectors and (N x r x c) matrices --- #
+        self._outputs_flat = [np.zeros(self._function.numel_out(i)) for i in range(self._function.n_out())]
+        self.outputs = {}
+        for i, name in enumerate(function.name_out()):
+            n_rows, n_columns = function.size_out(i)
+            if n_columns == 1:
+                self.outputs[name] = self._outputs_flat[i].reshape(batch_size, n_rows)
+            else:
+                self.outputs[name] = self._outputs_flat[i].reshape(batch_size, n_columns, n_rows).transpose(0, 2, 1)
+        self._buffer, self._evaluate = bind_buffers(self._function, [self.flat_buffer.reshape(-1)], self._outputs_flat)
+
+    def evaluate(self) -> dict:
+        self._evaluate()
+        return self.outputs
+
 class ParameterizedFabricPlannerExtended(ParameterizedFabricPlanner):
+    _compiled_functions = ["_funs", "_funs_full", "_funs_attractor", "_funs_avoidance", "_funs_fused"]
+    _geometry_groups = ["full", "attractor", "avoidance"]
+
     def __init__(self, dof: int, forward_kinematics: ForwardKinematics, time_step: float, **kwargs):
         super().__init__(dof=dof, forward_kinematics=forward_kinematics, **kwargs)
         self._time_step = time_step
+        self._funs_maps = {}
+        self._group_expressions = {}
+        self._obstacle_activation = False
+
+    def set_components(self, *args, obstacle_activation=False, **kwargs):
+        """
+        obstacle_activation: if True, the spherical obstacles are slots with an activation weight input weight_obst_i,
+        that scales the Finsler structure of all leaves of obstacle i. A slot with weight 0 does not contribute
+        to the fabric, so a planner concretized for N slots handles any number of obstacles up to N.
+        Inactive slots should be parked far away from the robot (a weight of 0 does not remove a singular geometry).
+        """
+        self._obstacle_activation = obstacle_activation
+        super().set_components(*args, **kwargs)
+
+    def add_spherical_obstacle_geometry(self, obstacle_name: str, collision_link_name: str, forward_kinematics: ca.SX) -> None:
+        if not self._obstacle_activation:
+            return super().add_spherical_obstacle_geometry(obstacle_name, collision_link_name, forward_kinematics)
+        geometry = ObstacleLeaf(self._variables, forward_kinematics, obstacle_name, collision_link_name)
+        geometry.set_geometry(self.config.collision_geometry)
+        geometry.set_finsler_structure(self.config.collision_finsler)
+        weight_name = f"weight_{obstacle_name}"
+        parameters = self._variables.parameters()
+        weight = parameters[weight_name] if weight_name in parameters else ca.SX.sym(weight_name, 1)
+        self._variables.add_parameters({weight_name: weight})
+        geometry._lag = Lagrangian(weight * geometry._lag._l, var=geometry._lag._vars)
+        self.add_leaf(geometry)
+
+    def set_base_geometry(self):
+        super().set_base_geometry()
+        self._goal_geometry = deepcopy(self._geometry)
+
+    def add_leaf(self, leaf, prime_leaf=False):
+        """
+        Joint limit and self-collision leaves are also added to the goal reaching geometry (see add_forcing_geometry),
+        the obstacle and constraint leaves only to the full geometry.
+        """
+        if isinstance(leaf, (LimitLeaf, SelfCollisionLeaf)):
+            self._goal_geometry += WeightedGeometry(g=leaf.geometry(), le=leaf.lagrangian()).pull(leaf.map())
+        super().add_leaf(leaf, prime_leaf)
+
+    def add_forcing_geometry(self, forward_map, lagrangian, geometry, prime_forcing_leaf):
+        """
+        Next to the forced geometry, the attractors are added to the goal reaching geometry: the base geometry with the
+        joint limits and self collision, without obstacles. The goal reaching geometry can then be evaluated separately
+        by the same planner, as a planner with only the goal and limits.
+        """
+        self._goal_geometry += WeightedGeometry(g=geometry, le=lagrangian).pull(forward_map)
+        super().add_forcing_geometry(forward_map, lagrangian, geometry, prime_forcing_leaf)
 
     ### ---- Additional functions if you would like to analyse geometry groups separately --- ####
     def add_speed_control(self, bool_speed_control=True):
@@ -61,13 +316,21 @@ class ParameterizedFabricPlannerExtended(ParameterizedFabricPlanner):
             self.extensive_concretize_geometries(speed_control_addition = diff_xddot_split)
 
         if mode == 'acc':
-            self._funs = CasadiFunctionWrapper(
-                "funs", self.variables, {"action": xddot}
-            )
+            action = xddot
         elif mode == 'vel':
             action = self._geometry.xdot() + time_step * xddot
-            self._funs = CasadiFunctionWrapper(
-                "funs", self.variables, {"action": action}
+        self._funs = CasadiFunctionWrapper(
+            "funs", self.variables, {"action": action}
+        )
+
+        if extensive_concretize == True:
+            # all geometry groups and the action in one function, evaluated at once with shared subexpressions
+            fused_expressions = {"action": action}
+            for group, expressions in self._group_expressions.items():
+                for key, expression in expressions.items():
+                    fused_expressions[key + "_" + group] = expression
+            self._funs_fused = CasadiFunctionWrapperCSE(
+                "funs_fused", self.variables, fused_expressions
             )
 
     def extensive_concretize_geometries(self, speed_control_addition):
@@ -82,7 +345,7 @@ class ParameterizedFabricPlannerExtended(ParameterizedFabricPlanner):
                 raise Exception("No time step passed in velocity mode.")
         try:
             self._geometry.concretize()
-            self._attractor_geometry = self._forced_geometry
+            self._attractor_geometry = self._goal_geometry
             self._attractor_geometry.concretize()
             self._forced_geometry.concretize()
 
@@ -117,14 +380,19 @@ class ParameterizedFabricPlannerExtended(ParameterizedFabricPlanner):
                 action_attractor = self._attractor_geometry.xdot() + self._time_step * xddot_attractor
                 action_avoidance = self._geometry.xdot() + self._time_step * xddot_avoidance
 
+            self._group_expressions = {
+                "full": {"action": action, "M":M_forced, "f":f_forced, "xddot_speed":speed_control_addition},
+                "attractor": {"action": action_attractor, "M":M_attractor, "f":f_attractor, "xddot_speed":speed_control_addition},
+                "avoidance": {"action": action_avoidance, "M":M_avoidance, "f":f_avoidance, "xddot_speed":speed_control_addition},
+            }
             self._funs_full = CasadiFunctionWrapper(
-                "funs_full", self.variables, {"action": action, "M":M_forced, "f":f_forced, "xddot_speed":speed_control_addition}
+                "funs_full", self.variables, self._group_expressions["full"]
             )
             self._funs_attractor = CasadiFunctionWrapper(
-                "funs_attractor", self.variables, {"action": action_attractor, "M":M_attractor, "f":f_attractor, "xddot_speed":speed_control_addition}
+                "funs_attractor", self.variables, self._group_expressions["attractor"]
             )
             self._funs_avoidance = CasadiFunctionWrapper(
-                "funs_attractor", self.variables, {"action": action_avoidance, "M":M_avoidance, "f":f_avoidance, "xddot_speed":speed_control_addition}
+                "funs_attractor", self.variables, self._group_expressions["avoidance"]
             )
         except:
             logging.warn("No forcing term, using pure geometry with energization.")
@@ -134,8 +402,11 @@ class ParameterizedFabricPlannerExtended(ParameterizedFabricPlanner):
             elif self._mode == 'vel':
                 action_avoidance = self._geometry.xdot() + self._time_step * xddot_avoidance
 
+            self._group_expressions = {
+                "avoidance": {"action": action_avoidance, "M":M_avoidance, "f":f_avoidance, "xddot_speed":speed_control_addition},
+            }
             self._funs_avoidance = CasadiFunctionWrapper(
-                "funs_attractor", self.variables, {"action": action_avoidance, "M":M_avoidance, "f":f_avoidance, "xddot_speed":speed_control_addition}
+                "funs_attractor", self.variables, self._group_expressions["avoidance"]
             )
 
     def compute_M_f_action(self, **kwargs):
@@ -156,6 +427,64 @@ class ParameterizedFabricPlannerExtended(ParameterizedFabricPlanner):
         M, f, action, xddot_speed = self.get_M_f_action(evaluations=evaluations)
         return M, f, action, xddot_speed
 
+    def compute_M_f_action_groups(self, **kwargs):
+        """
+        Evaluates the action of the planner and M, f, action and xddot_speed of all geometry groups
+        (full, attractor, avoidance) in one call of the fused function, instead of one call per group.
+        :return: action, dictionary {group: (M, f, action, xddot_speed)}
+        """
+        evaluations = self._funs_fused.evaluate(**kwargs)
+        return evaluations["action"], self.get_M_f_action_groups(evaluations=evaluations)
+
+    def compute_M_f_action_groups_batch(self, arguments_list: list):
+        evaluations = self.evaluate_batch(self._funs_fused, arguments_list)
+        return evaluations["action"], self.get_M_f_action_groups(evaluations=evaluations)
+
+    def compute_M_f_action_avoidance_batch(self, arguments_list: list):
+        evaluations = self.evaluate_batch(self._funs_avoidance, arguments_list)
+        M, f, action, xddot_speed = self.get_M_f_action(evaluations=evaluations)
+        return M, f, action, xddot_speed
+
+    def evaluate_batch(self, funs: CasadiFunctionWrapper, arguments_list: list):
+        """
+        Evaluates a concretized function for a batch of argument dictionaries (e.g. one per robot) in one call,
+        via a casadi map over the batch.
+        :param funs: CasadiFunctionWrapper, e.g. self._funs_avoidance.
+        :param arguments_list: list of N keyword dictionaries, as given to compute_M_f_action_avoidance.
+        :return: dictionary with the outputs stacked along the first axis, (N x n) vectors and (N x n x m) matrices.
+        """
+        batch_size = len(arguments_list)
+        function = funs.function()
+        input_names = function.name_in()
+        inputs_batch = {name: [] for name in input_names}
+        for arguments in arguments_list:
+            funs.process_inputs(**arguments)
+            for name in input_names:
+                inputs_batch[name].append(np.reshape(np.array(funs._argument_dictionary[name], dtype=float), (-1,)))
+        inputs_batch = {name: np.stack(values, axis=1) for name, values in inputs_batch.items()}
+
+        # construct the mapped function only once per batch size
+        map_key = (id(funs), batch_size)
+        if map_key not in self._funs_maps:
+            self._funs_maps[map_key] = function.map(batch_size)
+        outputs_batch = self._funs_maps[map_key](**inputs_batch)
+
+        evaluations = {}
+        for name, value in outputs_batch.items():
+            value = np.array(value)
+            n_rows, n_columns = value.shape[0], value.shape[1] // batch_size
+            value = value.reshape(n_rows, batch_size, n_columns).transpose(1, 0, 2)
+            evaluations[name] = value[:, :, 0] if n_columns == 1 else value
+        return evaluations
+
+    def prepare_call(self, attribute="_funs", **arguments) -> PreparedCall:
+        """
+        Fixes the argument layout of a concretized function, e.g. prepare_call("_funs_avoidance", radius_body_link=0.1).
+        :param attribute: name of the CasadiFunctionWrapper, e.g. "_funs", "_funs_avoidance" or "_funs_fused".
+        :param arguments: (static) arguments, as given to compute_action, which are written into the buffers once.
+        """
+        return PreparedCall(getattr(self, attribute), arguments)
+
     def get_M_f_action(self, evaluations):
         M = evaluations["M"]
         f = evaluations["f"]
@@ -163,6 +492,68 @@ class ParameterizedFabricPlannerExtended(ParameterizedFabricPlanner):
         xddot_speed = evaluations["xddot_speed"]
         return M, f, action, xddot_speed
 
+    def get_M_f_action_groups(self, evaluations):
+        groups = {}
+        for group in self._geometry_groups:
+            if "M_" + group in evaluations:
+                groups[group] = tuple(evaluations[key + "_" + group] for key in ["M", "f", "action", "xddot_speed"])
+        return groups
+
+    ### ---- Compiled (C code) functions --- ####
+    def export_compiled(self, directory: str, compiler="gcc", flags=("-O1",)):
+        """
+        Generates C code of the concretized functions, compiles them into shared libraries and stores them together
+        with their default arguments in directory, such that load_compiled can skip the symbolic construction.
+        """
+        os.makedirs(directory, exist_ok=True)
+        metadata = {"version": COMPILED_FORMAT_VERSION, "casadi": ca.__version__,
+                    "mode": self._mode, "time_step": self._time_step, "functions": {}}
+        for attribute in self._compiled_functions:
+            funs = getattr(self, attribute, None)
+            if funs is None:
+                metadata["functions"][attribute] = None
+                continue
+            function = funs.function()
+            file_name = attribute.strip("_")
+            code_generator = ca.CodeGenerator(file_name + ".c")
+            code_generator.add(function)
+            code_generator.generate(directory + "/")
+            subprocess.run([compiler, "-fPIC", "-shared", *flags, os.path.join(directory, file_name + ".c"),
+                            "-o", os.path.join(directory, "lib" + file_name + ".so")], check=True)
+            metadata["functions"][attribute] = {"name": function.name(),
+                                                "library": "lib" + file_name + ".so",
+                                                "argument_dictionary": dict(funs._argument_dictionary),
+                                                "expression_keys": list(funs._expressions.keys())}
+
+        # metadata is written last, an interrupted export is not considered valid
+        with open(os.path.join(directory, "metadata.pkl"), "wb") as file:
+            pickle.dump(metadata, file)
+
+    def load_compiled(self, directory: str) -> bool:
+        """
+        Loads the functions exported by export_compiled, returns False if there are none in directory, or if they
+        were exported by another format version or casadi version or lack one of the _compiled_functions.
+        """
+        metadata_file = os.path.join(directory, "metadata.pkl")
+        if not os.path.exists(metadata_file):
+            return False
+        with open(metadata_file, "rb") as file:
+            metadata = pickle.load(file)
+        if metadata.get("version", None) != COMPILED_FORMAT_VERSION or metadata.get("casadi", None) != ca.__version__ or \
+                any(attribute not in metadata["functions"] for attribute in self._compiled_functions):
+            return False
+        self._mode = metadata["mode"]
+        self._time_step = metadata["time_step"]
+        for attribute, function_metadata in metadata["functions"].items():
+            if function_metadata is None:
+                setattr(self, attribute, None)
+                continue
+            setattr(self, attribute, CasadiFunctionWrapperCompiled(name=function_metadata["name"],
+                                                                   library_path=os.path.join(directory, function_metadata["library"]),
+                                                                   argument_dictionary=function_metadata["argument_dictionary"],
+                                                                   expression_keys=function_metadata["expression_keys"]))
+        return True
+
     def Minv(self, M, eps=1e-6):
         """
         This is a copy of Minv as in spec.py, but where M and epsilon can be given as inputs.
@@ -1,19 +1,25 @@
 import numpy as np
 import importlib
+import torch
 from pumafabrics.tamed_puma.nullspace_control.nullspace_controller import CartesianImpedanceController
 from pumafabrics.tamed_puma.utils.normalizations_2 import normalization_functions
-from pumafabrics.puma_extension.initializer import initialize_framework
+from pumafabrics.tamed_puma.utils.compiled_normalizations import CompiledNormalization
+from pumafabrics.puma_extension.initializer import initialize_policy
+from pumafabrics.puma_extension.agent.utils.device_operations import set_inference_threads
+from pumafabrics.puma_extension.agent.compiled_transition import load_compiled_dynamical_system
+from pumafabrics.tamed_puma.utils.latency_profiler import LatencyProfiler
+from pumafabrics.tamed_puma.tamedpuma.raw_units_policy import RawUnitsPolicy
 
 class PUMAControl():
-    def __init__(self, params, kinematics, NULLSPACE=True):
+    def __init__(self, params, kinematics, NULLSPACE=True, profiler=None):
         self.update_params(params)
         self.kuka_kinematics = kinematics
         self.time_list = []
+        self.profiler = profiler if profiler is not None else LatencyProfiler(enabled=False)
         self.NULLSPACE = NULLSPACE
         if self.NULLSPACE:
             self.controller_nullspace = CartesianImpedanceController(robot_name=self.params["robot_name"])
-        self.Jac_dot_prev = np.zeros((self.params["dim_task"], self.params["dof"]))
-        self.Jac_prev = np.zeros((self.params["dim_task"], self.params["dof"]))
+        self.raw_policy = None
 
     def update_params(self, params):
         self.params = params
@@ -40,8 +46,11 @@ class PUMAControl():
         xddot_pos_quat = np.append(action_PUMA[:3], action_quat_acc_sys)
         return xddot_pos_quat
 
-    def initialize_PUMA(self, q_init, goal_pos, offset_orientation, results_base_directory=None):
-        # # Construct classes:
+    def load_PUMA(self, results_base_directory=None) -> bool:
+        """
+        Loads the PUMA policy (learner, training data and normalizations), once per parameter file.
+        Returns True if the policy was (re)loaded, False if the loaded policy is reused.
+        """
         if results_base_directory is None:
             results_base_directory = '../pumafabrics/puma_extension/'
 
@@ -51,6 +60,11 @@ class PUMAControl():
         else:
             self.params_name = self.params["params_name_2nd"]
         self.mode_NN_int = int(self.params["mode_NN"][0])
+        load_key = (self.params_name, results_base_directory, self.params.get("device", None), self.params["dim_task"],
+                    self.params["dt"], self.params.get("compiled_policy", None),
+                    self.params.get("bool_compiled_normalization", False), self.params.get("bool_raw_units_policy", False))
+        if getattr(self, "load_key", None) == load_key:
+            return False
         print("self.params_name:", self.params_name)
 
         # Load parameters
@@ -58,13 +72,32 @@ class PUMAControl():
         params = Params(results_base_directory)
         params.results_path += params.selected_primitives_ids + '/'
         params.load_model = True
+        params.device = self.params.get("device", None)  # cpu or cuda, default: cuda if available
+        self.results_path = params.results_path
 
-        # Initialize framework
-        learner, _, data = initialize_framework(params, self.params_name, verbose=False)
-        goal_NN = data['goals training'][0]
+        # Initialize policy (from model bundle if available)
+        self.learner, data = initialize_policy(params, self.params_name, verbose=False)
+        set_inference_threads(self.learner.device, n_threads=self.params.get("cpu_threads", 1))
+        self.goal_NN = data['goals training'][0]
 
         # Normalization class
-        self.normalizations = normalization_functions(x_min=data["x min"], x_max=data["x max"], dof_task=self.params["dim_task"], dt=self.params["dt"], mode_NN=self.params["mode_NN"], learner=learner)
+        self.normalizations = normalization_functions(x_min=data["x min"], x_max=data["x max"], dof_task=self.params["dim_task"], dt=self.params["dt"], mode_NN=self.params["mode_NN"], learner=self.learner)
+        if self.params.get("bool_compiled_normalization", False):
+            # precomputed affine maps per goal for the normalizations of every tick
+            self.normalizations = CompiledNormalization(self.normalizations)
+        self.dynamical_system = None
+        self.raw_policy = None
+        self.load_key = load_key
+        return True
+
+    def initialize_PUMA(self, q_init, goal_pos, offset_orientation, results_base_directory=None):
+        """
+        Initializes the state of PUMA for a run from q_init. The policy is only loaded at the first call
+        (see load_PUMA), later calls reset the state of the same dynamical system.
+        """
+        self.model_reloaded = self.load_PUMA(results_base_directory=results_base_directory)
+        learner = self.learner
+        goal_NN = self.goal_NN
 
         # Translation of goal:
         if self.params["dim_task"] == 7:
@@ -76,26 +109,85 @@ class PUMAControl():
         # initial state:
         x_t_init = self.kuka_kinematics.get_initial_state_task(q_init=q_init, qdot_init=np.zeros((self.params["dof"], 1)), offset_orientation=offset_orientation, mode_NN=self.params["mode_NN"])
         x_init_gpu = self.normalizations.normalize_state_to_NN(x_t=[x_t_init], translation_cpu=translation_cpu, offset_orientation=offset_orientation)
-        self.dynamical_system = learner.init_dynamical_system(initial_states=x_init_gpu[:, :self.params["dim_task"]*self.mode_NN_int].clone(), delta_t=1)
+        x_init_state = x_init_gpu[:, :self.params["dim_task"]*self.mode_NN_int].clone()
+        if self.dynamical_system is not None:
+            self.dynamical_system.reset(x_init_state)
+            return x_t_init, x_init_gpu, translation_cpu, goal_NN
+        self.dynamical_system = learner.init_dynamical_system(initial_states=x_init_state, delta_t=1)
+
+        # Compiled transition (torchscript or onnx), exported at the first run
+        if self.params.get("compiled_policy", None) is not None:
+            self.dynamical_system = load_compiled_dynamical_system(self.dynamical_system,
+                                                                   file_path=self.results_path + 'transition_' + learner.device.type,
+                                                                   backend=self.params["compiled_policy"],
+                                                                   reference_path=self.results_path + 'model')
+
+        # Normalizations folded into the first and last layer of the network
+        if self.params.get("bool_raw_units_policy", False):
+            if self.params.get("bool_combined", False) and self.params.get("bool_energy_regulator", False):
+                raise ValueError("The raw-units policy provides no desired state in network units for the energy regulator (CPM), "
+                                 "set bool_raw_units_policy to False or bool_energy_regulator to False.")
+            self.raw_policy = RawUnitsPolicy(self.dynamical_system, self.normalizations)
         return x_t_init, x_init_gpu, translation_cpu, goal_NN
 
     def return_classes(self):
         return self.dynamical_system, self.normalizations
 
-    def request_PUMA(self, q, qdot, x_t, xee_orientation, offset_orientation, translation_cpu, POS_OUTPUT=False):
-        # normalization
+    def normalize_PUMA_state(self, x_t, offset_orientation, translation_cpu):
+        """
+        Normalized (network) state of the system state x_t, (1 x dim_task*order) on the device
+        """
         x_t_gpu = self.normalizations.normalize_state_to_NN(x_t=x_t, translation_cpu=translation_cpu,
                                                        offset_orientation=offset_orientation)
+        return x_t_gpu[:, :self.params["dim_task"]*self.mode_NN_int].clone()
 
-        # compute action network
-        transition_info = self.dynamical_system.transition(space='task', x_t=x_t_gpu[:, :self.params["dim_task"]*self.mode_NN_int].clone())
+    def request_PUMA(self, q, qdot, x_t, xee_orientation, offset_orientation, translation_cpu, POS_OUTPUT=False):
+        if self.raw_policy is not None and not POS_OUTPUT:
+            # system state in, system derivatives out (normalizations in the weights)
+            with self.profiler.span("nn_transition"), torch.inference_mode():
+                transition_info = self.raw_policy.transition(x_t=x_t, translation_cpu=translation_cpu,
+                                                             offset_orientation=offset_orientation)
+            with self.profiler.span("ik"):
+                xdot_pos_quat = transition_info["desired velocity"][0].cpu().numpy()
+                xddot_pos_quat = transition_info["desired acceleration"][0].cpu().numpy()
+                qddot_PUMA = self.action_from_task_derivatives(q=q, qdot=qdot, xdot_pos_quat=xdot_pos_quat,
+                                                               xddot_pos_quat=xddot_pos_quat, xee_orientation=xee_orientation)
+            return qddot_PUMA, transition_info
 
-        # # -- normalize pose --#
-        if self.params["dim_task"] == 7:
-            x_t_action = self.normalizations.reverse_transformation_pos_quat(state_gpu=transition_info["desired state"], offset_orientation=offset_orientation)
-        else:
-            x_t_action = self.normalizations.reverse_transformation_position(position_gpu=transition_info["desired state"])  # , offset_orientation=offset_orientation)
+        # normalization
+        with self.profiler.span("normalization"):
+            x_t_gpu = self.normalize_PUMA_state(x_t=x_t, offset_orientation=offset_orientation, translation_cpu=translation_cpu)
+
+        # compute action network
+        with self.profiler.span("nn_transition"), torch.inference_mode():
+            transition_info = self.dynamical_system.transition(space='task', x_t=x_t_gpu)
+        with self.profiler.span("ik"):
+            return self.action_from_transition(q=q, qdot=qdot, transition_info=transition_info,
+                                               xee_orientation=xee_orientation, offset_orientation=offset_orientation,
+                                               POS_OUTPUT=POS_OUTPUT)
+
+    def request_PUMA_rollout(self, x_t, offset_orientation, translation_cpu, n_steps=50):
+        """
+        Desired pose of the system after n_steps transitions of PUMA from x_t, integrated on the device (the velocity of
+        x_t is kept for second order systems). Only the final state is transferred back and denormalized.
+        """
+        x_t_gpu = self.normalize_PUMA_state(x_t=x_t, offset_orientation=offset_orientation, translation_cpu=translation_cpu)
+        with torch.inference_mode():
+            transition_info = self.dynamical_system.rollout(n_steps=n_steps, x_t=x_t_gpu, hold_velocity=True)
+        return self.action_from_transition(q=None, qdot=None, transition_info=transition_info,
+                                           xee_orientation=None, offset_orientation=offset_orientation,
+                                           POS_OUTPUT=True)
+
+    def action_from_transition(self, q, qdot, transition_info, xee_orientation, offset_orientation, POS_OUTPUT=False):
+        """
+        Maps the transition of the network (batch size 1) to the system: the desired pose if POS_OUTPUT, otherwise the joint acceleration
+        """
         if POS_OUTPUT:
+            # # -- normalize pose --#
+            if self.params["dim_task"] == 7:
+                x_t_action = self.normalizations.reverse_transformation_pos_quat(state_gpu=transition_info["desired state"], offset_orientation=offset_orientation)
+            else:
+                x_t_action = self.normalizations.reverse_transformation_position(position_gpu=transition_info["desired state"])  # , offset_orientation=offset_orientation)
             return x_t_action, transition_info
 
         # --- rescale velocities (correct offset and normalization) ---#
@@ -104,19 +196,25 @@ class PUMAControl():
                                                                        self.kuka_kinematics)
         xddot_pos_quat = self.acc_NN_rescale(transition_info, offset_orientation, xee_orientation,
                                                              self.normalizations, self.kuka_kinematics)
-
+        qddot_PUMA = self.action_from_task_derivatives(q=q, qdot=qdot, xdot_pos_quat=xdot_pos_quat,
+                                                       xddot_pos_quat=xddot_pos_quat, xee_orientation=xee_orientation)
+        return qddot_PUMA, transition_info
+
+    def action_from_task_derivatives(self, q, qdot, xdot_pos_quat, xddot_pos_quat, xee_orientation):
+        """
+        Joint acceleration of the desired task velocity and acceleration (system units)
+        """
         # ---- velocity action_PUMA: option 1 ---- #
         qdot_PUMA_pulled = self.kuka_kinematics.inverse_diff_kinematics_quat(xdot=xdot_pos_quat,
                                                                                  angle_quaternion=xee_orientation).numpy()[0]
 
         #### --------------- directly from acceleration!! -----#
-        qddot_PUMA, self.Jac_prev, Jac_dot_prev = self.kuka_kinematics.inverse_2nd_kinematics_quat(q=q,
-                                                                                                  qdot=qdot_PUMA_pulled,
-                                                                                                  xddot=xddot_pos_quat,
-                                                                                                  angle_quaternion=xee_orientation,
-                                                                                                  Jac_prev=self.Jac_prev)
+        qddot_PUMA, _, _ = self.kuka_kinematics.inverse_2nd_kinematics_quat(q=q,
+                                                                            qdot=qdot_PUMA_pulled,
+                                                                            xddot=xddot_pos_quat,
+                                                                            angle_quaternion=xee_orientation)
         qddot_PUMA = qddot_PUMA.numpy()[0]
         if self.NULLSPACE:
-            action_nullspace = self.controller_nullspace._nullspace_control(q=q, qdot=qdot)
+            action_nullspace = self.controller_nullspace._nullspace_control(q=q, qdot=qdot, frame=self.kuka_kinematics.frame)
             qddot_PUMA = qddot_PUMA + action_nullspace
-        return qddot_PUMA, transition_info
\ No newline at end of file
+        return qddot_PUMA
@@ -0,0 +1,132 @@
+import numpy as np
+import torch
+from pumafabrics.tamed_puma.utils.compiled_normalizations import affine_normalization
+from pumafabrics.tamed_puma.kinematics.quaternions import quat_right_matrix, quat_inverse
+
+class RawUnitsPolicy():
+    """
+    PUMA policy in system units: the normalization of the state (scaling wrt the room, translation wrt the goal and
+    quaternion offset) is folded into the weights of the first encoder layer, the denormalization of the derivative
+    (max vel/acc of the network, time step, scaling of the room and quaternion offset) into the last decoder layer.
+    The state of the system goes in, the desired velocity and acceleration of the system come out,
+    as normalize_state_to_NN -> transition -> vel_NN_rescale/acc_NN_rescale of PUMAControl.
+    Folding is a few small matrix products and is only redone if the goal (translation or orientation offset) changes.
+
+    Only the derivatives are computed, not the desired state in network units (used by the CPM energy regulator).
+    The saturation of 'euclidean' systems is defined in network units and 'sphere' systems have no pose offset,
+    both are not supported.
+    """
+    def __init__(self, dynamical_system, normalizations):
+        if dynamical_system.space == 'sphere' or (dynamical_system.space == 'euclidean' and dynamical_system.saturate_transition):
+            raise ValueError("Raw-units policy is not available for space %s (saturate_transition: %s), "
+                             "options: euclidean_sphere and euclidean without saturation."
+                             % (dynamical_system.space, dynamical_system.saturate_transition))
+        self.model = dynamical_system.model
+        self.normalizations = normalizations
+        self.device = self.model.device
+        self.space = dynamical_system.space
+        self.order = dynamical_system.order
+        self.delta_t = dynamical_system.delta_t
+        self.n_state = dynamical_system.dim_state
+        self.dof_task = normalizations.dof_task
+        self.x_device = torch.zeros((1, self.n_state), dtype=torch.float32, device=self.device)
+        self._key = None
+
+        with torch.no_grad():
+            # encoder layer 1, the encoding of the primitive (multi-motion) is a constant input and goes into the bias
+            weight = self.model.encoder1.weight.detach()
+            self.weight_state = weight[:, :self.n_state].clone()
+            self.bias_state = self.model.encoder1.bias.detach().clone()
+            if self.model.multi_motion:
+                primitive_type = dynamical_system.primitive_type
+                encoding = self.model.get_encoding_batch(primitive_type) if primitive_type.ndim == 1 else primitive_type
+                self.bias_state += weight[:, self.n_state:] @ encoding[0]
+
+            # decoder layer 3, denormalize_derivative and reverse_transformation as one scaling per axis
+            max_norm = dynamical_system.max_vel_norm if self.order == 1 else dynamical_system.max_acc_norm
+            scale = np.ones(self.dof_task)
+            scale[0:2] = normalizations.scaling_factor[0:2]
+            scale = scale / normalizations.dt ** self.order
+            self.scale_derivative = torch.as_tensor(scale, dtype=torch.float32, device=self.device) * max_norm.reshape(-1).to(self.device)
+            self.weight_decoder = self.model.decoder3_dx.weight.detach().clone()
+            self.bias_decoder = self.model.decoder3_dx.bias.detach().clone()
+
+    def fold(self, translation_cpu, offset_orientation):
+        """
+        Folds the normalizations for the given translation and orientation offset into the first and last layer
+        """
+        A, b = affine_normalization(self.normalizations, self.n_state, translation_cpu, offset_orientation)
+        A = torch.as_tensor(A, dtype=torch.float32, device=self.device)
+        b = torch.as_tensor(b, dtype=torch.float32, device=self.device)
+        D = torch.diag(self.scale_derivative)
+        P = torch.eye(self.dof_task, device=self.device)
+        if self.dof_task == 7:
+            # quaternion offset of the derivatives (quat_vel_with_offset), velocities of the state: there and back
+            R = torch.as_tensor(quat_right_matrix(np.asarray(offset_orientation, dtype=float)), dtype=torch.float32, device=self.device)
+            R_inverse = torch.as_tensor(quat_right_matrix(quat_inverse(offset_orientation)), dtype=torch.float32, device=self.device)
+            D[3:7, 3:7] = R @ D[3:7, 3:7]
+            P[3:7, 3:7] = R @ R_inverse
+        with torch.no_grad():
+            self.weight_encoder = self.weight_state @ A
+            self.bias_encoder = self.bias_state + self.weight_state @ b
+            self.weight_output = D @ self.weight_decoder
+            self.bias_output = D @ self.bias_decoder
+        self.P_velocity = P
+        self._key = (np.array(translation_cpu, dtype=float), np.array(offset_orientation, dtype=float))
+
+    def encoder(self, x_t):
+        """
+        NeuralNetwork.encoder with the folded first layer
+        """
+        model = self.model
+        e_1 = model.activation(model.norm_e_1(torch.nn.functional.linear(x_t, self.weight_encoder, self.bias_encoder)))
+        e_2 = model.activation(model.norm_e_2(model.encoder2(e_1)))
+        return model.activation(model.encoder3(e_2))
+
+    def decoder_dx(self, y_t):
+        """
+        NeuralNetwork.decoder_dx with the folded last layer, the derivative in system units
+        """
+        model = self.model
+        y_t_norm = model.norm_de_dx0[0](y_t)
+        de_1 = model.activation(model.norm_de_dx1(model.decoder1_dx(y_t_norm)))
+        de_2 = model.activation(model.norm_de_dx2(model.decoder2_dx(de_1)))
+        return torch.nn.functional.linear(de_2, self.weight_output, self.bias_output)
+
+    def project_tangent(self, v, quat):
+        """
+        Projection of the quaternion derivatives onto the tangent plane of the quaternion (as the dynamical system)
+        """
+        return v - torch.sum(v * quat, dim=-1, keepdim=True) / torch.sum(quat * quat, dim=-1, keepdim=True) * quat
+
+    def transition(self, x_t, translation_cpu, offset_orientation):
+        """
+        Desired velocity and acceleration (1 x dim_task, system units) and latent state for the system state x_t
+        """
+        if self._key is None or not all(np.array_equal(k, v) for k, v in zip(self._key, (translation_cpu, offset_orientation))):
+            self.fold(translation_cpu, offset_orientation)
+        x = np.asarray(x_t, dtype=float).reshape(1, -1)[:, :self.n_state]
+        self.x_device[0].copy_(torch.from_numpy(x[0]))
+        x_t = self.x_device
+        dof_task = self.dof_task
+
+        y_t = self.encoder(x_t)
+        dx_t_d = self.decoder_dx(y_t)
+        rotation = self.space == 'euclidean_sphere'
+        if self.order == 1:
+            vel_t_d = dx_t_d
+            if rotation:
+                vel_t_d = torch.cat([vel_t_d[:, :3], self.project_tangent(vel_t_d[:, 3:], x_t[:, 3:dof_task])], dim=1)
+            acc_t_d = None
+        else:
+            vel_t = x_t[:, dof_task:] @ self.P_velocity.T
+            acc_t_d = dx_t_d
+            if rotation:
+                quat = x_t[:, 3:dof_task]
+                vel_t = torch.cat([vel_t[:, :3], self.project_tangent(vel_t[:, 3:], quat)], dim=1)
+                acc_t_d = torch.cat([acc_t_d[:, :3], self.project_tangent(acc_t_d[:, 3:], quat)], dim=1)
+            vel_t_d = vel_t + acc_t_d * (self.normalizations.dt * self.delta_t)
+
+        return {'desired velocity': vel_t_d,
+                'desired acceleration': acc_t_d,
+                'latent state': y_t}
@@ -2,16 +2,108 @@
 This file includes tools for the final analysis of the planner, such as distance to obstacles and time to reach the goal.
 """
 import numpy as np
+import casadi as ca
+from scipy.spatial import cKDTree
 from forwardkinematics.urdfFks.generic_urdf_fk import GenericURDFFk
 
+class DistanceEngine():
+    """
+    Batched clearances between the collision links (spheres) and spherical obstacles.
+    All link positions come from one casadi function (one call per configuration), and the clearance matrix
+    (links x obstacles) is computed by broadcasting.
+    For large obstacle sets (>= spatial_index_threshold obstacles) a KD-tree over the obstacle centers can be used,
+    which is rebuilt only when the obstacle positions change, so it pays off for (mostly) static obstacles.
+    """
+    def __init__(self, forward_kinematics: GenericURDFFk, collision_links: list, collision_radii: dict,
+                 spatial_index=False, spatial_index_threshold=500) -> None:
+        self.fk = forward_kinematics
+        self.collision_links = collision_links
+        self.link_radii = np.array(list(collision_radii.values()), dtype=float)[:len(collision_links)]
+        self.spatial_index = spatial_index
+        self.spatial_index_threshold = spatial_index_threshold
+        self._link_position_functions = {}
+        self._tree = None
+        self._tree_positions = None
+
+    def _link_position_function(self, parent_link):
+        if parent_link not in self._link_position_functions:
+            try:
+                q = self.fk._q_ca
+                positions = [self.fk.casadi(q, child_link=link, parent_link=parent_link, position_only=True) for link in self.collision_links]
+                self._link_position_functions[parent_link] = ca.Function("link_positions", [q], [ca.hcat(positions)])
+            except (AttributeError, NotImplementedError, TypeError):
+                # forward kinematics without a symbolic version (or another signature): per-link numpy evaluation
+                self._link_position_functions[parent_link] = None
+        return self._link_position_functions[parent_link]
+
+    def link_positions(self, q: np.ndarray, parent_link='iiwa_link_0') -> np.ndarray:
+        """
+        Positions of all collision links (n_links x 3)
+        """
+        function = self._link_position_function(parent_link)
+        if function is None:
+            return np.array([self.fk.numpy(q, parent_link=parent_link, child_link=link, position_only=True)
+                             for link in self.collision_links], dtype=float)
+        return np.array(function(q)).T
+
+    @staticmethod
+    def obstacle_arrays(obstacles: list):
+        """
+        Stacked obstacle positions (n_obstacles x 3) and sizes (n_obstacles,)
+        """
+        n_obstacles = len(obstacles)
+        positions = np.array([obstacle["position"] for obstacle in obstacles], dtype=float).reshape(n_obstacles, -1)[:, :3]
+        sizes = np.array([obstacle["size"] for obstacle in obstacles], dtype=float).reshape(n_obstacles, -1)[:, 0]
+        return positions, sizes
+
+    def clearance_matrix(self, link_positions, obstacle_positions, obstacle_sizes, margin=0.0) -> np.ndarray:
+        """
+        Clearances (n_links x n_obstacles): center distance - obstacle size - link radius + margin
+        """
+        distances = np.linalg.norm(link_positions[:, None, :] - obstacle_positions[None, :, :], axis=-1)
+        return distances - obstacle_sizes[None, :] - self.link_radii[:, None] + margin
+
+    def _query_tree(self, link_positions, obstacle_positions, obstacle_sizes, margin=0.0) -> np.ndarray:
+        """
+        Minimal clearance per link using the KD-tree: only obstacles whose center lies within
+        (nearest center distance + max size - min size) can have a smaller clearance than the nearest one.
+        """
+        if self._tree is None or self._tree_positions.shape != obstacle_positions.shape \
+                or not np.array_equal(self._tree_positions, obstacle_positions):
+            self._tree = cKDTree(obstacle_positions)
+            self._tree_positions = obstacle_positions.copy()
+        nearest_distances, _ = self._tree.query(link_positions, k=1)
+        size_spread = np.max(obstacle_sizes) - np.min(obstacle_sizes)
+        min_clearances = np.empty(len(link_positions))
+        for i_link, candidates in enumerate(self._tree.query_ball_point(link_positions, nearest_distances + size_spread + 1e-12)):
+            candidates = np.asarray(candidates, dtype=int)
+            distances = np.linalg.norm(obstacle_positions[candidates] - link_positions[i_link], axis=-1)
+            min_clearances[i_link] = np.min(distances - obstacle_sizes[candidates])
+        return min_clearances - self.link_radii + margin
+
+    def min_clearances(self, q: np.ndarray, obstacles: list, margin=0.0, parent_link='iiwa_link_0') -> np.ndarray:
+        """
+        Minimal clearance of each collision link over all obstacles (n_links,)
+        """
+        link_positions = self.link_positions(q, parent_link=parent_link)
+        obstacle_positions, obstacle_sizes = self.obstacle_arrays(obstacles)
+        if self.spatial_index and len(obstacles) >= self.spatial_index_threshold:
+            return self._query_tree(link_positions, obstacle_positions, obstacle_sizes, margin=margin)
+        return np.min(self.clearance_matrix(link_positions, obstacle_positions, obstacle_sizes, margin=margin), axis=1)
+
 class UtilsAnalysis():
-    def __init__(self, forward_kinematics: GenericURDFFk, collision_links:list, collision_radii: dict, kinematics) -> None:
+    def __init__(self, forward_kinematics: GenericURDFFk, collision_links:list, collision_radii: dict, kinematics,
+                 spatial_index=False) -> None:
         self.min_dist = 1000
         self.collision_links = collision_links
         self.collision_radii = collision_radii
         self.fk = forward_kinematics
         self.goal_reach_thr = 0.05
         self.kuka_kinematics = kinematics
+        self.distance_engine = DistanceEngine(forward_kinematics=forward_kinematics,
+                                              collision_links=collision_links,
+                                              collision_radii=collision_radii,
+                                              spatial_index=spatial_index)
 
     def check_distance_collision(self, q: np.ndarray, obstacles: list, margin=0.0, parent_link='iiwa_link_0') -> bool:
         """
@@ -21,18 +113,9 @@ class UtilsAnalysis():
         if len(obstacles) == 0:
             return False
 
-        for i_link, collision_link in enumerate(self.collision_links):
-            pose_link_i = self.fk.numpy(
-                q,
-                parent_link=parent_link,
-                child_link=collision_link,
-            )
-            for obstacle in obstacles:
-                collision_radii_list = list(self.collision_radii.values())
-                dist = np.linalg.norm(pose_link_i[:3, 3] - np.array(obstacle["position"])) - obstacle["size"] - \
-                       collision_radii_list[i_link] + margin
-                if dist < self.min_dist:
-                    self.min_dist = dist
+        min_dist = float(np.min(self.distance_engine.min_clearances(q, obstacles, margin=margin, parent_link=parent_link)))
+        if min_dist < self.min_dist:
+            self.min_dist = min_dist
 
         if self.min_dist < 0:
             print("IN COLLISION, minimal dist during this run: ", self.min_dist)
@@ -40,6 +123,12 @@ class UtilsAnalysis():
         else:
             return False
 
+    def reset(self):
+        """
+        Resets the minimal distance tracked over a run
+        """
+        self.min_dist = 1000
+
     def _request_ee_state(self, q, quat_prev):
          # --- end-effector states and normalized states --- #
         x_t, xee_orientation, _ = self.kuka_kinematics.get_state_task(q, quat_prev, mode_NN="1st")
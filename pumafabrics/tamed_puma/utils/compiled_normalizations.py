@@ -0,0 +1,132 @@
+import numpy as np
+import torch
+from pumafabrics.tamed_puma.kinematics.quaternions import quat_right_matrix, quat_inverse
+
+def affine_normalization(normalizations, n_state, translation_cpu, offset_orientation):
+    """
+    A, b with normalize_state_to_NN(x) = A x + b for system states x of length n_state (pose, and velocities for
+    second order), for the given translation and orientation offset
+    """
+    nrm = normalizations
+    dim_pos, dof_task = nrm.dim_pos, nrm.dof_task
+    min_state = np.asarray(nrm.min_state, dtype=float)[:dim_pos]
+    max_state = np.asarray(nrm.max_state, dtype=float)[:dim_pos]
+    R_inverse = quat_right_matrix(quat_inverse(offset_orientation))
+    A = np.identity(n_state)
+    b = np.zeros(n_state)
+
+    # pose: scaling wrt room size, translation wrt goal, quaternion offset
+    A[:dim_pos, :dim_pos] = np.diag(2. / (max_state - min_state))
+    b[:dim_pos] = -2. * min_state / (max_state - min_state) - 1.
+    b[:dof_task] -= np.asarray(translation_cpu, dtype=float)[:dof_task]
+    A[3:7, :] = R_inverse @ A[3:7, :]
+    b[3:7] = R_inverse @ b[3:7]
+
+    # velocities: quaternion offset, scaling wrt room size and time step, scaling wrt min and max vel of NN
+    if nrm.mode_NN == "2nd":
+        min_vel = np.asarray(nrm.min_vel, dtype=float)
+        max_vel = np.asarray(nrm.max_vel, dtype=float)
+        scale = np.full(dof_task, nrm.dt)
+        scale[0:2] /= nrm.scaling_factor[0:2]
+        A_vel = np.identity(n_state)[dof_task:dof_task * 2]
+        A_vel[-4:] = R_inverse @ np.identity(n_state)[n_state - 4:]
+        A[dof_task:dof_task * 2] = np.diag(2. * scale / (max_vel - min_vel)) @ A_vel
+        b[dof_task:dof_task * 2] = -2. * min_vel / (max_vel - min_vel) - 1.
+    return A, b
+
+class CompiledNormalization():
+    """
+    Normalization of poses (position + quaternion) and their velocities as one precomputed affine map per goal.
+    For a given translation and orientation offset, normalize_state_to_NN is x_NN = A x + b: the scaling wrt the room,
+    the translation wrt the goal and the quaternion offset (a right multiplication) are folded into [A | b], which is
+    applied with one matrix product into a preallocated buffer and copied to the device tensor.
+    The reverse transformations use precomputed scale and offset vectors the same way.
+    Everything else is delegated to the (eager) normalization functions.
+
+    Unlike the eager normalization, normalize_state_to_NN does not modify x_t in place, and it returns a new tensor
+    (a copy of the device buffer), so states kept by the caller (e.g. the initial state) are not overwritten.
+    """
+    def __init__(self, normalizations):
+        self.normalizations = normalizations
+        self._key_forward = None
+        self._key_pos_quat = None
+        self._key_position = None
+        self.A_forward = None
+        self.x_augmented = None
+        self.x_host = None
+        self.x_device = None
+
+        # reverse transformation of actions, independent of the goal:
+        scale = np.ones(normalizations.dof_task)
+        scale[0:2] = normalizations.scaling_factor[0:2]
+        self.scale_action = {"1st": scale / normalizations.dt, "2nd": scale / (normalizations.dt * normalizations.dt)}
+
+    def __getattr__(self, name):
+        if name == "normalizations":
+            raise AttributeError(name)
+        return getattr(self.normalizations, name)
+
+    def independent_copy(self):
+        """
+        Compiled normalization with its own buffers and goal translation (e.g. for another thread)
+        """
+        return CompiledNormalization(self.normalizations.independent_copy())
+
+    @staticmethod
+    def _same_key(key, values):
+        return key is not None and all(np.array_equal(k, v) for k, v in zip(key, values))
+
+    # ---------------------------- system --> network ---------------------------- #
+    def compile_forward(self, n_state, translation_cpu, offset_orientation):
+        """
+        Affine map [A | b] of a state of length n_state for the given translation and orientation offset
+        """
+        nrm = self.normalizations
+        A, b = affine_normalization(nrm, n_state, translation_cpu, offset_orientation)
+        self.A_forward = np.hstack((A, b[:, None]))
+        self.x_augmented = np.ones(n_state + 1)
+        self.x_host = np.zeros(n_state)
+        self.x_device = torch.zeros((1, n_state), dtype=torch.float32, device=nrm.device)
+        self._key_forward = (np.array(translation_cpu, dtype=float), np.array(offset_orientation, dtype=float), n_state)
+
+    def normalize_state_to_NN(self, x_t, translation_cpu, offset_orientation):
+        x = np.asarray(x_t, dtype=float)
+        if x.ndim != 2 or x.shape[0] != 1 or x.shape[1] < 7:
+            return self.normalizations.normalize_state_to_NN(x_t, translation_cpu, offset_orientation)
+        if not self._same_key(self._key_forward, (translation_cpu, offset_orientation, x.shape[1])):
+            self.compile_forward(x.shape[1], translation_cpu, offset_orientation)
+        self.x_augmented[:-1] = x[0]
+        np.dot(self.A_forward, self.x_augmented, out=self.x_host)
+        self.x_device[0].copy_(torch.from_numpy(self.x_host))
+        return self.x_device.clone()
+
+    # ---------------------------- network --> system ---------------------------- #
+    def reverse_transformation(self, action_gpu, mode_NN=None):
+        if mode_NN is None:
+            mode_NN = self.normalizations.mode_NN
+        dof_task = self.normalizations.dof_task
+        return action_gpu[0, :dof_task].detach().cpu().numpy() * self.scale_action[mode_NN]
+
+    def reverse_transformation_pos_quat(self, state_gpu, offset_orientation):
+        nrm = self.normalizations
+        if not self._same_key(self._key_pos_quat, (nrm.translation, offset_orientation)):
+            min_state = np.asarray(nrm.min_state, dtype=float)[:3]
+            range_state = np.asarray(nrm.max_state, dtype=float)[:3] - min_state
+            A = np.zeros((7, 8))
+            A[:3, :3] = np.diag(range_state / 2.)
+            A[:3, 7] = (np.asarray(nrm.translation, dtype=float)[:3] / 2. + 0.5) * range_state + min_state
+            A[3:7, 3:7] = quat_right_matrix(np.asarray(offset_orientation, dtype=float))
+            self.A_pos_quat = A
+            self.state_augmented = np.ones(8)
+            self._key_pos_quat = (np.array(nrm.translation, dtype=float), np.array(offset_orientation, dtype=float))
+        self.state_augmented[:7] = state_gpu[0, :7].detach().cpu().numpy()
+        return self.A_pos_quat @ self.state_augmented
+
+    def reverse_transformation_position(self, position_gpu):
+        nrm = self.normalizations
+        if not self._same_key(self._key_position, (nrm.translation,)):
+            range_state = np.asarray(nrm.max_state, dtype=float) - np.asarray(nrm.min_state, dtype=float)
+            self.scale_position = range_state / 2.
+            self.offset_position = (np.asarray(nrm.translation, dtype=float) / 2. + 0.5) * range_state + nrm.min_state
+            self._key_position = (np.array(nrm.translation, dtype=float),)
+        return position_gpu.detach().cpu().numpy() * self.scale_position + self.offset_position
@@ -3,10 +3,11 @@ import copy
 import torch
 from pumafabrics.puma_extension.agent.utils.dynamical_system_operations import normalize_state, denormalize_state
 from pumafabrics.tamed_puma.kinematics.quaternion_operations import QuaternionOperations
-from spatialmath import UnitQuaternion
+from pumafabrics.tamed_puma.kinematics.quaternions import quat_unit, quat_product
+from pumafabrics.puma_extension.agent.utils.device_operations import get_device
 
 class denormalizations():
-    def __init__(self, x_min, x_max, dof_task=0, dim_pos=3, dt=0.01, mode_NN="1st", min_vel=[], max_vel=[], learner=None):
+    def __init__(self, x_min, x_max, dof_task=0, dim_pos=3, dt=0.01, mode_NN="1st", min_vel=[], max_vel=[], learner=None, device=None):
         self.min_state = x_min
         self.max_state = x_max
         if dof_task == 0:
@@ -20,18 +21,26 @@ class denormalizations():
         # self.mode = mode
         self.mode_NN = mode_NN
         if learner is not None:
+            self.device = learner.device
             self.min_vel = self.gpu_to_cpu(learner.min_vel).transpose()[0]
             self.max_vel = self.gpu_to_cpu(learner.max_vel).transpose()[0]
         else:
+            self.device = get_device(device)
             self.min_vel = min_vel
             self.max_vel = max_vel
         self.quaternion_operations = QuaternionOperations()
 
     # ---- GPU CPU conversions ---#
+    def independent_copy(self):
+        """
+        Normalizations with their own goal translation (e.g. for another thread), the limits are shared
+        """
+        return copy.copy(self)
+
     def cpu_to_gpu(self, x_cpu):
         if type(x_cpu) == list:
             x_cpu = np.stack(x_cpu)
-        x_gpu = torch.FloatTensor(x_cpu).cuda()
+        x_gpu = torch.FloatTensor(x_cpu).to(self.device)
         return x_gpu
 
     def gpu_to_cpu(self, x_gpu):
@@ -88,13 +97,12 @@ class denormalizations():
 
     # ------------------------------- in case of quaternions ---------------------------------- #
     def NN_quat_to_system(self, quat, offset):
-        quat2 = UnitQuaternion(quat, check=False)
-        if self.quaternion_flipped(quat=quat2.A, quat_prev=quat):
+        quat2 = quat_unit(quat)
+        if self.quaternion_flipped(quat=quat2, quat_prev=quat):
             quat2 = quat2 * -1
             # print("flipped 2!!")
 
-        quat_system = quat2 * UnitQuaternion(offset)
-        quat_system = self.quaternion_operations.quat_product(quat, offset)
+        quat_system = quat_product(quat, offset)
 
         # ---- checking the norms ---#
         self.check_norm_quaternion(quat_list = [quat_system, quat2, offset])
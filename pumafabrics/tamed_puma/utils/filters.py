@@ -7,6 +7,9 @@ class PDController:
         self.previous_error = 0
         self.dt=dt
 
+    def reset(self):
+        self.previous_error = 0
+
     def control(self, desired_velocity, current_velocity):
         error = (desired_velocity - current_velocity)/self.dt
         control_value = self.Kp * error + self.Kd * (error - self.previous_error)
@@ -0,0 +1,188 @@
+import json
+import time
+import numpy as np
+
+STAGES = ("fk", "normalization", "nn_transition", "ik", "fabrics", "energy_regulation", "collision_check", "total")
+
+class _Span():
+    """
+    Context manager timing one stage of the profiler, reused for every tick (not reentrant)
+    """
+    __slots__ = ("profiler", "name", "time0")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.time0 = 0.
+
+    def __enter__(self):
+        self.time0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.record(self.name, time.perf_counter() - self.time0)
+        return False
+
+class _NullSpan():
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+class LatencyProfiler():
+    """
+    Per-stage latencies of the control loop in preallocated ring buffers (the last `capacity` ticks per stage).
+    Stages are timed with `with profiler.span("fk"): ...`, a disabled profiler returns a no-op span.
+    deadlines: {stage: seconds}, durations above the deadline of a stage are counted as deadline misses
+    (over all ticks, also those that are no longer in the ring buffer).
+    """
+    def __init__(self, stages=STAGES, capacity=4096, deadlines=None, enabled=True):
+        self.capacity = capacity
+        self.deadlines = dict(deadlines) if deadlines is not None else {}
+        self.enabled = enabled
+        self.buffers = {}
+        self.indices = {}
+        self.counts = {}
+        self.deadline_misses = {}
+        self.spans = {}
+        for name in stages:
+            self.add_stage(name)
+
+    def add_stage(self, name: str):
+        self.buffers[name] = np.zeros(self.capacity)
+        self.indices[name] = 0
+        self.counts[name] = 0
+        self.deadline_misses[name] = 0
+        self.spans[name] = _Span(self, name)
+
+    def reset(self):
+        for name in self.buffers:
+            self.indices[name] = 0
+            self.counts[name] = 0
+            self.deadline_misses[name] = 0
+
+    def span(self, name: str):
+        if not self.enabled:
+            return _NULL_SPAN
+        if name not in self.spans:
+            self.add_stage(name)
+        return self.spans[name]
+
+    def record(self, name: str, duration: float):
+        """
+        Adds a duration [s] of a stage
+        """
+        if not self.enabled:
+            return
+        if name not in self.buffers:
+            self.add_stage(name)
+        index = self.indices[name]
+        self.buffers[name][index] = duration
+        self.indices[name] = (index + 1) % self.capacity
+        self.counts[name] += 1
+        deadline = self.deadlines.get(name, None)
+        if deadline is not None and duration > deadline:
+            self.deadline_misses[name] += 1
+
+    def samples(self, name: str) -> np.ndarray:
+        """
+        Durations [s] of a stage in the ring buffer, oldest first
+        """
+        count = self.counts[name]
+        if count < self.capacity:
+            return self.buffers[name][:count].copy()
+        return np.roll(self.buffers[name], -self.indices[name])
+
+    def summary(self) -> dict:
+        """
+        Statistics per timed stage in ms: n (number of ticks), mean, std, p50, p95, p99, max and deadline misses
+        """
+        summary = {}
+        for name in self.buffers:
+            if self.counts[name] == 0:
+                continue
+            samples = self.buffers[name][:min(self.counts[name], self.capacity)] * 1000
+            p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+            deadline = self.deadlines.get(name, None)
+            summary[name] = {"n": self.counts[name],
+                             "mean": float(np.mean(samples)),
+                             "std": float(np.std(samples)),
+                             "p50": float(p50),
+                             "p95": float(p95),
+                             "p99": float(p99),
+                             "max": float(np.max(samples)),
+                             "deadline": deadline * 1000 if deadline is not None else None,
+                             "deadline_misses": self.deadline_misses[name]}
+        return summary
+
+    def export_json(self, file_path: str, metadata=None):
+        """
+        Writes the summary (and optional metadata, e.g. the case and run) to a json file
+        """
+        with open(file_path, "w") as f:
+            json.dump({"metadata": metadata if metadata is not None else {}, "stages": self.summary()}, f, indent=2)
+
+    @staticmethod
+    def load_json(file_path: str) -> dict:
+        with open(file_path, "r") as f:
+            return json.load(f)
+
+def combine_summaries(summaries: list) -> dict:
+    """
+    Combines the summaries of several runs per stage: ticks and deadline misses are summed, the mean is weighted by the
+    ticks, p50 is the median of the runs and p95, p99 and max are the maxima of the runs (an upper bound)
+    """
+    combined = {}
+    names = []
+    for summary in summaries:
+        names += [name for name in summary if name not in names]
+    for name in names:
+        stats = [summary[name] for summary in summaries if name in summary]
+        n = np.array([stat["n"] for stat in stats])
+        combined[name] = {"n": int(np.sum(n)),
+                          "runs": len(stats),
+                          "mean": float(np.sum(n * np.array([stat["mean"] for stat in stats])) / np.sum(n)),
+                          "p50": float(np.median([stat["p50"] for stat in stats])),
+                          "p95": float(np.max([stat["p95"] for stat in stats])),
+                          "p99": float(np.max([stat["p99"] for stat in stats])),
+                          "max": float(np.max([stat["max"] for stat in stats])),
+                          "deadline": stats[0]["deadline"],
+                          "deadline_misses": int(np.sum([stat["deadline_misses"] for stat in stats]))}
+    return combined
+
+def export_latency_json(results: dict, cases: list, file_path: str):
+    """
+    Per-stage latencies of the cases that are profiled (results[case]["latency"], the summaries of the runs), combined
+    over the runs, to be read by table_latency
+    """
+    latency = {case: combine_summaries(results[case]["latency"]) for case in cases if len(results[case].get("latency", [])) > 0}
+    with open(file_path, "w") as f:
+        json.dump(latency, f, indent=2)
+
+def table_latency(file_path: str) -> str:
+    """
+    Latex table of the latencies per case and stage (p50, p95, p99, max and deadline misses) in a json file of
+    export_latency_json
+    """
+    from texttable import Texttable  # only needed for the tables of the evaluations
+    import latextable
+    latency = LatencyProfiler.load_json(file_path)
+    rows = [[' ', 'Stage', 'p50 [ms]', 'p95 [ms]', 'p99 [ms]', 'Max [ms]', 'Deadline misses']]
+    for case in latency:
+        for stage, stats in latency[case].items():
+            rows.append([case, stage.replace("_", " "),
+                         str(np.round(stats["p50"], decimals=3)),
+                         str(np.round(stats["p95"], decimals=3)),
+                         str(np.round(stats["p99"], decimals=3)),
+                         str(np.round(stats["max"], decimals=3)),
+                         str(stats["deadline_misses"]) + "/" + str(stats["n"]) if stats["deadline"] is not None else "-"])
+    table = Texttable()
+    table.set_cols_align(["c"] * len(rows[0]))
+    table.set_deco(Texttable.HEADER | Texttable.VLINES)
+    table.add_rows(rows)
+    return latextable.draw_latex(table)
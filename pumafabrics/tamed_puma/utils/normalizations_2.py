@@ -2,7 +2,7 @@ import numpy as np
 import copy
 import torch
 from pumafabrics.puma_extension.agent.utils.dynamical_system_operations import normalize_state, denormalize_state
-from spatialmath import SO3, UnitQuaternion, Quaternion
+from pumafabrics.tamed_puma.kinematics.quaternions import quat_divide, quat_inverse, quat_product
 import casadi as ca
 from pumafabrics.tamed_puma.utils.denormalizations import denormalizations
 
@@ -10,9 +10,9 @@ class normalization_functions(denormalizations):
     '''
     Functions to normalize and denormalize the states and actions (positions/quaternions/velocities).
     '''
-    def __init__(self, x_min, x_max, dof_task=0, dim_pos=3, dt=0.01, mode_NN="1st", min_vel=[], max_vel=[], learner=None):
+    def __init__(self, x_min, x_max, dof_task=0, dim_pos=3, dt=0.01, mode_NN="1st", min_vel=[], max_vel=[], learner=None, device=None):
         super().__init__(x_min, x_max, dof_task=dof_task, dim_pos=dim_pos, dt=dt, mode_NN=mode_NN, min_vel=min_vel,
-                         max_vel=max_vel, learner=learner)
+                         max_vel=max_vel, learner=learner, device=device)
 
     def call_normalize_state(self, state):
         state_normalized = normalize_state(state, x_min=self.min_state[:len(state)], x_max=self.max_state[:len(state)])
@@ -76,19 +76,25 @@ class normalization_functions(denormalizations):
         """
         Quaternion orientation offset of the goal wrt the goal of the NN (e.g. [1, 0, 0, 0]).
         """
-        offset = UnitQuaternion(goal_quat_desired) / UnitQuaternion(goal_NN_quat)
+        offset = quat_divide(goal_quat_desired, goal_NN_quat)
 
         # ---- checking the norms ---#
         self.check_norm_quaternion(quat_list = [goal_NN_quat, goal_quat_desired, offset])
-        return offset.A
+        return offset
 
     def system_quat_to_NN(self, quat, offset):
-        offset_inverse = UnitQuaternion(offset).inv()
+        if isinstance(offset, ca.SX):
+            # symbolic offset, same as quat_inverse: unit quaternion with w >= 0, then the conjugate
+            offset_unit = offset / ca.norm_2(offset)
+            offset_unit = ca.if_else(offset_unit[0] < 0, -offset_unit, offset_unit)
+            offset_inverse_A = ca.vcat((offset_unit[0], -offset_unit[1:4]))
+        else:
+            offset_inverse_A = quat_inverse(offset)
         if torch.is_tensor(quat):
             quat2 = self.gpu_to_cpu(quat)
-            quat_NN = self.quaternion_operations.quat_product(quat2, offset_inverse.A)
+            quat_NN = self.quaternion_operations.quat_product(quat2, offset_inverse_A)
         else:
-            quat_NN = self.quaternion_operations.quat_product(quat, offset_inverse.A)
+            quat_NN = self.quaternion_operations.quat_product(quat, offset_inverse_A)
 
         # ---- checking the norms ---#
         self.check_norm_quaternion(quat_list = [quat_NN, offset])
@@ -101,7 +107,7 @@ class normalization_functions(denormalizations):
         translation = self.get_translation(goal_pos=goal_normalized, goal_pos_NN=goal_NN)
         if len(translation)>3:
             translation[3:] = np.zeros(4)
-        translation_gpu = torch.FloatTensor(translation).cuda()
+        translation_gpu = torch.FloatTensor(translation).to(self.device)
         return translation_gpu, translation
 
     def normalize_pose_to_NN(self, x_t, translation_cpu, offset_orientation):
@@ -112,8 +118,7 @@ class normalization_functions(denormalizations):
         return x_cpu
 
     def normalize_vel_to_NN(self, x_t, offset_orientation):
-        offset_inverse = UnitQuaternion(offset_orientation).inv()
-        x_t[0][-4:] = self.quaternion_operations.quat_product(x_t[0][-4:], offset_inverse.A)
+        x_t[0][-4:] = quat_product(x_t[0][-4:], quat_inverse(offset_orientation))
         x_vel_cpu = self.transformation_to_NN_vel(v_t=x_t[0][self.dof_task:self.dof_task * 2])
         return x_vel_cpu
 
@@ -125,7 +130,7 @@ class normalization_functions(denormalizations):
         # --- if state=(pose, vel) also normalize the velocities) ---#
         if self.mode_NN == "2nd":
             x_vel_cpu = self.normalize_vel_to_NN(x_t, offset_orientation)
-            x_gpu[0][self.dof_task:self.dof_task*2] = torch.cuda.FloatTensor(x_vel_cpu)
+            x_gpu[0][self.dof_task:self.dof_task*2] = torch.FloatTensor(x_vel_cpu).to(self.device)
             return x_gpu
         else:
             return x_gpu
@@ -138,7 +143,7 @@ class normalization_functions(denormalizations):
         # --- if state=(pose, vel) also normalize the velocities) ---#
         if self.mode_NN == "2nd":
             x_vel_cpu = self.transformation_to_NN_vel(v_t=x_t[0][self.dof_task:self.dof_task * 2])
-            x_gpu[0][self.dof_task:self.dof_task*2] = torch.cuda.FloatTensor(x_vel_cpu)
+            x_gpu[0][self.dof_task:self.dof_task*2] = torch.FloatTensor(x_vel_cpu).to(self.device)
             return x_cpu, x_gpu
         else:
             return x_cpu, x_gpu
@@ -0,0 +1,10 @@
+"""
+Shared values of the normalization tests (test_normalizations.py and test_raw_units_policy.py).
+"""
+import numpy as np
+
+X_MIN = np.array([-0.5, -0.6, 0.0, -1., -1., -1., -1.])
+X_MAX = np.array([0.8, 0.7, 0.9, 1., 1., 1., 1.])
+
+def unit(q):
+    return q / np.linalg.norm(q)
@@ -0,0 +1,64 @@
+"""
+Tests of the Cholesky solves of the metrics against the CasADi pseudo-inverse (planner.Minv).
+"""
+from types import SimpleNamespace
+import numpy as np
+import casadi as ca
+from pumafabrics.tamed_puma.tamedpuma.combining_actions import solve_metric, solve_metric_batch, combine_fabrics_safeMP
+
+EPS = 1e-6
+
+def random_metrics(seed=2, dof=7):
+    """
+    Positive definite, singular positive semi-definite and indefinite metrics with forces
+    """
+    rng = np.random.default_rng(seed)
+    A = rng.normal(size=(dof, dof))
+    B = rng.normal(size=(dof, 3))
+    C = rng.normal(size=(dof, dof))
+    metrics = [A @ A.T + 0.1 * np.identity(dof), B @ B.T, C + C.T]
+    forces = [rng.normal(size=dof) for _ in metrics]
+    return metrics, forces
+
+def pinv_solve(M, f):
+    """
+    pinv(M + eps*I) f as planner.Minv, with the numpy pseudo-inverse (the CasADi one is inaccurate for the
+    ill-conditioned regularized singular metric)
+    """
+    return np.linalg.pinv(M + np.identity(len(M)) * EPS) @ f
+
+def test_solve_metric():
+    metrics, forces = random_metrics()
+    for M, f in zip(metrics, forces):
+        reference = pinv_solve(M, f)
+        np.testing.assert_allclose(solve_metric(M, f, eps=EPS), reference, rtol=1e-6, atol=1e-6 * np.abs(reference).max())
+    for i in [0, 2]:  # well-conditioned metrics: planner.Minv itself
+        reference = np.array(ca.pinv(metrics[i] + np.identity(len(metrics[i])) * EPS)) @ forces[i]
+        np.testing.assert_allclose(solve_metric(metrics[i], forces[i], eps=EPS), reference, rtol=1e-6, atol=1e-9)
+
+def test_solve_metric_batch():
+    metrics, forces = random_metrics()
+    for n_items in [2, 3]:  # positive (semi-)definite only, and with an indefinite metric (pinv fallback)
+        M, f = np.stack(metrics[:n_items]), np.stack(forces[:n_items])
+        solution = solve_metric_batch(M, f, eps=EPS)
+        for i in range(n_items):
+            reference = pinv_solve(M[i], f[i])
+            np.testing.assert_allclose(solution[i], reference, rtol=1e-6, atol=1e-6 * np.abs(reference).max())
+
+def test_combine_action():
+    metrics, forces = random_metrics(dof=2)
+    rng = np.random.default_rng(5)
+    combiner = combine_fabrics_safeMP(v_min=-np.ones(2), v_max=np.ones(2), acc_min=-50 * np.ones(2), acc_max=50 * np.ones(2))
+    M_avoidance, M_attractor = metrics[0], metrics[1]
+    f_avoidance, f_attractor = forces[0], forces[1]
+    xddot_speed, qdot = rng.normal(size=2), rng.normal(size=2) * 0.1
+    for mode in ["acc", "vel"]:
+        planner = SimpleNamespace(_mode=mode, _time_step=0.01)
+        xddot = -pinv_solve(M_avoidance + M_attractor, f_avoidance + f_attractor) + xddot_speed
+        reference = combiner.get_action_in_limits(qdot + planner._time_step * xddot if mode == "vel" else xddot, mode=mode)
+        action = combiner.combine_action(M_avoidance, M_attractor, f_avoidance, f_attractor, xddot_speed, planner, qdot=qdot)
+        np.testing.assert_allclose(action, reference, rtol=1e-6, atol=1e-8)
+        action_batch = combiner.combine_action_batch(np.stack([M_avoidance] * 2), np.stack([M_attractor] * 2),
+                                                     np.stack([f_avoidance] * 2), np.stack([f_attractor] * 2),
+                                                     np.stack([xddot_speed] * 2), planner, qdot=np.stack([qdot] * 2))
+        np.testing.assert_allclose(action_batch, np.stack([reference] * 2), rtol=1e-6, atol=1e-8)
@@ -0,0 +1,67 @@
+"""
+Tests of the prepared (flat-buffer) calls of the fabrics controller against the dictionary based calls (kuka iiwa14).
+"""
+import os
+import yaml
+import numpy as np
+from pumafabrics.tamed_puma.tamedpuma.fabrics_controller import FabricsController, DUMMY_OBSTACLE_POSITION, DUMMY_OBSTACLE_SIZE
+
+CONFIG_PATH = os.path.dirname(os.path.abspath(__file__)) + "/../pumafabrics/tamed_puma/config/kuka_TamedPUMA_tomato.yaml"
+
+def avoidance_controller():
+    with open(CONFIG_PATH, "r") as setup_stream:
+        params = yaml.safe_load(setup_stream)
+    fabrics_controller = FabricsController(params)
+    fabrics_controller.set_avoidance_planner(goal=None)
+    return fabrics_controller
+
+def test_prepared_call_keeps_argument_dictionary():
+    fabrics_controller = avoidance_controller()
+    funs = fabrics_controller.planner_avoidance._funs_avoidance
+    argument_dictionary = dict(funs._argument_dictionary)
+    fabrics_controller.planner_avoidance.prepare_call("_funs_avoidance", **fabrics_controller.static_arguments())
+    assert funs._argument_dictionary.keys() == argument_dictionary.keys()
+
+def test_prepared_avoidance_fewer_obstacles():
+    """
+    Fewer obstacles than slots: the unused slots are parked far away, as the dummy obstacles of the dictionary call
+    """
+    fabrics_controller = avoidance_controller()
+    prepared = fabrics_controller.prepared_avoidance
+    assert fabrics_controller.params["nr_obst"] == 2
+    np.testing.assert_allclose(prepared.buffers["x_obsts"], np.tile(DUMMY_OBSTACLE_POSITION, (2, 1)))
+    np.testing.assert_allclose(prepared.buffers["radius_obsts"], DUMMY_OBSTACLE_SIZE)
+
+    obstacle = {"position": np.array([0.5, 0.15, 0.05]), "size": np.array([0.05])}
+    fabrics_controller.set_obstacles_prepared(prepared, [obstacle])
+    np.testing.assert_allclose(prepared.buffers["x_obsts"][1], DUMMY_OBSTACLE_POSITION)
+    np.testing.assert_allclose(prepared.buffers["radius_obsts"][1], DUMMY_OBSTACLE_SIZE)
+
+    rng = np.random.default_rng(9)
+    q, qdot = rng.uniform(-1., 1., 7), rng.uniform(-0.5, 0.5, 7)
+    action, M, f, _ = fabrics_controller.compute_action_avoidance_prepared(q, qdot)
+    action, M, f = action.copy(), M.copy(), f.copy()
+    dummy_obstacle = {"position": np.array(DUMMY_OBSTACLE_POSITION), "size": np.array([DUMMY_OBSTACLE_SIZE])}
+    arguments = fabrics_controller.avoidance_arguments(q, qdot, [obstacle, dummy_obstacle])
+    planner = fabrics_controller.planner_avoidance
+    evaluations = planner.evaluate_batch(planner._funs_avoidance, [arguments])
+    np.testing.assert_allclose(action, evaluations["action"][0], rtol=1e-8, atol=1e-10)
+    np.testing.assert_allclose(M, evaluations["M"][0], rtol=1e-8, atol=1e-10)
+    np.testing.assert_allclose(f, evaluations["f"][0], rtol=1e-8, atol=1e-10)
+
+def test_prepared_avoidance_batch():
+    """
+    One casadi map over the rows of the batch buffer against the prepared call per robot, with obstacles per robot
+    """
+    fabrics_controller = avoidance_controller()
+    rng = np.random.default_rng(6)
+    q, qdot = rng.uniform(-1., 1., (3, 7)), rng.uniform(-0.5, 0.5, (3, 7))
+    obstacles_list = [[{"position": rng.uniform(0.3, 0.6, 3), "size": np.array([0.05])} for _ in range(n)] for n in [0, 1, 2]]
+    action, M, f, _ = fabrics_controller.compute_action_avoidance_batch(q, qdot, obstacles_list)
+    assert action.shape == (3, 7) and M.shape == (3, 7, 7) and f.shape == (3, 7)
+    for i in range(3):
+        fabrics_controller.set_obstacles_prepared(fabrics_controller.prepared_avoidance, obstacles_list[i])
+        action_i, M_i, f_i, _ = fabrics_controller.compute_action_avoidance_prepared(q[i], qdot[i])
+        np.testing.assert_allclose(action[i], action_i, rtol=1e-8, atol=1e-10)
+        np.testing.assert_allclose(M[i], M_i, rtol=1e-8, atol=1e-10)
+        np.testing.assert_allclose(f[i], f_i, rtol=1e-8, atol=1e-10)
@@ -0,0 +1,55 @@
+"""
+Tests of the geometry groups of the extended fabrics planner (point robot), against separate planners.
+"""
+import os
+import warnings
+import numpy as np
+import pytest
+from forwardkinematics.urdfFks.generic_urdf_fk import GenericURDFFk
+from mpscenes.goals.goal_composition import GoalComposition
+from pumafabrics.tamed_puma.tamedpuma.parametrized_planner_extended import ParameterizedFabricPlannerExtended
+
+URDF_PATH = os.path.dirname(os.path.abspath(__file__)) + "/../pumafabrics/tamed_puma/config/urdfs/point_robot.urdf"
+LIMITS = [[-8., 8.], [-9., 9.]]
+ARGUMENTS = dict(q=np.array([0.3, 0.5]), qdot=np.array([0.2, -0.4]),
+                 x_goal_0=np.array([-2.4, -7.5]), weight_goal_0=0.5,
+                 x_obst_0=np.array([-1., -2., 0.]), radius_obst_0=np.array([0.5]),
+                 x_obst_1=np.array([1., 2., 0.]), radius_obst_1=np.array([0.5]),
+                 radius_body_base_link_y=np.array([0.2]))
+
+def point_robot_goal():
+    goal_dict = {"subgoal0": {"weight": 0.5, "is_primary_goal": True, "indices": [0, 1], "parent_link": "world",
+                              "child_link": "base_link_y", "desired_position": [-2.4, -7.5], "epsilon": 0.1,
+                              "type": "staticSubGoal"}}
+    return GoalComposition(name="goal", content_dict=goal_dict)
+
+def point_robot_planner(**components):
+    with open(URDF_PATH, "r", encoding="utf-8") as file:
+        urdf = file.read()
+    forward_kinematics = GenericURDFFk(urdf, root_link="world", end_links=["base_link_y"])
+    planner = ParameterizedFabricPlannerExtended(2, forward_kinematics, time_step=0.01,
+                                                 collision_geometry="-2.0 / (x ** 1) * xdot ** 2",
+                                                 collision_finsler="2.0/(x**2) * (1 - ca.heaviside(xdot))* xdot**2")
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore")
+        planner.set_components(**components)
+        planner.concretize_extensive(mode="acc", time_step=0.01, extensive_concretize=True, bool_speed_control=True)
+    return planner
+
+@pytest.mark.parametrize("limits", [None, LIMITS])
+def test_geometry_groups(limits):
+    planner = point_robot_planner(collision_links=["base_link_y"], goal=point_robot_goal(), number_obstacles=2, limits=limits)
+    planner_goal = point_robot_planner(goal=point_robot_goal(), limits=limits)
+    planner_avoidance = point_robot_planner(collision_links=["base_link_y"], number_obstacles=2, limits=limits)
+    arguments_goal = {key: value for key, value in ARGUMENTS.items() if key in ("q", "qdot", "x_goal_0", "weight_goal_0")}
+    arguments_avoidance = {key: value for key, value in ARGUMENTS.items() if "goal" not in key}
+
+    action, groups = planner.compute_M_f_action_groups(**ARGUMENTS)
+    assert np.allclose(action, planner.compute_action(**ARGUMENTS))
+    references = {"full": planner.compute_M_f_action(**ARGUMENTS),
+                  "attractor": planner_goal.compute_M_f_action(**arguments_goal),
+                  "avoidance": planner_avoidance.compute_M_f_action_avoidance(**arguments_avoidance)}
+    for group, reference in references.items():
+        # M, f and action, xddot_speed is that of the full planner for all groups
+        for value, value_reference in zip(groups[group][:3], reference[:3]):
+            assert np.allclose(value, value_reference)
@@ -0,0 +1,100 @@
+"""
+Tests of the per-configuration kinematics frame (kuka iiwa14, double precision) against eager torch computations
+and finite differences.
+"""
+import numpy as np
+import torch
+from pumafabrics.tamed_puma.kinematics.kinematics_basics import KinematicsBasics
+from pumafabrics.tamed_puma.kinematics.kinematics_frame import KinematicsFrame
+
+def kinematics_float64():
+    kinematics = KinematicsBasics(end_link_name="iiwa_link_7", robot_name="iiwa14", root_link_name="iiwa_link_0")
+    kinematics.chain = kinematics.chain.to(dtype=torch.float64)
+    kinematics.frame = KinematicsFrame(kinematics.chain, kinematics.quaternion_operations)
+    return kinematics
+
+def random_configurations(n=5, seed=1):
+    rng = np.random.default_rng(seed)
+    return rng.uniform(-2., 2., size=(n, 7)), rng.uniform(-1., 1., size=(n, 7))
+
+def test_frame_cache():
+    kinematics = kinematics_float64()
+    frame = kinematics.frame
+    q, _ = random_configurations(n=2)
+    assert frame.update(q[0])
+    J = frame.jacobian()
+    assert not frame.update(q[0].copy())
+    assert frame.jacobian() is J
+    assert frame.update(q[1])
+    torch.testing.assert_close(frame.jacobian(), kinematics.chain.jacobian(q[1]))
+
+def test_factorization():
+    kinematics = kinematics_float64()
+    frame = kinematics.frame
+    for q in random_configurations()[0]:
+        frame.update(q)
+        J = kinematics.chain.jacobian(q)
+        J_pinv = torch.linalg.pinv(J)
+        torch.testing.assert_close(frame.pseudo_inverse(), J_pinv)
+        np.testing.assert_allclose(frame.nullspace_projector(), np.identity(7) - (J_pinv @ J)[0].numpy(), atol=1e-10)
+        np.testing.assert_allclose(frame.condition_number(), torch.linalg.cond(J[0]).item(), rtol=1e-8)
+
+        angle_quaternion = kinematics.forward_kinematics(q)[3:]
+        _, E_tot, _ = frame.quaternion_maps(angle_quaternion)
+        torch.testing.assert_close(frame.pseudo_inverse_quat(angle_quaternion), J_pinv @ torch.from_numpy(E_tot))
+
+def test_damped_pseudo_inverse():
+    kinematics = kinematics_float64()
+    frame = kinematics.frame
+    frame.damping = 0.05
+    q = random_configurations()[0][0]
+    frame.update(q)
+    J = kinematics.chain.jacobian(q)[0]
+    J_dls = J.T @ torch.linalg.inv(J @ J.T + frame.damping ** 2 * torch.eye(6, dtype=J.dtype))
+    torch.testing.assert_close(frame.pseudo_inverse()[0], J_dls)
+
+def test_jacobian_dot():
+    """
+    Analytic Jdot against the central difference of J along q + t qdot
+    """
+    kinematics = kinematics_float64()
+    frame = kinematics.frame
+    h = 1e-6
+    for q, qdot in zip(*random_configurations()):
+        frame.update(q)
+        Jdot = frame.jacobian_dot(qdot)
+        Jdot_fd = ((kinematics.chain.jacobian(q + h * qdot) - kinematics.chain.jacobian(q - h * qdot)) / (2 * h))[0].numpy()
+        np.testing.assert_allclose(Jdot, Jdot_fd, atol=1e-7)
+
+def test_jacobian_quat_dot():
+    """
+    Analytic derivative of J_quat = E_inv(quat) J against the central difference along q + t qdot
+    """
+    kinematics = kinematics_float64()
+    h = 1e-6
+
+    def J_quat(q):
+        angle_quaternion = kinematics.forward_kinematics(q)[3:]
+        return kinematics.diff_kinematics_quat(q, angle_quaternion), angle_quaternion
+
+    for q, qdot in zip(*random_configurations()):
+        J_quat_plus, quat_plus = J_quat(q + h * qdot)
+        J_quat_minus, quat_minus = J_quat(q - h * qdot)
+        assert np.linalg.norm(quat_plus - quat_minus) < 1e-3  # same hemisphere
+        _, angle_quaternion = J_quat(q)
+        Jdot_quat = kinematics.jacobian_quat_dot(qdot, angle_quaternion)
+        np.testing.assert_allclose(Jdot_quat, (J_quat_plus - J_quat_minus) / (2 * h), atol=1e-7)
+
+def test_jacobian_history():
+    """
+    Ring buffer of the Jacobians: chronological history and backward difference (float64 chain)
+    """
+    kinematics = kinematics_float64()
+    configurations, _ = random_configurations(n=kinematics.len_max_list + 3)
+    jacobians = []
+    for i, q in enumerate(configurations):
+        jacobians.append(kinematics.call_jacobian(q)[0].clone())
+        if i == 0:
+            torch.testing.assert_close(kinematics.Jacobian_grad, torch.zeros_like(jacobians[0]))
+    torch.testing.assert_close(kinematics.Jacobian_vec, torch.stack(jacobians[-kinematics.len_max_list:]))
+    torch.testing.assert_close(kinematics.Jacobian_grad, jacobians[-1] - jacobians[-2])
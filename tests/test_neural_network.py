@@ -0,0 +1,33 @@
+"""
+Tests of the primitive index cache of the neural network, in and out of inference mode.
+"""
+import torch
+from pumafabrics.puma_extension.agent.neural_network import NeuralNetwork
+
+def multi_motion_model():
+    torch.manual_seed(0)
+    return NeuralNetwork(dim_state=3, dynamical_system_order=1, n_primitives=2, multi_motion=True,
+                         latent_space_dim=4, neurons_hidden_layers=8)
+
+def test_primitive_index():
+    model = multi_motion_model()
+    primitive_type = torch.tensor([0., 1., 1.5, 5.])
+    torch.testing.assert_close(model.get_primitive_index(primitive_type), torch.tensor([0, 1, 2, 2]))
+    primitive_type[0] = 1.  # in place change: the cached index is not used
+    torch.testing.assert_close(model.get_primitive_index(primitive_type), torch.tensor([1, 1, 2, 2]))
+
+def test_primitive_index_inference_mode():
+    model = multi_motion_model()
+    with torch.inference_mode():
+        primitive_type_inference = torch.zeros(2)
+        model.get_primitive_index(primitive_type_inference)
+        model.get_primitive_index(primitive_type_inference)
+    model.get_primitive_index(primitive_type_inference)
+
+    # an index created in inference mode is not reused by autograd
+    primitive_type = torch.zeros(2)
+    with torch.inference_mode():
+        model.get_primitive_index(primitive_type)
+    goals_latent_space = torch.rand(3, 4, requires_grad=True)
+    model.get_goals_latent_space_batch(primitive_type, goals_latent_space).sum().backward()
+    torch.testing.assert_close(goals_latent_space.grad[0], torch.full((4,), 2.))
@@ -0,0 +1,49 @@
+"""
+Tests of the precomputed (affine) normalizations against the eager normalization functions.
+"""
+import copy
+import numpy as np
+import pytest
+import torch
+from pumafabrics.tamed_puma.utils.normalizations_2 import normalization_functions
+from pumafabrics.tamed_puma.utils.compiled_normalizations import CompiledNormalization, affine_normalization
+from helpers import X_MIN, X_MAX, unit
+
+def normalization_setup(mode_NN, seed=5):
+    rng = np.random.default_rng(seed)
+    normalizations = normalization_functions(x_min=X_MIN, x_max=X_MAX, dof_task=7, dt=0.02, mode_NN=mode_NN,
+                                             min_vel=rng.uniform(-0.2, -0.1, 7), max_vel=rng.uniform(0.1, 0.2, 7),
+                                             device="cpu")
+    offset_orientation = unit(rng.normal(size=4))
+    state_goal = np.append(rng.uniform(0., 0.5, 3), offset_orientation)
+    goal_NN = rng.uniform(-1., 1., 7)
+    _, translation_cpu = normalizations.translation_goal(state_goal=state_goal, goal_NN=goal_NN)
+    n_state = 7 if mode_NN == "1st" else 14
+    x_t = rng.normal(size=(1, n_state))
+    x_t[0, 3:7] = unit(x_t[0, 3:7])
+    return normalizations, translation_cpu, offset_orientation, x_t
+
+@pytest.mark.parametrize("mode_NN", ["1st", "2nd"])
+def test_affine_normalization(mode_NN):
+    normalizations, translation_cpu, offset_orientation, x_t = normalization_setup(mode_NN)
+    assert np.abs(translation_cpu).max() > 1e-3
+    x_ref = normalizations.normalize_state_to_NN(x_t=copy.deepcopy(x_t), translation_cpu=translation_cpu,
+                                                 offset_orientation=offset_orientation).numpy()
+    A, b = affine_normalization(normalizations, x_t.shape[1], translation_cpu, offset_orientation)
+    np.testing.assert_allclose(A @ x_t[0] + b, x_ref[0], atol=1e-5)
+
+@pytest.mark.parametrize("mode_NN", ["1st", "2nd"])
+def test_compiled_normalization(mode_NN):
+    normalizations, translation_cpu, offset_orientation, x_t = normalization_setup(mode_NN)
+    compiled = CompiledNormalization(copy.deepcopy(normalizations))
+    x_ref = normalizations.normalize_state_to_NN(x_t=copy.deepcopy(x_t), translation_cpu=translation_cpu,
+                                                 offset_orientation=offset_orientation)
+    x_first = compiled.normalize_state_to_NN(x_t=x_t, translation_cpu=translation_cpu,
+                                             offset_orientation=offset_orientation)
+    torch.testing.assert_close(x_first, x_ref, atol=1e-5, rtol=1e-5)
+
+    # the returned tensor is not overwritten by the next call
+    x_first_values = x_first.clone()
+    compiled.normalize_state_to_NN(x_t=x_t + 0.1, translation_cpu=translation_cpu,
+                                   offset_orientation=offset_orientation)
+    torch.testing.assert_close(x_first, x_first_values)
@@ -0,0 +1,56 @@
+"""
+Tests of the nearest-obstacle culling against a brute-force selection over all obstacles (kuka iiwa14).
+"""
+import os
+import numpy as np
+from forwardkinematics.urdfFks.generic_urdf_fk import GenericURDFFk
+from pumafabrics.tamed_puma.tamedpuma.obstacle_culling import ObstacleCulling
+
+URDF_PATH = os.path.dirname(os.path.abspath(__file__)) + "/../pumafabrics/tamed_puma/config/urdfs/iiwa14.urdf"
+COLLISION_LINKS = ["iiwa_link_3", "iiwa_link_4", "iiwa_link_5", "iiwa_link_6", "iiwa_link_7"]
+COLLISION_RADII = {3: 0.09, 4: 0.09, 5: 0.09, 6: 0.09, 7: 0.07}
+
+def obstacle_culling(n_slots, k_per_link):
+    with open(URDF_PATH, "r", encoding="utf-8") as file:
+        urdf = file.read()
+    forward_kinematics = GenericURDFFk(urdf, root_link="iiwa_link_0", end_links=["iiwa_link_7"])
+    return ObstacleCulling(forward_kinematics, collision_links=COLLISION_LINKS, collision_radii=COLLISION_RADII,
+                           n_slots=n_slots, k_per_link=k_per_link, parent_link="iiwa_link_0")
+
+def brute_force_selection(culling, q, positions, sizes, n_slots):
+    """
+    The n_slots obstacles with the smallest clearance to any collision link
+    """
+    link_positions = culling.distance_engine.link_positions(q, parent_link="iiwa_link_0")
+    clearances = np.min(culling.distance_engine.clearance_matrix(link_positions, positions, sizes), axis=0)
+    return np.argsort(clearances)[:n_slots]
+
+def test_obstacle_culling():
+    """
+    With equal sizes and k_per_link >= n_slots, the culled obstacles are the brute-force ones
+    """
+    rng = np.random.default_rng(11)
+    n_slots = 3
+    culling = obstacle_culling(n_slots=n_slots, k_per_link=n_slots)
+    positions = rng.uniform([-1., -1., 0.], [1., 1., 1.5], size=(2000, 3))
+    sizes = np.full(len(positions), 0.05)
+    culling.set_obstacle_arrays(positions, sizes)
+    for _ in range(5):
+        q = rng.uniform(-1.5, 1.5, 7)
+        x_obsts, radius_obsts = culling.select(q)
+        expected = brute_force_selection(culling, q, positions, sizes, n_slots)
+        assert set(culling.selected_indices) == set(expected)
+        np.testing.assert_allclose(np.sort(x_obsts, axis=0), np.sort(positions[expected], axis=0))
+        np.testing.assert_allclose(radius_obsts, sizes[expected])
+
+def test_obstacle_culling_padding():
+    """
+    Fewer obstacles than slots: the remaining slots get the dummy obstacle
+    """
+    culling = obstacle_culling(n_slots=4, k_per_link=2)
+    obstacles = [{"position": [0.5, 0., 0.5], "size": 0.1}, {"position": [-0.5, 0., 0.5], "size": 0.2}]
+    x_obsts, radius_obsts = culling.select(np.zeros(7), obstacles=obstacles)
+    assert set(culling.selected_indices) == {0, 1}
+    np.testing.assert_allclose(x_obsts[2:], np.tile(culling.dummy_position, (2, 1)))
+    np.testing.assert_allclose(radius_obsts[2:], culling.dummy_size)
+    np.testing.assert_allclose(np.sort(radius_obsts[:2]), [0.1, 0.2])
@@ -0,0 +1,52 @@
+"""
+Tests of the numpy quaternion kernels against spatialmath and pytorch_kinematics.
+"""
+import numpy as np
+import torch
+import pytorch_kinematics as pk
+from spatialmath import UnitQuaternion
+from pumafabrics.tamed_puma.kinematics import quaternions
+
+def random_quaternions(n=50, seed=3):
+    rng = np.random.default_rng(seed)
+    quat = rng.normal(size=(n, 4))
+    return quat / np.linalg.norm(quat, axis=1, keepdims=True)
+
+def test_quat_product():
+    p, q = random_quaternions(), random_quaternions(seed=4)
+    reference = np.array([np.append(p_i[0] * q_i[0] - p_i[1:] @ q_i[1:],
+                                    p_i[0] * q_i[1:] + q_i[0] * p_i[1:] + np.cross(p_i[1:], q_i[1:]))
+                          for p_i, q_i in zip(p, q)])
+    np.testing.assert_allclose(quaternions.quat_product(p, q), reference, atol=1e-12)
+    np.testing.assert_allclose(quaternions.quat_product(p[0], q[0]), reference[0], atol=1e-12)
+    np.testing.assert_allclose(np.einsum("nij,nj->ni", quaternions.quat_right_matrix(q), p), reference, atol=1e-12)
+
+def test_quat_unit_inverse_divide():
+    p, q = random_quaternions(), random_quaternions(seed=4)
+    for p_i, q_i in zip(p, q):
+        np.testing.assert_allclose(quaternions.quat_unit(3. * p_i), UnitQuaternion(p_i).A, atol=1e-12)
+        np.testing.assert_allclose(quaternions.quat_inverse(p_i), UnitQuaternion(p_i).inv().A, atol=1e-12)
+        np.testing.assert_allclose(quaternions.quat_divide(p_i, q_i), (UnitQuaternion(p_i) / UnitQuaternion(q_i)).A,
+                                   atol=1e-12)
+
+def test_quat_flip():
+    quat = random_quaternions()
+    quat_prev = quat + 0.01
+    quat[::2] *= -1
+    flipped = quaternions.quat_flip(quat, quat_prev)
+    np.testing.assert_allclose(flipped[::2], -quat[::2])
+    np.testing.assert_allclose(flipped[1::2], quat[1::2])
+
+def test_quat_matrix():
+    quat = random_quaternions()
+    reference = pk.quaternion_to_matrix(torch.tensor(quat)).numpy()
+    np.testing.assert_allclose(quaternions.quat_to_matrix(quat), reference, atol=1e-12)
+    np.testing.assert_allclose(quaternions.matrix_to_quat(reference),
+                               pk.matrix_to_quaternion(torch.tensor(reference)).numpy(), atol=1e-12)
+
+def test_map_angular_quat():
+    quat = random_quaternions()
+    H = quaternions.map_angular_quat(quat)
+    q0, q1, q2, q3 = quat[0]
+    np.testing.assert_allclose(H[0], np.array([[-q1, q0, -q3, q2], [-q2, q3, q0, -q1], [-q3, -q2, q1, q0]]))
+    np.testing.assert_allclose(quaternions.map_angular_quat(quat[0]), H[0])
@@ -0,0 +1,70 @@
+"""
+Tests of the raw-units policy against normalize_state_to_NN -> transition -> rescaling (euclidean_sphere, untrained network).
+"""
+import copy
+import numpy as np
+import pytest
+import torch
+from pumafabrics.puma_extension.agent.neural_network import NeuralNetwork
+from pumafabrics.puma_extension.agent.dynamical_system import DynamicalSystem
+from pumafabrics.tamed_puma.utils.normalizations_2 import normalization_functions
+from pumafabrics.tamed_puma.kinematics.quaternions import quat_product
+from pumafabrics.tamed_puma.tamedpuma.raw_units_policy import RawUnitsPolicy
+from helpers import X_MIN, X_MAX, unit
+
+DT = 0.02
+
+def dynamical_system_and_normalizations(order, rng):
+    torch.manual_seed(0)
+    dim_state = 7 * order
+    model = NeuralNetwork(dim_state=dim_state, dynamical_system_order=order, n_primitives=1, multi_motion=False,
+                          latent_space_dim=16, neurons_hidden_layers=16)
+    model.eval()
+    min_vel, max_vel = rng.uniform(-0.2, -0.1, 7), rng.uniform(0.1, 0.2, 7)
+    min_acc, max_acc = rng.uniform(-0.05, -0.02, 7), rng.uniform(0.02, 0.05, 7)
+    to_tensor = lambda x: torch.tensor(x, dtype=torch.float32).reshape(1, 7)
+    dynamical_system = DynamicalSystem(x_init=torch.zeros(1, dim_state), space='euclidean_sphere', order=order,
+                                       min_state_derivative=[to_tensor(min_vel), to_tensor(min_acc) if order == 2 else None],
+                                       max_state_derivative=[to_tensor(max_vel), to_tensor(max_acc) if order == 2 else None],
+                                       saturate_transition=False, primitive_type=torch.FloatTensor([1]), model=model,
+                                       dim_state=dim_state, delta_t=1, x_min=-np.ones(dim_state), x_max=np.ones(dim_state),
+                                       radius=None)
+    normalizations = normalization_functions(x_min=X_MIN, x_max=X_MAX, dof_task=7, dt=DT, mode_NN="1st" if order == 1 else "2nd",
+                                             min_vel=min_vel, max_vel=max_vel, device="cpu")
+    return dynamical_system, normalizations
+
+def rescale(action_gpu, offset_orientation, normalizations, mode_NN):
+    """
+    vel_NN_rescale / acc_NN_rescale of PUMAControl (position and quaternion part)
+    """
+    action = normalizations.reverse_transformation(action_gpu=action_gpu, mode_NN=mode_NN)
+    return np.append(action[:3], quat_product(action[3:], offset_orientation))
+
+@pytest.mark.parametrize("mode_NN", ["1st", "2nd"])
+def test_raw_units_policy(mode_NN):
+    order = 1 if mode_NN == "1st" else 2
+    rng = np.random.default_rng(7)
+    dynamical_system, normalizations = dynamical_system_and_normalizations(order, rng)
+    policy = RawUnitsPolicy(dynamical_system, normalizations)
+    for trial in range(3):
+        offset_orientation = unit(rng.normal(size=4))
+        state_goal = np.append(rng.uniform(0., 0.5, 3), offset_orientation)
+        _, translation_cpu = normalizations.translation_goal(state_goal=state_goal, goal_NN=rng.uniform(-0.5, 0.5, 7))
+        x_t = rng.normal(size=(1, 7 * order)) * 0.1
+        x_t[0, :3] += 0.3
+        x_t[0, 3:7] = unit(rng.normal(size=4))
+
+        with torch.no_grad():
+            x_NN = normalizations.normalize_state_to_NN(x_t=copy.deepcopy(x_t), translation_cpu=translation_cpu,
+                                                        offset_orientation=offset_orientation)
+            transition_info = dynamical_system.transition(x_t=x_NN[:, :7 * order].clone())
+            transition_raw = policy.transition(x_t, translation_cpu, offset_orientation)
+
+        velocity = rescale(transition_info["desired velocity"], offset_orientation, normalizations, "1st")
+        np.testing.assert_allclose(transition_raw["desired velocity"][0].numpy(), velocity,
+                                   atol=1e-4 * np.abs(velocity).max())
+        torch.testing.assert_close(transition_raw["latent state"], transition_info["latent state"], atol=1e-5, rtol=1e-5)
+        if order == 2:
+            acceleration = rescale(transition_info["desired acceleration"], offset_orientation, normalizations, "2nd")
+            np.testing.assert_allclose(transition_raw["desired acceleration"][0].numpy(), acceleration,
+                                       atol=1e-4 * np.abs(acceleration).max())